@@ -248,59 +248,7 @@ class SNA_OT_Dgs__Import_Ply_As_Splats_8458E(bpy.types.Operator, ImportHelper):
         ply_import_path = self.filepath
         import numpy as np
         import os
-        try:
-            from plyfile import PlyData
-        except ImportError:
-            print("plyfile is not installed. Please install it to use this feature.")
-            PlyData = None
-        class PlyInfo:
-
-            def __init__(self, filepath: str):
-                self.loadPly(filepath)
-
-            def loadPly(self, filepath: str):
-                plydata = PlyData.read(filepath)
-                self.center = np.stack((np.asarray(plydata.elements[0]["x"]),
-                                        np.asarray(plydata.elements[0]["y"]),
-                                        np.asarray(plydata.elements[0]["z"])), axis=1)
-                self.splat_count = int(len(self.center))
-                N = self.splat_count
-                if 'opacity' in plydata.elements[0]:
-                    log_opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
-                    self.opacities = 1 / (1 + np.exp(-log_opacities))
-                else:
-                    log_opacities = np.asarray(1)[..., np.newaxis]
-                    self.opacities = 1 / (1 + np.exp(-log_opacities))
-                self.opacities = self.opacities.flatten()
-                self.features_dc = np.zeros((N, 3, 1))
-                self.features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-                self.features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-                self.features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
-                # V2 Update - V4 Remove f names
-                log_scales = np.stack((np.asarray(plydata.elements[0]["scale_0"]),
-                                       np.asarray(plydata.elements[0]["scale_1"]),
-                                       np.asarray(plydata.elements[0]["scale_2"])), axis=1)
-                self.scales = np.exp(log_scales)
-                self.quats = np.stack((np.asarray(plydata.elements[0]["rot_0"]),
-                                       np.asarray(plydata.elements[0]["rot_1"]),
-                                       np.asarray(plydata.elements[0]["rot_2"]),
-                                       np.asarray(plydata.elements[0]["rot_3"])), axis=1)
-
-        def RS_matrix(quat: np.ndarray, scale: np.ndarray) -> list[float]:
-            length = 1 / math.sqrt(quat[0] * quat[0] + quat[1] * quat[1] + quat[2] * quat[2] + quat[3] * quat[3])
-            x, y, z, w = quat[0] * length, quat[1] * length, quat[2] * length, quat[3] * length
-            matrix = [
-                scale[0] * (1 - 2 * (z * z + w * w)),
-                scale[0] * (2 * (y * z + x * w)),
-                scale[0] * (2 * (y * w - x * z)),
-                scale[1] * (2 * (y * z - x * w)),
-                scale[1] * (1 - 2 * (y * y + w * w)),
-                scale[1] * (2 * (z * w + x * y)),
-                scale[2] * (2 * (y * w + x * z)),
-                scale[2] * (2 * (z * w - x * y)),
-                scale[2] * (1 - 2 * (y * y + z * z))
-            ]
-            return matrix
+        from splat_mesh import face_attributes, load_splats, splat_quads
 
         def calculate_bounding_box(centers):
             bound_min = np.min(centers, axis=0)
@@ -313,75 +261,33 @@ class SNA_OT_Dgs__Import_Ply_As_Splats_8458E(bpy.types.Operator, ImportHelper):
             if not os.path.exists(ply_import_path):
                 print(f"Error: File not found at path: {ply_import_path}")
             else:
-                plyInfo = PlyInfo(ply_import_path)
+                # Vectorized over the splats (`splat_mesh.py`), instead of per-splat Python lists
+                splats = load_splats(ply_import_path)
+                splat_count = len(splats["center"])
                 file_base_name = os.path.splitext(os.path.basename(ply_import_path))[0]
                 object_name = f"{file_base_name}"
-                vertices = []
-                indices = []
-                for i in range(plyInfo.splat_count):
-                    vertices.append((-2.0, -2.0, float(i)))
-                    vertices.append((2.0, -2.0, float(i)))
-                    vertices.append((2.0, 2.0, float(i)))
-                    vertices.append((-2.0, 2.0, float(i)))
-                    b = i * 4
-                    indices.append((b, b+1, b+2))
-                    indices.append((b, b+2, b+3))
+                vertices, triangles = splat_quads(splat_count)
                 mesh = bpy.data.meshes.new(name=object_name)
-                mesh.from_pydata(vertices, [], indices)
+                mesh.vertices.add(len(vertices))
+                mesh.vertices.foreach_set("co", vertices.reshape(-1))
+                mesh.loops.add(triangles.size)
+                mesh.loops.foreach_set("vertex_index", triangles.reshape(-1))
+                mesh.polygons.add(len(triangles))
+                mesh.polygons.foreach_set("loop_start", np.arange(0, triangles.size, 3, dtype=np.int32))
+                if bpy.app.version < (4, 0, 0):
+                    mesh.polygons.foreach_set("loop_total", np.full(len(triangles), 3, dtype=np.int32))
+                mesh.update(calc_edges=True)
                 obj = bpy.data.objects.new(object_name, mesh)
-                Vrk_1 = [0.0] * plyInfo.splat_count * 2 * 1 
-                Vrk_2 = [0.0] * plyInfo.splat_count * 2 * 1
-                Vrk_3 = [0.0] * plyInfo.splat_count * 2 * 1
-                Vrk_4 = [0.0] * plyInfo.splat_count * 2 * 1
-                Vrk_5 = [0.0] * plyInfo.splat_count * 2 * 1
-                Vrk_6 = [0.0] * plyInfo.splat_count * 2 * 1
-                center = [0.0] * plyInfo.splat_count * 2 * 3 
-                color = [0.0] * plyInfo.splat_count * 2 * 4 
-                SH_0 = 0.28209479177387814
-                for i in range(plyInfo.splat_count):
-                    RS = RS_matrix(plyInfo.quats[i], plyInfo.scales[i])
-                    Vrk_1[2 * i + 0] = Vrk_1[2 * i + 1] = RS[0] * RS[0] + RS[3] * RS[3] + RS[6] * RS[6]
-                    Vrk_2[2 * i + 0] = Vrk_2[2 * i + 1] = RS[0] * RS[1] + RS[3] * RS[4] + RS[6] * RS[7]
-                    Vrk_3[2 * i + 0] = Vrk_3[2 * i + 1] = RS[0] * RS[2] + RS[3] * RS[5] + RS[6] * RS[8]
-                    Vrk_4[2 * i + 0] = Vrk_4[2 * i + 1] = RS[1] * RS[1] + RS[4] * RS[4] + RS[7] * RS[7]
-                    Vrk_5[2 * i + 0] = Vrk_5[2 * i + 1] = RS[1] * RS[2] + RS[4] * RS[5] + RS[7] * RS[8]
-                    Vrk_6[2 * i + 0] = Vrk_6[2 * i + 1] = RS[2] * RS[2] + RS[5] * RS[5] + RS[8] * RS[8]
-                    center[6 * i + 0] = center[6 * i + 3] = plyInfo.center[i][0]
-                    center[6 * i + 1] = center[6 * i + 4] = plyInfo.center[i][1]
-                    center[6 * i + 2] = center[6 * i + 5] = plyInfo.center[i][2]
-                    R = (plyInfo.features_dc[i][0][0] * SH_0 + 0.5)
-                    G = (plyInfo.features_dc[i][1][0] * SH_0 + 0.5)
-                    B = (plyInfo.features_dc[i][2][0] * SH_0 + 0.5)
-                    A = plyInfo.opacities[i]
-                    color[8 * i + 0] = color[8 * i + 4] = R
-                    color[8 * i + 1] = color[8 * i + 5] = G
-                    color[8 * i + 2] = color[8 * i + 6] = B
-                    color[8 * i + 3] = color[8 * i + 7] = A
-                center_attr = mesh.attributes.new(name="center", type='FLOAT_VECTOR', domain='FACE')
-                center_attr.data.foreach_set("vector", center)
-                color_attr = mesh.attributes.new(name="color", type='FLOAT_COLOR', domain='FACE')
-                color_attr.data.foreach_set("color", color)
-                Vrk_1_attr = mesh.attributes.new(name="Vrk_1", type='FLOAT', domain='FACE')
-                Vrk_1_attr.data.foreach_set("value", Vrk_1)
-                Vrk_2_attr = mesh.attributes.new(name="Vrk_2", type='FLOAT', domain='FACE')
-                Vrk_2_attr.data.foreach_set("value", Vrk_2)
-                Vrk_3_attr = mesh.attributes.new(name="Vrk_3", type='FLOAT', domain='FACE')
-                Vrk_3_attr.data.foreach_set("value", Vrk_3)
-                Vrk_4_attr = mesh.attributes.new(name="Vrk_4", type='FLOAT', domain='FACE')
-                Vrk_4_attr.data.foreach_set("value", Vrk_4)
-                Vrk_5_attr = mesh.attributes.new(name="Vrk_5", type='FLOAT', domain='FACE')
-                Vrk_5_attr.data.foreach_set("value", Vrk_5)
-                Vrk_6_attr = mesh.attributes.new(name="Vrk_6", type='FLOAT', domain='FACE')
-                Vrk_6_attr.data.foreach_set("value", Vrk_6)
-                # Sort indices V 2.1
-                sorted_indices = np.arange(plyInfo.splat_count, dtype=np.int32)
-                sorted_indices_attr = mesh.attributes.new(name="sorted_indices", type='INT', domain='FACE')
-                sorted_indices_attr.data.foreach_set("value", np.repeat(sorted_indices, 2))
+                attribute_types = {"center": ('FLOAT_VECTOR', "vector"), "color": ('FLOAT_COLOR', "color"), "sorted_indices": ('INT', "value")}
+                for name, values in face_attributes(splats).items():
+                    attribute_type, key = attribute_types.get(name, ('FLOAT', "value"))
+                    attribute = mesh.attributes.new(name=name, type=attribute_type, domain='FACE')
+                    attribute.data.foreach_set(key, values)
                 # Add custom properties
                 obj['update_rot_to_cam'] = True
                 obj['camera_position'] = (0, 0, 0)
                 obj['camera_direction'] = (0, 0, -1)
-                bound_min, bound_max = calculate_bounding_box(plyInfo.center)
+                bound_min, bound_max = calculate_bounding_box(splats["center"])
                 obj['bound_min'] = bound_min
                 obj['bound_max'] = bound_max
                 node_group = bpy.data.node_groups['KIRI_3DGS_Render_GN']
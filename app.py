@@ -1,5 +1,6 @@
 import spaces  # isort:skip
 import contextlib
+import functools
 import gc
 import os
 import sys
@@ -19,7 +20,32 @@ from pytorch3d.transforms import Transform3d
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-from model import PCAE
+from blender_worker import BlenderWorkerError, BlenderWorkerPool
+from export import EXPORT_DIR, EXPORT_FORMATS, compile_model, load_exported
+from gs_io import GaussianSplats, skin_gs
+from handoff import handoff_file, save_handoff
+from inference import (
+    BatchScheduler,
+    ChunkPlanner,
+    SharedEncoder,
+    knn_interpolate,
+    quantize_dynamic,
+    share_frozen_modules,
+    unique_rows,
+)
+from model import LatentContext, PCAE
+from pipeline import Stage, StagePipeline
+from rig_cache import RigCache, file_digest, register_type
+from sampling import MeshSampler
+from skinning import (
+    SparseWeights,
+    bone_weights,
+    lbs_points,
+    map_weights,
+    pack_weights,
+    reorganize_weights,
+    to_sparse,
+)
 from util.dataset_mixamo import (
     BONES_IDX_DICT,
     JOINTS_NUM,
@@ -39,12 +65,10 @@ from util.utils import (
     apply_transform,
     fix_random,
     get_normalize_transform,
-    load_gs,
     make_archive,
     pose_local_to_global,
     pose_rot_to_global,
     sample_mesh,
-    save_gs,
     str2bool,
     str2list,
     to_pose_local,
@@ -103,13 +127,20 @@ gradio.helpers.log_message = _log_message
 
 
 cmap = matplotlib.colormaps.get_cmap("plasma")
+# Stage outputs stored on disk by `RigCache` besides arrays & meshes
+register_type(Transform3d, lambda t: t.get_matrix(), lambda matrix: Transform3d(matrix=matrix))
+register_type(SparseWeights, tuple, lambda x: SparseWeights(*x))
+register_type(GaussianSplats, GaussianSplats.state, GaussianSplats.from_state)
+# "cached" for `MeshSampler`, "util" for `util.utils.sample_mesh`
+MESH_SAMPLER = os.getenv("MESH_SAMPLER", "util")
+assert MESH_SAMPLER in ("util", "cached"), f"Unknown mesh sampler: {MESH_SAMPLER}"
 
 
 @dataclass()
 class DB:
     mesh: trimesh.Trimesh = None
-    gs: torch.Tensor = None
-    gs_rest: torch.Tensor = None
+    gs: GaussianSplats = None
+    gs_rest: GaussianSplats = None
     is_mesh: bool = None
     sample_mask: np.ndarray = None
     verts: torch.Tensor = None
@@ -117,6 +148,7 @@ class DB:
     faces: np.ndarray = None
     pts: torch.Tensor = None
     pts_normal: torch.Tensor = None
+    sampler: MeshSampler = None  # tables of `db.mesh` in its input coordinates, for every sampling pass
     global_transform: Transform3d = None
 
     output_dir: str = None
@@ -130,11 +162,13 @@ class DB:
     anim_path: str = None
     anim_vis_path: str = None
 
-    bw: torch.Tensor = None
+    bw: torch.Tensor | SparseWeights = None
     joints: torch.Tensor = None
     joints_tail: torch.Tensor = None
     pose: torch.Tensor = None
 
+    stages: dict[str, tuple[str, dict]] = None  # memo of `StagePipeline.run`
+
     def clear(self):
         for k in self.__dict__:
             self.__dict__[k] = None
@@ -150,6 +184,23 @@ def clear(db: DB = None):
     return db
 
 
+def get_conflict_table(fn1, fn2, bones_idx_dict: dict[str, int]):
+    """
+    Args:
+        fn1: fn(str) -> bool. Values of `bones_idx_dict` will be appended to `idx1` if `fn1(key) == True`
+        fn2: fn(str) -> bool. Values of `bones_idx_dict` will be appended to `idx2` if `fn2(key) == True`
+    Returns:
+        table: (`len(bones_idx_dict)`, `len(bones_idx_dict)`) Boolean table.
+        `table[i, j] == True` if `i in idx1` and `j in idx2`.
+    """
+    mask1 = torch.zeros(len(bones_idx_dict), dtype=torch.bool)
+    mask2 = torch.zeros(len(bones_idx_dict), dtype=torch.bool)
+    for k, v in bones_idx_dict.items():
+        mask1[v] |= bool(fn1(k))
+        mask2[v] |= bool(fn2(k))
+    return mask1.unsqueeze(-1) & mask2
+
+
 def get_conflict_mask(dominant_idx: torch.Tensor, fn1, fn2, bones_idx_dict: dict[str, int]):
     """
     Args:
@@ -160,78 +211,48 @@ def get_conflict_mask(dominant_idx: torch.Tensor, fn1, fn2, bones_idx_dict: dict
         mask: (B, N, `len(bones_idx_dict)`) Boolean mask.
         `mask[..., i] == True` if `dominant_idx[...] in idx1` and `i in idx2`.
     """
-    idx1 = torch.tensor(tuple(v for k, v in bones_idx_dict.items() if fn1(k))).to(dominant_idx)
-    idx2 = torch.tensor(tuple(v for k, v in bones_idx_dict.items() if fn2(k))).to(dominant_idx)
-    mask2 = torch.isin(torch.arange(len(bones_idx_dict), device=dominant_idx.device), idx2)
-    pts_mask1 = torch.isin(dominant_idx, idx1).unsqueeze(-1).expand([*dominant_idx.shape, len(bones_idx_dict)]).clone()
-    pts_mask1[:, :, ~mask2] = False
-    return pts_mask1
-
-
-def bw_post_process(
-    bw: torch.Tensor,
-    bones_idx_dict: dict[str, int],
-    above_head_mask: torch.Tensor = None,
-    above_ear_mask_left: torch.Tensor = None,
-    above_ear_mask_right: torch.Tensor = None,
-    tail_mask: torch.Tensor = None,
-    no_fingers=False,
-):
+    return get_conflict_table(fn1, fn2, bones_idx_dict).to(dominant_idx.device)[dominant_idx]
 
-    def _edit_bw(
-        mask: torch.Tensor, bw: torch.Tensor, bones_idx_dict: dict[str, int], target_bone_name: str, value=1e5
-    ):
-        mask = mask.unsqueeze(-1).tile(bw.shape[-1])
-        head_bone_mask = torch.zeros_like(mask)
-        head_bone_mask[..., bones_idx_dict[f"{MIXAMO_PREFIX}{target_bone_name}"]] = True
-        mask &= head_bone_mask
-        bw[mask] = value
-        return bw
-
-    """bw: (B, N, `len(bones_idx_dict)`)"""
-    assert bw.shape[-1] == len(bones_idx_dict)
 
-    if above_head_mask is not None and all("Ear" not in b for b in bones_idx_dict):
-        bw = _edit_bw(above_head_mask, bw, bones_idx_dict, "Head")
-    if any("Ear" in b for b in bones_idx_dict):
-        if above_ear_mask_left is not None:
-            bw = _edit_bw(above_ear_mask_left, bw, bones_idx_dict, "LRabbitEar2", value=1.0)
-        if above_ear_mask_right is not None:
-            bw = _edit_bw(above_ear_mask_right, bw, bones_idx_dict, "RRabbitEar2", value=1.0)
-    if tail_mask is not None and all("Tail" not in b for b in bones_idx_dict):
-        bw = _edit_bw(tail_mask, bw, bones_idx_dict, "Spine")
+@functools.lru_cache(maxsize=None)
+def get_bw_post_process_tables(bones: tuple[tuple[str, int], ...], no_fingers=False):
+    """Conflict tables of `bw_post_process`, built once per `bones_idx_dict` & `no_fingers`
+    Args:
+        bones: `tuple(bones_idx_dict.items())`
+    Returns:
+        hand_table: (K, K) bool. If `no_fingers`, `bw[..., j] = 1e5` for points dominated by `i` if `hand_table[i, j]`
+        finger_mask: (K,) bool. If `no_fingers`, `bw[..., finger_mask] = 0` afterwards
+        conflict_table: (K, K) bool. `bw[..., j] = 0` for points dominated by `i` if `conflict_table[i, j]`
+    """
+    bones_idx_dict = dict(bones)
+    K = len(bones_idx_dict)
 
     hands = {"Left", "Right"}
     fingers = {"Thumb", "Index", "Middle", "Ring", "Pinky"}
+    hand_table = torch.zeros((K, K), dtype=torch.bool)
+    finger_mask = torch.zeros(K, dtype=torch.bool)
     if no_fingers:
-        dominant_idx = torch.argmax(bw, dim=-1)
         for hand in hands:
-            bw[
-                get_conflict_mask(
-                    dominant_idx,
-                    lambda k: hand in k and any(x in k for x in fingers),
-                    lambda k: k.endswith(f"{hand}Hand"),
-                    bones_idx_dict,
-                )
-            ] = 1e5
-        bw[get_conflict_mask(dominant_idx, lambda k: True, lambda k: any(x in k for x in fingers), bones_idx_dict)] = 0
+            hand_table |= get_conflict_table(
+                lambda k: hand in k and any(x in k for x in fingers),
+                lambda k: k.endswith(f"{hand}Hand"),
+                bones_idx_dict,
+            )
+        finger_mask = get_conflict_table(lambda k: True, lambda k: any(x in k for x in fingers), bones_idx_dict)[0]
 
     # Refine points dominated by conflict (mutually exclusive) joints (left & right limbs, different fingers)
-    dominant_idx = torch.argmax(bw, dim=-1)
+    conflict_table = torch.zeros((K, K), dtype=torch.bool)
     if not no_fingers:
         for hand in hands:
             other_hand = next(iter((hands - {hand})))
-            bw[get_conflict_mask(dominant_idx, lambda k: hand in k, lambda k: other_hand in k, bones_idx_dict)] = 0
+            conflict_table |= get_conflict_table(lambda k: hand in k, lambda k: other_hand in k, bones_idx_dict)
             for finger in fingers:
                 other_fingers = fingers - {finger}
-                bw[
-                    get_conflict_mask(
-                        dominant_idx,
-                        lambda k: hand in k and finger in k,
-                        lambda k: hand in k and any(x in k for x in other_fingers),
-                        bones_idx_dict,
-                    )
-                ] = 0
+                conflict_table |= get_conflict_table(
+                    lambda k: hand in k and finger in k,
+                    lambda k: hand in k and any(x in k for x in other_fingers),
+                    bones_idx_dict,
+                )
 
     conflict_sets = (
         {
@@ -343,22 +364,87 @@ def bw_post_process(
     for conflict_parts in conflict_sets:
         for part in conflict_parts:
             other_parts = conflict_parts - {part}
-            bw[
-                get_conflict_mask(
-                    dominant_idx,
-                    lambda k: any(x in k for x in part),
-                    lambda k: any(any(x in k for x in p) for p in other_parts),
-                    bones_idx_dict,
-                )
-            ] = 0
+            conflict_table |= get_conflict_table(
+                lambda k: any(x in k for x in part),
+                lambda k: any(any(x in k for x in p) for p in other_parts),
+                bones_idx_dict,
+            )
+
+    return hand_table, finger_mask, conflict_table
+
+
+def bw_post_process(
+    bw: torch.Tensor,
+    bones_idx_dict: dict[str, int],
+    above_head_mask: torch.Tensor = None,
+    above_ear_mask_left: torch.Tensor = None,
+    above_ear_mask_right: torch.Tensor = None,
+    tail_mask: torch.Tensor = None,
+    no_fingers=False,
+    chunk_size=65536,
+    return_sparse=False,
+):
+    """
+    Args:
+        bw: (B, N, `len(bones_idx_dict)`), not modified
+        *_mask: (B, N) bool
+        chunk_size: number of points processed at a time
+        return_sparse: return the kept top-4 weights as `SparseWeights` instead of a dense tensor
+    Returns:
+        (B, N, `len(bones_idx_dict)`) or `SparseWeights` with (B, N, 4) indices & weights
+    """
+    assert bw.shape[-1] == len(bones_idx_dict)
+    hand_table, finger_mask, conflict_table = (
+        x.to(bw.device) for x in get_bw_post_process_tables(tuple(bones_idx_dict.items()), no_fingers)
+    )
+
+    # (mask, bone, value): set `bw[..., bone]` to `value` for points in `mask`
+    edits: list[tuple[torch.Tensor, str, float]] = []
+    if above_head_mask is not None and all("Ear" not in b for b in bones_idx_dict):
+        edits.append((above_head_mask, "Head", 1e5))
+    if any("Ear" in b for b in bones_idx_dict):
+        if above_ear_mask_left is not None:
+            edits.append((above_ear_mask_left, "LRabbitEar2", 1.0))
+        if above_ear_mask_right is not None:
+            edits.append((above_ear_mask_right, "RRabbitEar2", 1.0))
+    if tail_mask is not None and all("Tail" not in b for b in bones_idx_dict):
+        edits.append((tail_mask, "Spine", 1e5))
 
-    bw = bw / (bw.sum(dim=-1, keepdim=True) + 1e-10)
-    # Only keep weights from the largest-weighted joints
-    # bw[bw < 1e-4] = 0
     joints_per_point = 4
-    thresholds = torch.topk(bw, k=joints_per_point, dim=-1, sorted=True).values[..., -1:]
-    bw[bw < thresholds] = 0
-    return bw
+    if return_sparse:
+        bw_out = SparseWeights(
+            torch.empty((*bw.shape[:-1], joints_per_point), dtype=torch.int16, device=bw.device),
+            torch.empty((*bw.shape[:-1], joints_per_point), dtype=bw.dtype, device=bw.device),
+            bw.shape[-1],
+        )
+    else:
+        bw_out = torch.empty_like(bw)
+    for begin in range(0, bw.shape[-2], chunk_size):
+        chunk = slice(begin, begin + chunk_size)
+        bw_ = bw[:, chunk].clone()
+        for mask, bone_name, value in edits:
+            bw_[..., bones_idx_dict[f"{MIXAMO_PREFIX}{bone_name}"]].masked_fill_(mask[:, chunk], value)
+
+        if no_fingers:
+            dominant_idx = torch.argmax(bw_, dim=-1)
+            bw_.masked_fill_(hand_table[dominant_idx], 1e5)
+            bw_[..., finger_mask] = 0
+
+        dominant_idx = torch.argmax(bw_, dim=-1)
+        bw_.masked_fill_(conflict_table[dominant_idx], 0)
+
+        bw_ = bw_ / (bw_.sum(dim=-1, keepdim=True) + 1e-10)
+        # Only keep weights from the largest-weighted joints
+        # bw_[bw_ < 1e-4] = 0
+        if return_sparse:
+            bw_ = to_sparse(bw_, k=joints_per_point)
+            bw_out.indices[:, chunk] = bw_.indices
+            bw_out.weights[:, chunk] = bw_.weights
+            continue
+        thresholds = torch.topk(bw_, k=joints_per_point, dim=-1, sorted=True).values[..., -1:]
+        bw_[bw_ < thresholds] = 0
+        bw_out[:, chunk] = bw_
+    return bw_out
 
 
 def reorganize_bone_data_(
@@ -395,21 +481,22 @@ def reorganize_bone_data_(
     return new_data
 
 
-def vis_weights(verts: np.ndarray, weights: np.ndarray, faces: np.ndarray, vis_bone_index: int):
+def vis_weights(verts: np.ndarray, weights: np.ndarray | SparseWeights, faces: np.ndarray, vis_bone_index: int):
     if isinstance(verts, torch.Tensor):
         verts = verts.cpu().numpy()
     if len(verts.shape) == 3:
         verts = verts[0]
+    weights = bone_weights(weights, vis_bone_index)
     if isinstance(weights, torch.Tensor):
         weights = weights.cpu().numpy()
-    if len(weights.shape) == 3:
+    if len(weights.shape) == 2:
         weights = weights[0]
     assert all(x is None or isinstance(x, np.ndarray) for x in (verts, weights, faces))
-    assert all(x is None or len(x.shape) == 2 for x in (verts, weights, faces))
+    assert all(x is None or len(x.shape) == 2 for x in (verts, faces))
     assert verts.shape[0] == weights.shape[0]
     assert faces is None or verts.shape[1] == faces.shape[1] == 3
     # assert weights.shape[1] == len(BONES_IDX_DICT)
-    colors = cmap(weights[:, vis_bone_index])[:, :3]
+    colors = cmap(weights)[:, :3]
     if faces is None:
         mesh = trimesh.PointCloud(verts, process=False, colors=colors)
     else:
@@ -519,7 +606,7 @@ def ply2visible(ply_path: str, is_gs=False):
     if not ply_path.endswith(".ply") or is_gs:
         return change_Model3D(ply_path, is_pc=False)
     with contextlib.suppress(Exception):
-        load_gs(ply_path)
+        GaussianSplats(ply_path)
         gr.Warning("The input file seems to be Gaussian Splats, enable 'Input is GS' to display it")
     mesh = trimesh.load(ply_path, process=False, maintain_order=True)
     is_pc = isinstance(mesh, trimesh.PointCloud)
@@ -540,32 +627,64 @@ def get_masked_mesh(mesh: trimesh.Trimesh, mask: np.ndarray):
     return mesh
 
 
-def prepare_input(input_path: str, is_gs=False, opacity_threshold=0.0, db: DB = None, export_temp=False):
+def resolve_input_path(input_path: str):
     if not (input_path and os.path.isfile(input_path)):
         raise gr.Error(f"Input file not found: '{input_path}', please re-upload the file")
 
     ply_path = f"{os.path.splitext(input_path)[0]}.ply"
     if os.path.isfile(ply_path):
         input_path = ply_path
-    print(f"{input_path=}")
+    return input_path
 
+
+def set_output_paths(input_path: str, is_gs=False, db: DB = None, export_temp=False):
+    if export_temp:
+        output_dir = tempfile.mkdtemp()
+    else:
+        output_dir = os.path.join(os.path.dirname(input_path), os.path.splitext(os.path.basename(input_path))[0])
+        os.makedirs(output_dir, exist_ok=True)
+    db.output_dir = output_dir
+    db.joints_coarse_path = os.path.join(output_dir, "joints_coarse.glb")
+    db.normed_path = os.path.join(output_dir, f"normed{os.path.splitext(input_path)[-1]}")
+    db.sample_path = os.path.join(output_dir, "sample.glb")
+    db.bw_path = os.path.join(output_dir, "bw.glb")
+    db.joints_path = os.path.join(output_dir, "joints.glb")
+    db.rest_lbs_path = os.path.join(output_dir, f"rest_lbs.{'ply' if is_gs else 'glb'}")
+    db.rest_vis_path = os.path.join(output_dir, "rest.glb")
+    input_filename = os.path.splitext(os.path.basename(input_path))[0]
+    db.anim_path = os.path.join(output_dir, f"{input_filename}.{'blend' if is_gs else 'fbx'}")
+    db.anim_vis_path = os.path.join(output_dir, f"{input_filename}.glb")
+
+
+def get_sampler(mesh: trimesh.Trimesh | trimesh.PointCloud) -> MeshSampler | None:
+    """`MeshSampler` of a triangle mesh if `MESH_SAMPLER=cached`, None to use `util.utils.sample_mesh`"""
+    if MESH_SAMPLER != "cached" or not isinstance(mesh, trimesh.Trimesh):
+        return None
+    return MeshSampler.from_trimesh(mesh)
+
+
+def load_input(input_path: str, is_gs=False, opacity_threshold=0.0, num_samples=32768) -> dict:
+    """Load the input file and sample `num_samples` points on it, independent of the models (e.g. in worker processes)
+
+    Returns:
+        values of the `DB` fields set by `prepare_input`
+    """
     if is_gs:
         if not input_path.endswith(".ply"):
             raise gr.Error("Input must be a `.ply` file for Gaussian Splats")
         try:
-            gaussians = load_gs(input_path)
-            db.gs = gaussians
+            gaussians = GaussianSplats(input_path)  # memory-mapped, only the columns below are read
         except:
             raise gr.Error("Fail to load the input file as Gaussian Splats")
-        xyz, opacities, scales, rots, shs = gaussians.split((3, 1, 3, 4, 3), dim=-1)
-        verts = xyz.numpy().astype(np.float32)
-        sample_mask = (opacities >= opacity_threshold).squeeze(-1).numpy()
+        verts = gaussians.xyz
+        sample_mask = (gaussians.opacities >= opacity_threshold).squeeze(-1)
         assert sample_mask.any(), "No solid points"
-        colors = shs.numpy().astype(np.float32)
+        colors = gaussians.colors
         faces = None
         mesh = trimesh.PointCloud(verts, colors=colors, process=False)
         # mesh.export("input.ply")
     else:
+        gaussians = None
         mesh: trimesh.Trimesh = trimesh.load(input_path, force="mesh")
         verts = np.array(mesh.vertices).astype(np.float32)
         sample_mask = None
@@ -575,7 +694,11 @@ def prepare_input(input_path: str, is_gs=False, opacity_threshold=0.0, db: DB =
             verts_normal = np.array(mesh.vertex_normals).astype(np.float32)
             faces = np.array(mesh.faces)
     is_mesh = faces is not None
-    pts = sample_mesh(get_masked_mesh(mesh, sample_mask), N, get_normals=is_mesh).astype(np.float32)
+    sampler = get_sampler(mesh)
+    if sampler is not None:
+        pts = sampler.sample(num_samples, get_normals=is_mesh).astype(np.float32)
+    else:
+        pts = sample_mesh(get_masked_mesh(mesh, sample_mask), num_samples, get_normals=is_mesh).astype(np.float32)
     pts = torch.from_numpy(pts).unsqueeze(0)
     verts = torch.from_numpy(verts).unsqueeze(0)
     if is_mesh:
@@ -585,40 +708,58 @@ def prepare_input(input_path: str, is_gs=False, opacity_threshold=0.0, db: DB =
         verts_normal = None
         pts_normal = None
 
-    db.mesh = mesh
-    db.is_mesh = is_mesh
-    db.sample_mask = sample_mask
-    db.verts = verts
-    db.verts_normal = verts_normal
-    db.faces = faces
-    db.pts = pts
-    db.pts_normal = pts_normal
+    return dict(
+        mesh=mesh,
+        gs=gaussians,
+        is_mesh=is_mesh,
+        sample_mask=sample_mask,
+        verts=verts,
+        verts_normal=verts_normal,
+        faces=faces,
+        pts=pts,
+        pts_normal=pts_normal,
+        sampler=sampler,
+    )
 
-    if export_temp:
-        output_dir = tempfile.mkdtemp()
-    else:
-        output_dir = os.path.join(os.path.dirname(input_path), os.path.splitext(os.path.basename(input_path))[0])
-        os.makedirs(output_dir, exist_ok=True)
-    db.output_dir = output_dir
-    db.joints_coarse_path = os.path.join(output_dir, "joints_coarse.glb")
-    db.normed_path = os.path.join(output_dir, f"normed{os.path.splitext(input_path)[-1]}")
-    db.sample_path = os.path.join(output_dir, "sample.glb")
-    db.bw_path = os.path.join(output_dir, "bw.glb")
-    db.joints_path = os.path.join(output_dir, "joints.glb")
-    db.rest_lbs_path = os.path.join(output_dir, f"rest_lbs.{'ply' if is_gs else 'glb'}")
-    db.rest_vis_path = os.path.join(output_dir, "rest.glb")
-    input_filename = os.path.splitext(os.path.basename(input_path))[0]
-    db.anim_path = os.path.join(output_dir, f"{input_filename}.{'blend' if is_gs else 'fbx'}")
-    db.anim_vis_path = os.path.join(output_dir, f"{input_filename}.glb")
+
+def prepare_input(
+    input_path: str, is_gs=False, opacity_threshold=0.0, db: DB = None, export_temp=False, loaded: dict = None
+):
+    """
+    Args:
+        loaded: result of `load_input` computed beforehand (e.g. by `batch_rig.py`), otherwise loaded here
+    """
+    input_path = resolve_input_path(input_path)
+    print(f"{input_path=}")
+
+    if loaded is None:
+        loaded = load_input(input_path, is_gs, opacity_threshold, N)
+    for k, v in loaded.items():
+        setattr(db, k, v)
+    if db.output_dir is None:
+        set_output_paths(input_path, is_gs, db, export_temp)
 
     return {state: db}
 
 
+def subsample_points(pts: torch.Tensor, num_points: int) -> torch.Tensor:
+    """A fixed random subset of `num_points` of the i.i.d. surface samples `pts` [B, N, D] (all of them if fewer)"""
+    if pts.shape[-2] <= num_points:
+        return pts
+    idx = torch.randperm(pts.shape[-2], generator=torch.Generator().manual_seed(0))[:num_points]
+    return pts[..., idx.sort().values.to(pts.device), :]
+
+
+@torch.no_grad()
+def forward_coarse(pts: torch.Tensor) -> torch.Tensor:
+    return model_coarse.query(shared_encoder.encode_context(model_coarse, pts)).joints
+
+
 @spaces.GPU
 @torch.no_grad()
 def model_forward_coarse(pts: torch.Tensor) -> torch.Tensor:
     pts = pts.to(device)
-    joints = model_coarse(pts).joints
+    joints = batched_forward["coarse"](pts)
     return joints.cpu()
 
 
@@ -629,6 +770,9 @@ def preprocess(db: DB):
     verts = db.verts
     verts_normal = db.verts_normal
 
+    if db.sampler is None or not db.sampler.is_sampler_of(mesh):  # e.g. loaded in another process or cached
+        db.sampler = get_sampler(mesh)
+
     # Transform to Hips coordinates
     norm = get_normalize_transform(pts, keep_ratio=True, recenter=True)
     pts = norm.transform_points(pts)
@@ -637,7 +781,7 @@ def preprocess(db: DB):
     #     pts_normal = F.normalize(norm.transform_normals(pts_normal), dim=-1)
     #     verts_normal = F.normalize(norm.transform_normals(verts_normal), dim=-1)
     with Timing(msg="Joints localization done in", print_fn=gr.Info):
-        joints = model_forward_coarse(pts)
+        joints = model_forward_coarse(subsample_points(pts, N_coarse))
     joints, joints_tail = joints[..., :3], joints[..., 3:]
     hips = joints[:, BONES_IDX_DICT[f"{MIXAMO_PREFIX}Hips"]]
     rightupleg = joints[:, BONES_IDX_DICT[f"{MIXAMO_PREFIX}RightUpLeg"]]
@@ -655,8 +799,8 @@ def preprocess(db: DB):
     ).export(db.joints_coarse_path)
     mesh.vertices = verts.squeeze(0).cpu().numpy()
     if db.gs is not None:
-        db.gs = transform_gs(db.gs, global_transform)
-        save_gs(db.gs, db.normed_path)
+        db.gs = db.gs.transformed(transform_gs, global_transform)
+        db.gs.save(db.normed_path)
     else:
         mesh.export(db.normed_path)
 
@@ -666,14 +810,18 @@ def preprocess(db: DB):
             joints_tail_hips[BONES_IDX_DICT[f"{MIXAMO_PREFIX}LeftHand"]],
             joints_tail_hips[BONES_IDX_DICT[f"{MIXAMO_PREFIX}RightHand"]],
         ]
-        pts = sample_mesh(
-            get_masked_mesh(mesh, db.sample_mask),
-            N,
+        sample_kwargs = dict(
             get_normals=db.is_mesh,
             attn_ratio=hands_resample_ratio,
             attn_centers=hands_centers,
             attn_geo_ratio=geo_resample_ratio,
-        ).astype(np.float32)
+        )
+        if db.sampler is not None:
+            # The input mesh up to a similarity, so the tables of the sampler still hold
+            sampler = db.sampler.transformed(global_transform.get_matrix()[0].cpu().numpy())
+            pts = sampler.sample(N, **sample_kwargs).astype(np.float32)
+        else:
+            pts = sample_mesh(get_masked_mesh(mesh, db.sample_mask), N, **sample_kwargs).astype(np.float32)
     else:
         pts = pts.squeeze(0).cpu().numpy()
         pts_normal = pts_normal.squeeze(0).cpu().numpy()
@@ -713,6 +861,10 @@ def preprocess(db: DB):
     db.pts_normal = pts_normal
     db.global_transform = global_transform
 
+    return preprocess_outputs(db)
+
+
+def preprocess_outputs(db: DB):
     return {
         output_joints_coarse: change_Model3D(db.joints_coarse_path, display_mode="wireframe", is_pc=not db.is_mesh),
         output_normed_input: change_Model3D(db.normed_path, is_pc=not db.is_mesh),
@@ -721,29 +873,55 @@ def preprocess(db: DB):
     }
 
 
+@torch.no_grad()
+def bw_contexts(pts: torch.Tensor, pts_normal: torch.Tensor, input_normal: bool) -> tuple[LatentContext]:
+    """Encoded & decoded latents of the bone weights models (encoding shared with the bones models)
+    Returns:
+        context of `model_bw`, context of `model_bw_normal` (None if not `input_normal`)
+    """
+    device = next(model_bw.parameters()).device
+    pts = pts.to(device)
+    context = batched_forward["bw"](pts)
+    context_normal = None
+    if input_normal:
+        context_normal = batched_forward["bw_normal"](torch.cat([pts, pts_normal.to(device)], dim=-1))
+    return context, context_normal
+
+
 # @spaces.GPU  # always lead to "GPU task aborted"
 @torch.no_grad()
 def model_forward_bw(
-    verts: torch.Tensor, verts_normal: torch.Tensor, pts: torch.Tensor, pts_normal: torch.Tensor, input_normal: bool
+    verts: torch.Tensor,
+    verts_normal: torch.Tensor,
+    pts: torch.Tensor,
+    pts_normal: torch.Tensor,
+    input_normal: bool,
+    contexts: tuple[LatentContext] = None,
 ) -> torch.Tensor:
+    """
+    Args:
+        contexts: from `bw_contexts(pts, pts_normal, input_normal)`, computed here if not given
+    """
     device = next(model_bw.parameters()).device
-    pts = pts.to(device)
-    pts_normal = None if pts_normal is None else pts_normal.to(device)
 
-    CHUNK = 100000  # present OOM for high-res models
-    bw = []
-    verts_chunks = torch.split(verts, CHUNK, dim=-2)
-    verts_normal_chunks = (
-        ([None] * len(verts_chunks)) if verts_normal is None else torch.split(verts_normal, CHUNK, dim=-2)
-    )
-    for verts_, verts_normal_ in zip(verts_chunks, verts_normal_chunks):
-        verts_ = verts_.to(device)
-        verts_normal_ = None if verts_normal_ is None else verts_normal_.to(device)
-        bw_ = model_bw(pts, verts_).bw
+    # Latents decoded once, then only the cross-attn runs per chunk
+    context, context_normal = contexts or bw_contexts(pts, pts_normal, input_normal)
+
+    # Vertices duplicated along UV seams & hard edges share their position (and normal, when used), so the model
+    # only queries the unique ones, and their weights are scattered back to every copy
+    queries = torch.cat([verts, verts_normal], dim=-1) if input_normal else verts
+    assert queries.shape[0] == 1
+    queries, inverse = unique_rows(queries[0])
+    queries = queries.unsqueeze(0)
+    if inverse is not None:
+        print(f"Deduplicated vertices: {verts.shape[-2]} -> {queries.shape[-2]} queries")
+
+    # Chunks of vertices as large as the memory budget allows, decoded against the same context
+    def forward_chunk(begin: int, end: int) -> torch.Tensor:
+        queries_ = queries[:, begin:end].to(device)
+        bw_ = model_bw.query(context, queries_[..., :3]).bw
         if input_normal:
-            bw_normal = model_bw_normal(
-                torch.cat([pts, pts_normal], dim=-1), torch.cat([verts_, verts_normal_], dim=-1)
-            ).bw
+            bw_normal = model_bw_normal.query(context_normal, queries_).bw
             mask = get_conflict_mask(
                 torch.argmax(bw_, dim=-1),
                 lambda k: True,
@@ -752,20 +930,62 @@ def model_forward_bw(
             )
             bw_normal[mask] = bw_[mask]
             bw_ = bw_normal
-        bw.append(bw_)
-    bw = torch.cat(bw, dim=-2)
+        return bw_
 
-    return bw.cpu()
+    models = [model_bw, model_bw_normal] if input_normal else [model_bw]
+    bw = torch.cat(query_planner.run(forward_chunk, queries.shape[-2], models, device), dim=-2).cpu()
+
+    return bw if inverse is None else bw[:, inverse.cpu()]
 
 
-@spaces.GPU
 @torch.no_grad()
-def model_forward_bones(pts: torch.Tensor) -> tuple[torch.Tensor]:
-    pts = pts.to(device)
+def model_forward_bw_multires(
+    verts: torch.Tensor,
+    verts_normal: torch.Tensor,
+    pts: torch.Tensor,
+    pts_normal: torch.Tensor,
+    input_normal: bool,
+    quality: float,
+    k=4,
+    max_entropy=1.0,
+    min_proxy=4096,
+) -> torch.Tensor:
+    """`model_forward_bw` on a random proxy of `quality` of the vertices, interpolated to the others (kNN), and
+    queried again where the interpolation is uncertain: the neighbours disagree on the dominant bone, or the
+    interpolated weights are spread over many bones
+    Args:
+        k: proxy vertices interpolated per vertex
+        max_entropy: of the interpolated weights (nats) above which a vertex is queried again
+    """
+    num_verts = verts.shape[-2]
+    num_proxy = min(max(int(num_verts * quality), min_proxy), num_verts)
+    proxy = torch.randperm(num_verts, generator=torch.Generator().manual_seed(0))[:num_proxy].sort().values
+    # Both passes query the same latents
+    contexts = bw_contexts(pts, pts_normal, input_normal)
+
+    def forward(idx: torch.Tensor) -> torch.Tensor:
+        normal = None if verts_normal is None else verts_normal[:, idx]
+        return model_forward_bw(verts[:, idx], normal, pts, pts_normal, input_normal, contexts)[0]
+
+    bw_proxy = forward(proxy)
+    bw, neighbors = knn_interpolate(verts[0, proxy], bw_proxy, verts[0], k=k)
+    dominant = bw_proxy.argmax(-1)[neighbors]
+    entropy = -(bw * bw.clamp_min(1e-12).log()).sum(-1)
+    uncertain = (dominant != dominant[:, :1]).any(-1) | (entropy > max_entropy)
+    uncertain[proxy] = False
+    bw[proxy] = bw_proxy
+    refine = uncertain.nonzero().squeeze(1)
+    if len(refine) > 0:
+        bw[refine] = forward(refine)
+    print(f"Multi-resolution bone weights: {num_proxy} proxy + {len(refine)} refined / {num_verts} vertices")
+    return bw.unsqueeze(0)
 
-    joints = model_joints.forward(pts).joints
+
+@torch.no_grad()
+def forward_bones(pts: torch.Tensor) -> tuple[torch.Tensor]:
+    joints = model_joints.query(shared_encoder.encode_context(model_joints, pts)).joints
     if joints_additional:
-        joints_add = model_joints_add(pts).joints
+        joints_add = model_joints_add.query(shared_encoder.encode_context(model_joints_add, pts)).joints
         joints = reorganize_bone_data_(joints, BONES_IDX_DICT, bones_idx_dict_joints, template_data=joints_add)
 
     if model_pose.pose_input_joints:
@@ -774,8 +994,15 @@ def model_forward_bones(pts: torch.Tensor) -> tuple[torch.Tensor]:
             joints_ = reorganize_bone_data_(joints_, bones_idx_dict_joints, BONES_IDX_DICT)
     else:
         joints_ = None
-    pose = model_pose(pts, joints=joints_).pose_trans
+    pose = model_pose.query(shared_encoder.encode_context(model_pose, pts), joints=joints_).pose_trans
+    return joints, pose
 
+
+@spaces.GPU
+@torch.no_grad()
+def model_forward_bones(pts: torch.Tensor) -> tuple[torch.Tensor]:
+    pts = pts.to(device)
+    joints, pose = batched_forward["bones"](pts)
     return joints.cpu(), pose.cpu()
 
 
@@ -796,10 +1023,13 @@ def infer(input_normal: bool, db: DB):
     #     pts_normal = F.normalize(norm.transform_normals(pts_normal), dim=-1)
     #     verts_normal = F.normalize(norm.transform_normals(verts_normal), dim=-1)
     if db.gs is not None:
-        db.gs = transform_gs(db.gs, norm)
+        db.gs = db.gs.transformed(transform_gs, norm)
 
     with Timing(msg="Model inference done in", print_fn=gr.Info):
-        bw = model_forward_bw(verts, verts_normal, pts, pts_normal, input_normal)
+        if bw_quality < 1 and verts.shape[-2] > bw_multires_min_verts:
+            bw = model_forward_bw_multires(verts, verts_normal, pts, pts_normal, input_normal, bw_quality)
+        else:
+            bw = model_forward_bw(verts, verts_normal, pts, pts_normal, input_normal)
         joints, pose = model_forward_bones(pts)
 
     db.mesh.vertices = verts.squeeze(0).cpu().numpy()
@@ -812,7 +1042,7 @@ def infer(input_normal: bool, db: DB):
     return {state: db}
 
 
-def vis(bw_fix: bool, bw_vis_bone: str, no_fingers: bool, db: DB):
+def vis(bw_fix: bool, no_fingers: bool, db: DB):
     verts = db.verts
     bw = db.bw
     joints = db.joints
@@ -865,6 +1095,7 @@ def vis(bw_fix: bool, bw_vis_bone: str, no_fingers: bool, db: DB):
             # & ((verts[..., 0] - _get_bone_loc(joints, "Hips", "x", "head")).abs() <= 0.1)
             # & ((verts[..., 1] - _get_bone_loc(joints, "Hips", "y", "head")).abs() <= 0.15),
             no_fingers=no_fingers,
+            return_sparse=True,
         )
 
         # Transform back to the input coordinates
@@ -880,11 +1111,8 @@ def vis(bw_fix: bool, bw_vis_bone: str, no_fingers: bool, db: DB):
         # # data_["bw"] = remove_fingers_from_data(data_["bw"].T, bones_idx_dict, is_bw=True).T
         # np.savez(os.path.join("data/rignet/output", os.path.basename(db.anim_path).replace(".fbx", ".npz")), **data_)
 
-    bw = bw.squeeze(0).cpu().numpy()
+    bw = map_weights(bw, lambda x: x.squeeze(0).cpu().numpy())
     verts = verts.squeeze(0).cpu().numpy()
-    vis_weights(verts, bw, db.faces, vis_bone_index=bones_idx_dict_bw[f"{MIXAMO_PREFIX}{bw_vis_bone}"]).export(
-        db.bw_path
-    )
     joints, joints_tail = joints.squeeze(0)[..., :3].cpu().numpy(), joints.squeeze(0)[..., 3:].cpu().numpy()
     vis_joints(verts, joints, db.faces, bones_idx_dict=bones_idx_dict_joints).export(db.joints_path)
 
@@ -898,7 +1126,7 @@ def vis(bw_fix: bool, bw_vis_bone: str, no_fingers: bool, db: DB):
                 kinematic_tree=KINEMATIC_TREE_ADD,
             )
             if not bw_additional:
-                bw = reorganize_bone_data_(bw.T, BONES_IDX_DICT, bones_idx_dict_joints).T
+                bw = reorganize_weights(bw, BONES_IDX_DICT, bones_idx_dict_joints)
 
         if "local" in model_pose.pose_mode:
             pose = to_pose_local(pose, input_mode=model_pose.pose_mode, return_quat=False)
@@ -919,15 +1147,14 @@ def vis(bw_fix: bool, bw_vis_bone: str, no_fingers: bool, db: DB):
 
         pose[..., 0, :, :] = torch.eye(4)
         pose = pose.squeeze(0).cpu().numpy()
-        lbs_transform = np.einsum("kij,nk->nij", pose, bw)
         if db.gs is None:
             rest_joints = apply_transform(joints, pose)
             vis_joints(
-                apply_transform(verts, lbs_transform), rest_joints, db.faces, bones_idx_dict=bones_idx_dict_joints
+                lbs_points(verts, pose, bw), rest_joints, db.faces, bones_idx_dict=bones_idx_dict_joints
             ).export(db.rest_lbs_path)
         else:
-            db.gs_rest = transform_gs(db.gs, lbs_transform)
-            save_gs(db.gs_rest, db.rest_lbs_path)
+            db.gs_rest = db.gs.transformed(skin_gs, pose, per_splat=(bw,))
+            db.gs_rest.save(db.rest_lbs_path)
 
     db.verts = verts
     db.bw = bw
@@ -935,14 +1162,31 @@ def vis(bw_fix: bool, bw_vis_bone: str, no_fingers: bool, db: DB):
     db.joints_tail = joints_tail
     db.pose = pose
 
+    return vis_outputs(db)
+
+
+def vis_outputs(db: DB):
     return {
         output_joints: change_Model3D(db.joints_path, display_mode="wireframe", is_pc=not db.is_mesh),
-        output_bw: change_Model3D(db.bw_path, is_pc=not db.is_mesh),
         output_rest_lbs: change_Model3D(db.rest_lbs_path, is_pc=not db.is_mesh),
         state: db,
     }
 
 
+def vis_bw(bw_vis_bone: str, db: DB):
+    # `vis` reorganizes the weights to the bones of the joints model if they differ
+    reorganized = db.pose is not None and joints_additional and not bw_additional
+    bones_idx_dict = bones_idx_dict_joints if reorganized else bones_idx_dict_bw
+    vis_weights(db.verts, db.bw, db.faces, vis_bone_index=bones_idx_dict[f"{MIXAMO_PREFIX}{bw_vis_bone}"]).export(
+        db.bw_path
+    )
+    return vis_bw_outputs(db)
+
+
+def vis_bw_outputs(db: DB):
+    return {output_bw: change_Model3D(db.bw_path, is_pc=not db.is_mesh), state: db}
+
+
 def get_pose_ignore_list(pose: str = None, pose_parts: list[str] = None):
     kw_list: list[str] = ["Hips", "Ear", "Tail"]
     if pose:
@@ -1016,24 +1260,6 @@ def vis_blender(
     if any(x is None for x in (db.mesh, db.joints, db.joints_tail, db.bw)):
         raise gr.Error("Run the inference first")
 
-    if db.gs is not None:
-        gr.Warning("It can take quite a long time to import and rig Gaussian Splats in Blender. Please wait patiently.")
-        if isinstance(db.gs, torch.Tensor):
-            db.gs = db.gs.numpy()
-        if db.gs_rest is not None and isinstance(db.gs_rest, torch.Tensor):
-            db.gs_rest = db.gs_rest.numpy()
-    template_path = TEMPLATE_PATH_ADD if joints_additional else TEMPLATE_PATH
-
-    data = dict(
-        mesh=db.mesh,
-        gs=db.gs_rest if reset_to_rest else db.gs,
-        joints=db.joints,
-        joints_tail=db.joints_tail,
-        bw=db.bw,
-        pose=db.pose,
-        bones_idx_dict=dict(bones_idx_dict_joints),
-        pose_ignore_list=get_pose_ignore_list(rest_pose_type, ignore_pose_parts),
-    )
     if animation_file is not None:
         if not os.path.isfile(animation_file):
             raise gr.Error(f"Animation file {animation_file} does not exist")
@@ -1042,49 +1268,100 @@ def vis_blender(
                 "'Reset to Rest' is not enabled, so the animation may be incorrect if the input is not in T-pose"
             )
 
-    if is_main_thread():
-        from argparse import Namespace
-
-        from app_blender import main
-
-        main(
-            Namespace(
-                input_path=data,
-                output_path=db.anim_path,
-                template_path=template_path,
-                keep_raw=False,
-                rest_path=db.rest_vis_path if db.is_mesh else None,
-                pose_local=False,
-                reset_to_rest=reset_to_rest,
-                remove_fingers=remove_fingers,
-                animation_path=animation_file,
-                retarget=retarget,
-                inplace=inplace,
+    gs = db.gs_rest if reset_to_rest else db.gs
+    gs_file = None
+    try:
+        if gs is not None:
+            gr.Warning(
+                "It can take quite a long time to import and rig Gaussian Splats in Blender. Please wait patiently."
             )
+            # Streamed to a file read back by `app_blender.py`, instead of gathering all the splats in memory. On
+            # disk, next to the outputs: `HANDOFF_DIR` can be RAM-backed (`/dev/shm`)
+            gs_file = tempfile.NamedTemporaryFile(suffix=".ply", dir=db.output_dir)
+            gs.save(gs_file.name)
+            gs = gs_file.name
+        template_path = TEMPLATE_PATH_ADD if joints_additional else TEMPLATE_PATH
+
+        data = dict(
+            mesh=db.mesh,
+            gs=gs,
+            joints=db.joints,
+            joints_tail=db.joints_tail,
+            **pack_weights(db.bw),
+            pose=db.pose,
+            bones_idx_dict=dict(bones_idx_dict_joints),
+            pose_ignore_list=get_pose_ignore_list(rest_pose_type, ignore_pose_parts),
         )
-    else:
-        # Directly call bpy here causes crash, because Blender does not support modifying data in child threads
-        with tempfile.NamedTemporaryFile(suffix=".npz") as f:
-            np.savez(f.name, **data)
-            cmd = f"python app_blender.py --input_path '{f.name}' --output_path '{os.path.abspath(db.anim_path)}'"
-            cmd += f" --template_path '{os.path.abspath(template_path)}'"
-            if db.is_mesh:
-                cmd += f" --rest_path '{os.path.abspath(db.rest_vis_path)}'"
-            # if "local" in model_pose.pose_mode:
-            #     cmd += " --pose_local"
-            if reset_to_rest:
-                cmd += " --reset_to_rest"
-            if remove_fingers:
-                cmd += " --remove_fingers"
-            if animation_file is not None:
-                cmd += f" --animation_path '{os.path.abspath(animation_file)}'"
-                if retarget:
-                    cmd += " --retarget"
-                if inplace:
-                    cmd += " --inplace"
-            cmd += " > /dev/null 2>&1"
-            # print(cmd)
-            os.system(cmd)
+
+        if is_main_thread():
+            from argparse import Namespace
+
+            from app_blender import main
+
+            data["mesh"] = db.mesh.copy()  # modified in place
+            main(
+                Namespace(
+                    input_path=data,
+                    output_path=db.anim_path,
+                    template_path=template_path,
+                    keep_raw=False,
+                    rest_path=db.rest_vis_path if db.is_mesh else None,
+                    pose_local=False,
+                    reset_to_rest=reset_to_rest,
+                    remove_fingers=remove_fingers,
+                    animation_path=animation_file,
+                    retarget=retarget,
+                    inplace=inplace,
+                )
+            )
+        elif blender_pool is not None:
+            with handoff_file() as f:
+                save_handoff(f.name, data)
+                try:
+                    blender_pool.run(
+                        dict(
+                            input_path=f.name,
+                            output_path=os.path.abspath(db.anim_path),
+                            template_path=os.path.abspath(template_path),
+                            keep_raw=False,
+                            rest_path=os.path.abspath(db.rest_vis_path) if db.is_mesh else None,
+                            pose_local=False,
+                            reset_to_rest=reset_to_rest,
+                            remove_fingers=remove_fingers,
+                            animation_path=None if animation_file is None else os.path.abspath(animation_file),
+                            retarget=retarget,
+                            inplace=inplace,
+                        )
+                    )
+                except BlenderWorkerError as e:
+                    print(e)
+                    gr.Warning("Blender failed to rig the model")
+        else:
+            # Directly call bpy here causes crash, because Blender does not support modifying data in child threads
+            with handoff_file() as f:
+                save_handoff(f.name, data)
+                cmd = f"python app_blender.py --input_path '{f.name}' --output_path '{os.path.abspath(db.anim_path)}'"
+                cmd += f" --template_path '{os.path.abspath(template_path)}'"
+                if db.is_mesh:
+                    cmd += f" --rest_path '{os.path.abspath(db.rest_vis_path)}'"
+                # if "local" in model_pose.pose_mode:
+                #     cmd += " --pose_local"
+                if reset_to_rest:
+                    cmd += " --reset_to_rest"
+                if remove_fingers:
+                    cmd += " --remove_fingers"
+                if animation_file is not None:
+                    cmd += f" --animation_path '{os.path.abspath(animation_file)}'"
+                    if retarget:
+                        cmd += " --retarget"
+                    if inplace:
+                        cmd += " --inplace"
+                cmd += " > /dev/null 2>&1"
+                # print(cmd)
+                os.system(cmd)
+    finally:
+        if gs_file is not None:
+            gs_file.close()  # deletes the streamed splats
 
     print(f"Output animatable model: '{db.anim_path}'")
 
@@ -1101,18 +1378,30 @@ def vis_blender(
         db.rest_vis_path = None
         db.anim_vis_path = None
 
-    anim_path = db.anim_path
+    compressed_path = f"{os.path.splitext(db.anim_path)[0]}.zip"
+    if os.path.isfile(compressed_path):
+        os.remove(compressed_path)
     if os.path.isfile(db.anim_path):
         size_mb = os.path.getsize(db.anim_path) / (1024**2)
         if size_mb > 50:
             gr.Info(f"Animation file is too large ({size_mb:.2f}MB), compressing it")
-            compressed_path = f"{os.path.splitext(db.anim_path)[0]}.zip"
             make_archive(db.anim_path, compressed_path)
-            anim_path = compressed_path
 
+    return vis_blender_outputs(db)
+
+
+def animate(*args):
+    """`vis_blender` from the Animate button, outside of `stage_pipeline`"""
+    db: DB = args[-1]
+    stage_pipeline.invalidate(db, "vis_blender")
+    return vis_blender(*args)
+
+
+def vis_blender_outputs(db: DB):
+    compressed_path = f"{os.path.splitext(db.anim_path)[0]}.zip"
     return {
         output_rest_vis: db.rest_vis_path,
-        output_anim: anim_path,
+        output_anim: compressed_path if os.path.isfile(compressed_path) else db.anim_path,
         output_anim_vis: db.anim_vis_path,
         state: db,
     }
@@ -1125,6 +1414,141 @@ def finish(db: DB = None):
     return {state: gr.skip() if db is None else db}
 
 
+def build_pipeline(cache: RigCache = None):
+    """`prepare_input` -> `preprocess` -> `infer` -> `vis` -> (`vis_bw`, `vis_blender`)"""
+
+    def checkpoints(*models: PCAE):
+        return [(model.checkpoint, model.fps_mode) for model in models]  # approximate FPS samples other points
+
+    def reset(options: dict, db: DB):
+        clear(db)
+        set_output_paths(options["input_path"], options["is_gs"], db, options["export_temp"])
+
+    models_infer = [model_bw, model_bw_normal, model_joints, model_pose]
+    if joints_additional:
+        models_infer.append(model_joints_add)
+    return StagePipeline(
+        [
+            Stage(
+                "prepare_input",
+                lambda o, db: prepare_input(
+                    o["input_path"], o["is_gs"], o["opacity_threshold"], db, o["export_temp"], o.get("loaded")
+                ),
+                lambda db: {state: db},
+                options=("input", "is_gs", "opacity_threshold"),
+                outputs=("mesh", "gs", "is_mesh", "sample_mask", "verts", "verts_normal", "faces", "pts", "pts_normal"),
+                version=lambda: (N, MESH_SAMPLER),
+                setup=reset,
+            ),
+            Stage(
+                "preprocess",
+                lambda o, db: preprocess(db),
+                preprocess_outputs,
+                deps=("prepare_input",),
+                outputs=("mesh", "gs", "verts", "verts_normal", "pts", "pts_normal", "global_transform"),
+                files=("joints_coarse_path", "normed_path", "sample_path"),
+                mutates=("mesh",),  # `mesh.vertices`
+                version=lambda: (
+                    N_coarse, hands_resample_ratio, geo_resample_ratio, MESH_SAMPLER, checkpoints(model_coarse)
+                ),
+                persistent=True,
+            ),
+            Stage(
+                "infer",
+                lambda o, db: infer(o["input_normal"], db),
+                lambda db: {state: db},
+                options=("input_normal",),
+                deps=("preprocess",),
+                outputs=("mesh", "gs", "pts", "verts", "bw", "joints", "pose", "global_transform"),
+                mutates=("mesh",),  # `mesh.vertices`
+                version=lambda: (checkpoints(*models_infer), bw_quality, bw_multires_min_verts),
+                persistent=True,
+            ),
+            Stage(
+                "vis",
+                lambda o, db: vis(o["bw_fix"], o["no_fingers"], db),
+                vis_outputs,
+                options=("bw_fix", "no_fingers"),
+                deps=("infer",),
+                outputs=("verts", "bw", "joints", "joints_tail", "pose", "gs_rest"),
+                files=("joints_path", "rest_lbs_path"),
+                mutates=("pose",),  # `pose[..., 0, :, :]` if already matrices
+            ),
+            Stage(
+                "vis_bw",
+                lambda o, db: vis_bw(o["bw_vis_bone"], db),
+                vis_bw_outputs,
+                options=("bw_vis_bone",),
+                deps=("vis",),
+                files=("bw_path",),
+            ),
+            Stage(
+                "vis_blender",
+                lambda o, db: vis_blender(
+                    o["reset_to_rest"],
+                    o["no_fingers"],
+                    o["rest_pose_type"],
+                    o["ignore_pose_parts"],
+                    o["animation_file"],
+                    o["retarget"],
+                    o["inplace"],
+                    db,
+                ),
+                vis_blender_outputs,
+                options=(
+                    "reset_to_rest",
+                    "no_fingers",
+                    "rest_pose_type",
+                    "ignore_pose_parts",
+                    "animation_file",
+                    "retarget",
+                    "inplace",
+                ),
+                deps=("vis",),
+                files=("rest_vis_path", "anim_path", "anim_vis_path"),
+            ),
+        ],
+        cache=cache,
+    )
+
+
+def pipeline_options(
+    input_path: str,
+    is_gs=False,
+    opacity_threshold=0.0,
+    no_fingers=False,
+    rest_pose_type: str = None,
+    ignore_pose_parts: list[str] = None,
+    input_normal=False,
+    bw_fix=True,
+    bw_vis_bone="LeftArm",
+    reset_to_rest=False,
+    animation_file: str = None,
+    retarget=True,
+    inplace=True,
+    export_temp=False,
+):
+    """Options of `stage_pipeline.run`, with the input identified by its content"""
+    input_path = resolve_input_path(input_path)
+    return dict(
+        input_path=input_path,
+        input=f"{file_digest(input_path)}{os.path.splitext(input_path)[-1].lower()}",
+        is_gs=is_gs,
+        opacity_threshold=opacity_threshold if is_gs else None,
+        export_temp=export_temp,
+        input_normal=input_normal,
+        bw_fix=bw_fix,
+        bw_vis_bone=bw_vis_bone,
+        no_fingers=no_fingers,
+        reset_to_rest=reset_to_rest,
+        rest_pose_type=rest_pose_type,
+        ignore_pose_parts=ignore_pose_parts,
+        animation_file=animation_file,
+        retarget=retarget,
+        inplace=inplace,
+    )
+
+
 @Timing(msg="All done in", print_fn=gr.Success)
 def _pipeline(
     input_path: str,
@@ -1147,38 +1571,39 @@ def _pipeline(
         db = DB()
     with TimePrints():
         print("*" * 50)
-    clear(db)
-    # Magic sleep to fix the random pydantic_core._pydantic_core.ValidationError in Gradio: https://github.com/gradio-app/gradio/issues/9366#issuecomment-2412903101
-    time.sleep(0.1)
-    yield prepare_input(input_path, is_gs, opacity_threshold, db, export_temp)
-    time.sleep(0.1)
-    yield preprocess(db)
-    time.sleep(0.1)
-    yield infer(input_normal, db)
-    time.sleep(0.1)
-    yield vis(bw_fix, bw_vis_bone, no_fingers, db)
-    time.sleep(0.1)
-    yield vis_blender(
-        reset_to_rest, no_fingers, rest_pose_type, ignore_pose_parts, animation_file, retarget, inplace, db
+    options = pipeline_options(
+        input_path,
+        is_gs,
+        opacity_threshold,
+        no_fingers,
+        rest_pose_type,
+        ignore_pose_parts,
+        input_normal,
+        bw_fix,
+        bw_vis_bone,
+        reset_to_rest,
+        animation_file,
+        retarget,
+        inplace,
+        export_temp,
     )
+    # Only the stages downstream of a changed option are executed
+    for outputs in stage_pipeline.run(options, db):
+        # Magic sleep to fix the random pydantic_core._pydantic_core.ValidationError in Gradio: https://github.com/gradio-app/gradio/issues/9366#issuecomment-2412903101
+        time.sleep(0.1)
+        yield outputs
     time.sleep(0.1)
     yield finish(db=None)  # keep the outputs for possible re-animation later
 
 
-def init_models():
-    global device, N, hands_resample_ratio, geo_resample_ratio, bw_additional, joints_additional, bones_idx_dict_bw, bones_idx_dict_joints, model_bw, model_bw_normal, model_joints, model_joints_add, model_coarse, model_pose
-
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    fix_random()
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    IS_HF_ZEROGPU = str2bool(os.getenv("SPACES_ZERO_GPU", False))
-
-    N = 32768
-    hands_resample_ratio = 0.5
-    geo_resample_ratio = 0.0
-    hierarchical_ratio = hands_resample_ratio + geo_resample_ratio
-
-    ADDITIONAL_BONES = bw_additional = joints_additional = False
+def load_models(
+    N: int, hierarchical_ratio: float, device: torch.device, bw_device: torch.device = None, ADDITIONAL_BONES=False
+) -> dict[str, PCAE]:
+    """Eager models from the checkpoints, by name
+    Args:
+        bw_device: device of the bone weights models (default `device`)
+    """
+    bw_device = device if bw_device is None else bw_device
 
     model_bw = PCAE(
         N=N,
@@ -1191,7 +1616,7 @@ def init_models():
         model_bw.load("output/vroid/bw.pth")
     else:
         model_bw.load("output/best/new/bw.pth")
-    model_bw.to("cpu" if IS_HF_ZEROGPU else device).eval()
+    model_bw.to(bw_device).eval()
 
     model_bw_normal = PCAE(
         N=N,
@@ -1205,8 +1630,7 @@ def init_models():
         model_bw_normal.load("output/vroid/bw_normal.pth")
     else:
         model_bw_normal.load("output/best/new/bw_normal.pth")
-    bones_idx_dict_bw = BONES_IDX_DICT_ADD if bw_additional else BONES_IDX_DICT
-    model_bw_normal.to("cpu" if IS_HF_ZEROGPU else device).eval()
+    model_bw_normal.to(bw_device).eval()
 
     model_joints = PCAE(
         N=N,
@@ -1222,8 +1646,6 @@ def init_models():
     )
     model_joints.load("output/best/new/joints.pth")
     model_joints.to(device).eval()
-    bones_idx_dict_joints = BONES_IDX_DICT_ADD if joints_additional else BONES_IDX_DICT
-    assert not (bw_additional and not joints_additional)
     if ADDITIONAL_BONES:
         model_joints_add = PCAE(
             N=N,
@@ -1268,6 +1690,103 @@ def init_models():
     model_pose.load("output/best/new/pose.pth")
     model_pose.to(device).eval()
 
+    models = {
+        "bw": model_bw,
+        "bw_normal": model_bw_normal,
+        "joints": model_joints,
+        "coarse": model_coarse,
+        "pose": model_pose,
+    }
+    if ADDITIONAL_BONES:
+        models["joints_add"] = model_joints_add
+    return models
+
+
+def init_models():
+    global device, N, N_coarse, hands_resample_ratio, geo_resample_ratio, bw_additional, joints_additional, bones_idx_dict_bw, bones_idx_dict_joints, model_bw, model_bw_normal, model_joints, model_joints_add, model_coarse, model_pose, shared_encoder, batched_forward, query_planner, bw_quality, bw_multires_min_verts, blender_pool, stage_pipeline
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    fix_random()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    IS_HF_ZEROGPU = str2bool(os.getenv("SPACES_ZERO_GPU", False))
+
+    N = 32768
+    # Points of the coarse joints pass (`INFER_N_COARSE`), only used for the Hips transform: a subset of the `N`
+    # sampled ones, see `n_points_eval.py` for the latency & accuracy per count
+    N_coarse = min(int(os.getenv("INFER_N_COARSE", N)), N)
+    hands_resample_ratio = 0.5
+    geo_resample_ratio = 0.0
+    hierarchical_ratio = hands_resample_ratio + geo_resample_ratio
+
+    ADDITIONAL_BONES = bw_additional = joints_additional = False
+
+    bones_idx_dict_bw = BONES_IDX_DICT_ADD if bw_additional else BONES_IDX_DICT
+    bones_idx_dict_joints = BONES_IDX_DICT_ADD if joints_additional else BONES_IDX_DICT
+    assert not (bw_additional and not joints_additional)
+
+    # `INFER_BACKEND`: "eager", "compile" (`torch.compile`), or the format of the models exported by `export.py`
+    # to `INFER_EXPORT_DIR` ("torchscript" or "onnx"), loaded instead of the checkpoints
+    backend = os.getenv("INFER_BACKEND", "eager")
+    if backend in EXPORT_FORMATS:
+        named_models = load_exported(os.getenv("INFER_EXPORT_DIR", EXPORT_DIR), backend, device)
+    else:
+        named_models = load_models(N, hierarchical_ratio, device, "cpu" if IS_HF_ZEROGPU else device, ADDITIONAL_BONES)
+    model_bw, model_bw_normal = named_models["bw"], named_models["bw_normal"]
+    model_joints, model_coarse, model_pose = named_models["joints"], named_models["coarse"], named_models["pose"]
+    model_joints_add = named_models.get("joints_add")
+
+    # Opt-in int8 dynamic quantization on CPU: `INFER_QUANTIZE` is "all" or a list of the model names,
+    # `INFER_QUANTIZE_EXCLUDE` a list of models kept in fp32. Check the accuracy with `quantize_eval.py` first
+    quantize = [k for k in os.getenv("INFER_QUANTIZE", "").split(",") if k]
+    if quantize and backend in EXPORT_FORMATS:
+        print(f"Skipping quantization of the models exported to {backend}")
+        quantize = []
+    quantize = list(named_models) if quantize == ["all"] else quantize
+    quantize = [k for k in quantize if k not in os.getenv("INFER_QUANTIZE_EXCLUDE", "").split(",")]
+    for name in quantize:
+        if name not in named_models:
+            raise ValueError(f"Unknown model to quantize: '{name}', choose from {list(named_models)}")
+        if device.type != "cpu":
+            print(f"Skipping quantization of model '{name}', only supported on CPU")
+            continue
+        quantize_dynamic(named_models[name])
+        print(f"Quantized model '{name}' to int8")
+
+    # Keep one copy of the frozen encoder and run it once per input for all models
+    if backend not in EXPORT_FORMATS:  # exported encoders are already deduplicated
+        share_frozen_modules(list(named_models.values()))
+    if backend == "compile":
+        for model in named_models.values():
+            compile_model(model)
+    shared_encoder = SharedEncoder()
+    # Vertices decoded at once by `model_forward_bw`: `INFER_CHUNK_MB` of activations, or a share of the free memory
+    query_planner = ChunkPlanner.from_env()
+    # Bone weights of meshes above `BW_MULTIRES_MIN_VERTS` vertices from a proxy of `BW_QUALITY` of them (1 for all),
+    # see `model_forward_bw_multires`, `bw_quality_eval.py` for the speed/accuracy trade-off
+    bw_quality = float(os.getenv("BW_QUALITY", 1.0))
+    bw_multires_min_verts = int(os.getenv("BW_MULTIRES_MIN_VERTS", 200000))
+
+    # Batch the forwards of concurrent requests (not on ZeroGPU, where they must run in the `spaces.GPU` context)
+    max_batch_size = 1 if IS_HF_ZEROGPU else int(os.getenv("INFER_MAX_BATCH", 1))
+    max_wait = float(os.getenv("INFER_MAX_WAIT_MS", 10)) / 1000
+    batched_forward = {
+        "coarse": forward_coarse,
+        "bones": forward_bones,
+        "bw": functools.partial(shared_encoder.encode_context, model_bw),
+        "bw_normal": functools.partial(shared_encoder.encode_context, model_bw_normal),
+    }
+    if max_batch_size > 1:
+        batched_forward = {
+            k: BatchScheduler(fn, max_batch_size=max_batch_size, max_wait=max_wait, name=k)
+            for k, fn in batched_forward.items()
+        }
+
+    # Persistent Blender processes with preloaded templates for `vis_blender` from Gradio's worker threads
+    blender_workers = int(os.getenv("BLENDER_WORKERS", 0))
+    blender_pool = BlenderWorkerPool(blender_workers, [TEMPLATE_PATH, TEMPLATE_PATH_ADD]) if blender_workers > 0 else None
+
+    stage_pipeline = build_pipeline(RigCache.from_env())
+
     clear()
 
 
@@ -1577,7 +2096,7 @@ def init_blocks():
                 inputs={output_rest_vis, output_anim, output_anim_vis},
                 outputs=[output_rest_vis, output_anim, output_anim_vis],
             ).success(
-                fn=vis_blender,
+                fn=animate,
                 inputs=[
                     input_reset_to_rest,
                     input_no_fingers,
@@ -8,15 +8,34 @@ import trimesh
 from pytorch3d.transforms import Scale
 
 import util.blender_utils as blender_utils
+from gs_io import GaussianSplats
+from handoff import HANDOFF_SUFFIX, load_handoff
+from skinning import SparseWeights, Weights, remap_bones, repeat_weights, unpack_weights
 from util.blender_utils import bpy as bpy
 from util.utils import HiddenPrints, save_gs, transform_gs
 
+# Template path (absolute) -> .blend with its objects, filled by the persistent workers of `blender_worker.py`
+TEMPLATE_CACHE: dict[str, str] = {}
+
 
 def is_finger(bone_name: str):
     return any(f in bone_name for f in {"Thumb", "Index", "Middle", "Ring", "Pinky"})
 
 
-def remove_fingers_from_data(data: np.ndarray, bones_idx_dict: dict[str, int], is_bw=False):
+def remove_fingers_from_data(data: np.ndarray | SparseWeights, bones_idx_dict: dict[str, int], is_bw=False):
+    if isinstance(data, SparseWeights):
+        # Finger weights are merged into the hands, as for dense [K, N] `data`
+        assert is_bw and data.num_bones == len(bones_idx_dict)
+        bones_kept = sorted((k for k in bones_idx_dict if not is_finger(k)), key=bones_idx_dict.get)
+        index_map = np.full(len(bones_idx_dict), -1)
+        for i, k in enumerate(bones_kept):
+            index_map[bones_idx_dict[k]] = i
+        for k, v in bones_idx_dict.items():
+            if is_finger(k):
+                hand = "Left" if "Left" in k else "Right"
+                index_map[v] = index_map[bones_idx_dict[f"mixamorig:{hand}Hand"]]
+        return remap_bones(data, index_map, len(bones_kept))
+
     assert data.shape[0] == len(bones_idx_dict)
     if is_bw:
         for k, v in bones_idx_dict.items():
@@ -32,8 +51,47 @@ def remove_fingers_from_data(data: np.ndarray, bones_idx_dict: dict[str, int], i
     return data_new
 
 
+def set_weights(objs: list, bw: Weights, bones_idx_dict: dict[str, int]):
+    if not isinstance(bw, SparseWeights):
+        blender_utils.set_weights(objs, bw, bones_idx_dict)
+        return
+    # Only visit the nonzero entries, with one `add` call per (bone, weight): the vertices fully bound to a bone, and
+    # any other shared weight, are added at once (the weights are float32 in Blender too, so the grouping is exact)
+    bones_name = {v: k for k, v in bones_idx_dict.items()}
+    indices, weights = np.asarray(bw.indices), np.asarray(bw.weights, dtype=np.float32)
+    verts, slots = np.nonzero(weights > 0)
+    bones, weights = indices[verts, slots], weights[verts, slots]
+    order = np.lexsort((verts, weights, bones))
+    verts, bones, weights = verts[order], bones[order], weights[order]
+    splits = np.flatnonzero((np.diff(bones) != 0) | (np.diff(weights) != 0)) + 1
+    groups = [
+        (int(bones_[0]), float(weights_[0]), verts_.tolist())
+        for verts_, bones_, weights_ in zip(*(np.split(x, splits) for x in (verts, bones, weights)))
+        if len(verts_) > 0
+    ]
+    for obj in objs:
+        for bone, weight, verts_ in groups:
+            name = bones_name[bone]
+            vertex_group = obj.vertex_groups.get(name) or obj.vertex_groups.new(name=name)
+            vertex_group.add(verts_, weight, "REPLACE")
+
+
+def load_template(template_path: str) -> list:
+    """Same as `blender_utils.load_file(template_path)`, appending the objects from the cached .blend if any"""
+    cache_path = TEMPLATE_CACHE.get(os.path.abspath(template_path))
+    if cache_path is None:
+        return blender_utils.load_file(template_path)
+    with bpy.data.libraries.load(cache_path, link=False) as (data_from, data_to):
+        data_to.objects = data_from.objects
+    for obj in data_to.objects:
+        bpy.context.scene.collection.objects.link(obj)
+    return list(data_to.objects)
+
+
 def main(args: argparse.Namespace):
-    if isinstance(args.input_path, str):
+    if isinstance(args.input_path, str) and args.input_path.endswith(HANDOFF_SUFFIX):
+        data = load_handoff(args.input_path)
+    elif isinstance(args.input_path, str):
         data = np.load(args.input_path, allow_pickle=True)
     else:
         assert isinstance(args.input_path, dict)
@@ -44,7 +102,7 @@ def main(args: argparse.Namespace):
     gs = data["gs"]
     joints = data["joints"]
     joints_tail = data["joints_tail"]
-    bw = data["bw"]
+    bw = unpack_weights(data)
     pose = data["pose"]
     bones_idx_dict = data["bones_idx_dict"]
     if isinstance(bones_idx_dict, np.ndarray):
@@ -54,7 +112,10 @@ def main(args: argparse.Namespace):
     if args.remove_fingers:
         joints = remove_fingers_from_data(joints, bones_idx_dict)
         joints_tail = remove_fingers_from_data(joints_tail, bones_idx_dict)
-        bw = remove_fingers_from_data(bw.T, bones_idx_dict, is_bw=True).T
+        if isinstance(bw, SparseWeights):
+            bw = remove_fingers_from_data(bw, bones_idx_dict, is_bw=True)
+        else:
+            bw = remove_fingers_from_data(bw.T, bones_idx_dict, is_bw=True).T
         if pose is not None:
             pose = remove_fingers_from_data(pose, bones_idx_dict)
         joints_list = [None] * len(bones_idx_dict)
@@ -67,7 +128,7 @@ def main(args: argparse.Namespace):
     with HiddenPrints(suppress_err=True):
         blender_utils.reset()
 
-        template = blender_utils.load_file(args.template_path)
+        template = load_template(args.template_path)
         for mesh_obj in blender_utils.get_all_mesh_obj(template):
             bpy.data.objects.remove(mesh_obj, do_unlink=True)
         armature_obj = blender_utils.get_armature_obj(template)
@@ -110,7 +171,7 @@ def main(args: argparse.Namespace):
             bpy.ops.object.transform_apply(rotation=True)
             blender_utils.update()
         blender_utils.set_armature_parent([mesh_obj], armature_obj)
-        blender_utils.set_weights([mesh_obj], bw, bones_idx_dict)
+        set_weights([mesh_obj], bw, bones_idx_dict)
         if not args.keep_raw:
             armature_obj.matrix_world = matrix_world
         blender_utils.remove_empty()
@@ -173,14 +234,17 @@ def main(args: argparse.Namespace):
             if gs is not None:
                 mesh_obj.hide_set(True)
                 with tempfile.NamedTemporaryFile(suffix=".ply") as f:
-                    gs = torch.from_numpy(gs)
-                    gs = transform_gs(gs, transform=(Scale(1 / scaling)))
-                    save_gs(gs, f.name)
+                    if isinstance(gs, str):  # `.ply` file streamed by `app.vis_blender`
+                        GaussianSplats(gs).transformed(transform_gs, Scale(1 / scaling)).save(f.name)
+                    else:
+                        gs = torch.from_numpy(gs)
+                        gs = transform_gs(gs, transform=(Scale(1 / scaling)))
+                        save_gs(gs, f.name)
                     gs_obj = blender_utils.load_3dgs(f.name)
                     gs_obj = blender_utils.get_all_mesh_obj(gs_obj)[0]
                     gs_obj.name = gs_obj.data.name = "gs"
                 blender_utils.set_armature_parent([gs_obj], armature_obj, type="ARMATURE_NAME", no_inv=True)
-                blender_utils.set_weights([gs_obj], bw.repeat(4, axis=0), bones_idx_dict)
+                set_weights([gs_obj], repeat_weights(bw, 4), bones_idx_dict)
                 bpy.ops.sna.dgs__set_render_engine_to_eevee_7516e()
                 # bpy.ops.sna.dgs__start_camera_update_9eaff()
 
@@ -0,0 +1,331 @@
+"""Headless batch rigging of a directory or a manifest of meshes / Gaussian Splats, with the stages of `app._pipeline`
+
+Inputs are loaded and sampled (`app.load_input`) in a pool of processes, the models run in this process one asset
+at a time, and the Blender exports (`app.vis_blender`) run in parallel threads, each driving its own Blender process
+(one of the `BLENDER_WORKERS` persistent workers, or a subprocess per job). Every finished asset is appended to a
+progress file, and the assets already done with the same options are skipped when the batch is run again.
+Usage:
+    python batch_rig.py <directory or manifest> [--workers 4] [--blender_jobs 2] [--gs auto]
+
+A manifest is either a `.txt` file with one input path per line, or a `.jsonl` file with one object per line,
+holding the input path as "input" and optionally any option of `app.pipeline_options` for this asset, e.g.
+    {"input": "chars/knight.glb", "no_fingers": false, "rest_pose_type": "T-pose"}
+Relative paths are relative to the manifest.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from glob import glob
+
+import numpy as np
+import torch
+
+import app
+from gs_io import GaussianSplats
+from handoff import HANDOFF_DIR, HANDOFF_SUFFIX, load_handoff, save_handoff
+from rig_cache import cache_key
+from util.utils import str2bool, str2list
+
+INPUT_EXTENSIONS = (".fbx", ".glb", ".gltf", ".obj", ".ply")
+
+
+def load_asset(input_path: str, is_gs: bool | None, opacity_threshold: float, num_samples: int):
+    """`app.load_input` in a worker process. The results are passed back through a handoff file instead of pickling.
+
+    Args:
+        is_gs: None to detect it, i.e. a `.ply` file loadable as Gaussian Splats
+    Returns:
+        handoff path, whether the input is Gaussian Splats, seconds spent
+    """
+    start = time.perf_counter()
+    loaded = None
+    if is_gs is None:
+        is_gs = input_path.endswith(".ply")
+        if is_gs:
+            try:
+                loaded = app.load_input(input_path, True, opacity_threshold, num_samples)
+            except app.gr.Error:
+                is_gs = False
+    if loaded is None:
+        loaded = app.load_input(input_path, is_gs, opacity_threshold, num_samples)
+
+    loaded.pop("sampler", None)  # rebuilt by `app.preprocess` in the main process
+    if loaded["gs"] is not None:
+        loaded["gs"] = loaded["gs"].path  # memory-mapped again by `read_asset`
+    tensors = [k for k, v in loaded.items() if isinstance(v, torch.Tensor)]
+    data = {k: v.numpy() if k in tensors else v for k, v in loaded.items()}
+    fd, path = tempfile.mkstemp(suffix=HANDOFF_SUFFIX, dir=HANDOFF_DIR)
+    os.close(fd)
+    try:
+        save_handoff(path, {**data, "tensors": tensors})
+    except:
+        os.remove(path)
+        raise
+    return path, is_gs, time.perf_counter() - start
+
+
+def read_asset(path: str) -> dict:
+    """Inverse of the handoff of `load_asset`, removes the file"""
+    try:
+        data = load_handoff(path)
+    finally:
+        os.remove(path)  # the memory maps stay valid
+    tensors = data.pop("tensors")
+    data = {k: torch.from_numpy(np.asarray(v)) if k in tensors else v for k, v in data.items()}
+    if data["gs"] is not None:
+        data["gs"] = GaussianSplats(data["gs"])
+    return data
+
+
+def list_assets(input_path: str, defaults: dict) -> list[dict]:
+    """
+    Returns:
+        list of {"input_path", "options"} with absolute paths, one per input (a mesh and its sibling `.ply` are one input)
+    """
+    entries: list[tuple[str, dict]] = []
+    if os.path.isdir(input_path):
+        # Not recursive, the outputs of every input are written to a sub-directory next to it
+        for path in sorted(glob(os.path.join(input_path, "*"))):
+            if os.path.splitext(path)[-1].lower() in INPUT_EXTENSIONS:
+                entries.append((path, {}))
+    else:
+        root = os.path.dirname(os.path.abspath(input_path))
+        with open(input_path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if input_path.endswith(".jsonl"):
+                    entry: dict = json.loads(line)
+                    entries.append((os.path.join(root, entry.pop("input")), entry))
+                else:
+                    entries.append((os.path.join(root, line), {}))
+
+    assets = {}
+    for path, overrides in entries:
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            print(f"Skipping missing input '{path}'")
+            continue
+        path = app.resolve_input_path(path)
+        if path in assets:
+            continue
+        options = {**defaults, **overrides}
+        if options.get("animation_file") is not None:
+            options["animation_file"] = os.path.abspath(options["animation_file"])
+        assets[path] = {"input_path": path, "options": options}
+    return list(assets.values())
+
+
+def asset_key(asset: dict) -> str:
+    """Identifies an asset in the progress file, by its path, file stats and options"""
+    stat = os.stat(asset["input_path"])
+    return cache_key(asset["input_path"], stat.st_size, stat.st_mtime_ns, asset["options"])
+
+
+def read_progress(progress_path: str) -> dict[str, dict]:
+    """Last record of every asset key in the progress file"""
+    progress = {}
+    if os.path.isfile(progress_path):
+        with open(progress_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # interrupted while writing
+                    continue
+                progress[record["key"]] = record
+    return progress
+
+
+def print_report(records: list[dict]):
+    """Per-asset timing table (seconds) and totals"""
+    if not records:
+        return
+    columns = list(dict.fromkeys(k for record in records for k in record["timings"]))
+    width = max(len(os.path.basename(record["input"])) for record in records)
+    print(f"{'asset':<{width}} {'status':<6} " + " ".join(f"{c:>13}" for c in columns))
+    for record in records:
+        timings = " ".join(
+            f"{record['timings'][c]:>13.2f}" if c in record["timings"] else f"{'-':>13}" for c in columns
+        )
+        print(f"{os.path.basename(record['input']):<{width}} {record['status']:<6} {timings}")
+    totals = " ".join(f"{sum(r['timings'].get(c, 0.0) for r in records):>13.2f}" for c in columns)
+    print(f"{'total':<{width}} {'':<6} {totals}")
+
+
+def main(args):
+    defaults = dict(
+        opacity_threshold=args.opacity_threshold,
+        no_fingers=args.no_fingers,
+        rest_pose_type=args.rest_pose_type,
+        ignore_pose_parts=args.ignore_pose_parts,
+        input_normal=args.input_normal,
+        bw_fix=args.bw_fix,
+        bw_vis_bone=args.bw_vis_bone,
+        reset_to_rest=args.reset_to_rest,
+        animation_file=args.animation_file,
+        retarget=args.retarget,
+        inplace=args.inplace,
+    )
+    if args.gs != "auto":
+        defaults["is_gs"] = str2bool(args.gs)
+    assets = list_assets(args.input, defaults)
+    progress_path = args.progress or (
+        os.path.join(args.input, "batch_rig_progress.jsonl")
+        if os.path.isdir(args.input)
+        else f"{os.path.splitext(args.input)[0]}_progress.jsonl"
+    )
+    progress_path = os.path.abspath(progress_path)
+    progress = read_progress(progress_path)
+    for asset in assets:
+        asset["key"] = asset_key(asset)
+    todo = [asset for asset in assets if progress.get(asset["key"], {}).get("status") != "done"]
+    print(f"{len(assets)} assets, {len(assets) - len(todo)} already done, progress in '{progress_path}'")
+    if not todo:
+        return
+
+    app.init_models()  # changes the working directory, all paths are absolute from here
+    app.init_blocks()  # the stages return Gradio outputs keyed by the components
+    stage_names = [stage.name for stage in app.stage_pipeline.stages]
+    stage_names = stage_names[: stage_names.index("vis_bw") + 1]  # `vis_blender` runs in `export`
+
+    records: list[dict] = []
+    lock = threading.Lock()
+    progress_file = open(progress_path, "a")
+
+    def write_record(asset: dict, status: str, timings: dict, db: app.DB = None, error: str = None):
+        record = dict(input=asset["input_path"], key=asset["key"], status=status, timings=timings)
+        if db is not None:
+            record.update(output_dir=db.output_dir, anim_path=db.anim_path if args.blender_jobs > 0 else None)
+        if error is not None:
+            record["error"] = error
+            print(f"Failed to rig '{asset['input_path']}':\n{error}")
+        with lock:
+            records.append(record)
+            progress_file.write(json.dumps(record) + "\n")
+            progress_file.flush()
+
+    # Bound the assets waiting for Blender, each one holds its mesh & weights
+    export_slots = threading.BoundedSemaphore(max(args.blender_jobs, 1) * 2)
+
+    def export(asset: dict, options: dict, db: app.DB, timings: dict, start: float):
+        try:
+            t = time.perf_counter()
+            app.vis_blender(
+                options["reset_to_rest"],
+                options["no_fingers"],
+                options["rest_pose_type"],
+                options["ignore_pose_parts"],
+                options["animation_file"],
+                options["retarget"],
+                options["inplace"],
+                db,
+            )
+            timings["vis_blender"] = time.perf_counter() - t
+            if not os.path.isfile(db.anim_path):
+                raise RuntimeError(f"Blender did not output '{db.anim_path}'")
+            timings["total"] = time.perf_counter() - start
+            write_record(asset, "done", timings, db)
+        except Exception:
+            write_record(asset, "failed", timings, db, traceback.format_exc())
+        finally:
+            db.clear()
+            export_slots.release()
+
+    start_all = time.perf_counter()
+    pending: deque[tuple[dict, Future]] = deque()
+    queue = iter(todo)
+    exports: list[Future] = []
+    with (
+        ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as loaders,
+        ThreadPoolExecutor(max(args.blender_jobs, 1)) as exporters,
+    ):
+
+        def prefetch():
+            while len(pending) < args.workers + args.prefetch and (asset := next(queue, None)) is not None:
+                options = asset["options"]
+                future = loaders.submit(
+                    load_asset, asset["input_path"], options.get("is_gs"), options["opacity_threshold"], app.N
+                )
+                pending.append((asset, future))
+
+        prefetch()
+        while pending:
+            asset, future = pending.popleft()
+            prefetch()
+            start = time.perf_counter()
+            timings = {}
+            db = app.DB()
+            try:
+                handoff_path, is_gs, timings["load"] = future.result()
+                timings["wait"] = time.perf_counter() - start  # main process idle, waiting for the loaders
+                options = app.pipeline_options(
+                    asset["input_path"], **{**asset["options"], "is_gs": is_gs}, export_temp=False
+                )
+                options["loaded"] = read_asset(handoff_path)
+                t = time.perf_counter()
+                for name, _ in zip(stage_names, app.stage_pipeline.run(options, db, until="vis_bw")):
+                    timings[name] = time.perf_counter() - t
+                    t = time.perf_counter()
+            except Exception:
+                write_record(asset, "failed", timings, db, traceback.format_exc())
+                db.clear()
+                continue
+            if args.blender_jobs > 0:
+                export_slots.acquire()
+                exports.append(exporters.submit(export, asset, options, db, timings, start))
+            else:
+                timings["total"] = time.perf_counter() - start
+                write_record(asset, "done", timings, db)
+                db.clear()
+        for future in exports:
+            future.result()
+    progress_file.close()
+    if app.blender_pool is not None:
+        app.blender_pool.close()
+
+    print_report(records)
+    num_done = sum(record["status"] == "done" for record in records)
+    print(
+        f"Rigged {num_done}/{len(records)} assets in {time.perf_counter() - start_all:.1f}s "
+        f"({len(records) - num_done} failed, see '{progress_path}')"
+    )
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=str, help="Directory of input files, or a `.txt` / `.jsonl` manifest")
+    parser.add_argument("--progress", type=str, default=None, help="Progress file, next to the input by default")
+    parser.add_argument("--workers", default=max(min(os.cpu_count() - 1, 4), 1), type=int, help="Loading processes")
+    parser.add_argument("--prefetch", default=2, type=int, help="Assets loaded ahead beyond one per loader")
+    parser.add_argument(
+        "--blender_jobs",
+        default=2,
+        type=int,
+        help="Parallel Blender exports (`BLENDER_WORKERS` persistent workers are used if set), 0 to skip Blender",
+    )
+    parser.add_argument("--gs", default="auto", type=str, help="Inputs are Gaussian Splats: true, false or auto")
+    parser.add_argument("--opacity_threshold", default=0.01, type=float)
+    parser.add_argument("--no_fingers", default=True, type=str2bool)
+    parser.add_argument("--rest_pose_type", default="No", type=str, choices=("T-pose", "A-pose", "大-pose", "No"))
+    parser.add_argument("--ignore_pose_parts", default=[], type=str2list(str), help="Among Fingers, Arms, Legs, Head")
+    parser.add_argument("--input_normal", default=False, type=str2bool)
+    parser.add_argument("--bw_fix", default=True, type=str2bool)
+    parser.add_argument("--bw_vis_bone", default="LeftArm", type=str)
+    parser.add_argument("--reset_to_rest", default=True, type=str2bool)
+    parser.add_argument("--animation_file", default=None, type=str)
+    parser.add_argument("--retarget", default=True, type=str2bool)
+    parser.add_argument("--inplace", default=True, type=str2bool)
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
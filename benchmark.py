@@ -0,0 +1,603 @@
+"""Equivalence checks & micro-benchmarks of the inference paths (random weights, no checkpoints needed)
+Usage:
+    python benchmark.py <name> [--device cpu] [--repeat 20] [--checkpoint_dir output/best/new]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+import models_ae
+from export import compare, export_models, load_exported
+from gs_io import GS_PROPERTIES, PLY_PROPERTIES, GaussianSplats, activate, deactivate
+from inference import BatchScheduler
+from model import FPS_MODES, PCAE, InputAttention, JointsAttention, JointsAttentionCausal, LatentContext
+from models_ae import ATTENTION_BACKENDS, Attention, set_attention_backend
+from plyfile import PlyData, PlyElement
+from skinning import SparseWeights, lbs_points, map_weights, to_dense
+from splat_mesh import SH_0, face_attributes, load_splats, splat_quads
+from util.dataset_mixamo import KINEMATIC_TREE
+from util.utils import find_ckpt
+
+
+def timeit(fn, repeat=20, warmup=3) -> float:
+    """Returns average milliseconds per call"""
+    for _ in range(warmup):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def allocated_memory(fn) -> int:
+    """Returns total bytes allocated by `fn` (peak on CUDA)"""
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn()
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    return sum(max(e.self_cpu_memory_usage, 0) for e in prof.key_averages())
+
+
+def peak_memory(fn) -> int:
+    """Returns peak bytes allocated by torch during `fn`"""
+    if torch.cuda.is_available():
+        return allocated_memory(fn)
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    # Allocations are attributed to their op (at its start), frees are "[memory]" events
+    events = sorted(prof.events(), key=lambda e: e.time_range.start)
+    current = peak = 0
+    for e in events:
+        current += e.self_cpu_memory_usage
+        peak = max(peak, current)
+    return peak
+
+
+def peak_memory_numpy(fn) -> int:
+    """Returns peak bytes allocated by numpy during `fn`"""
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def causal_heads(feat_dim=512, checkpoint_dir: str = None):
+    """Causal heads as configured by `PCAE` for `model_joints` and `model_pose` in `app.py`
+    Args:
+        checkpoint_dir: with the `joints.pth` & `pose.pth` checkpoints of `app.load_models` to load the heads from
+            (random weights if None)
+    """
+    heads = {
+        "joints": JointsAttentionCausal(
+            feat_dim, kinematic_tree=KINEMATIC_TREE, out_type="joints", include_joints_tail=True, out_dim=6
+        ),
+        "pose": JointsAttentionCausal(
+            feat_dim, kinematic_tree=KINEMATIC_TREE, out_type="pose", out_dim=6, rotation_dim=6
+        ),
+    }
+    if checkpoint_dir:
+        for name, head in heads.items():
+            pth_path = find_ckpt(os.path.join(checkpoint_dir, f"{name}.pth"))
+            prefix = f"{name}_head."
+            state_dict = torch.load(pth_path, map_location="cpu")["model"]
+            state_dict = {k[len(prefix) :]: v for k, v in state_dict.items() if k.startswith(prefix)}
+            missing = {k for k, _ in head.named_parameters()} - set(state_dict)
+            assert not missing, f"Missing parameters of the {name} head in {pth_path}: {sorted(missing)}"
+            head.load_state_dict({k: v for k, v in state_dict.items() if k in head.state_dict()}, strict=False)
+            print(f"Loaded the {name} head from {pth_path}")
+    return heads
+
+
+def causal_step_error(head: JointsAttentionCausal, feat: torch.Tensor, out: torch.Tensor) -> float:
+    """Max error of every tree level of `out` against a full `_forward` conditioned on the same upper levels.
+    With random weights, `Embedder3D` amplifies rounding errors along deep chains of joints,
+    so end-to-end differences of the outputs are not a meaningful equivalence check.
+    """
+    err = 0.0
+    decoded = torch.zeros_like(head.tree_levels_mask[0])
+    for mask in head.tree_levels_mask:
+        if not mask.any():
+            continue
+        ref = head._forward(feat, out * decoded.unsqueeze(-1))
+        err = max(err, (ref[:, mask] - out[:, mask]).abs().max().item())
+        decoded = decoded | mask
+    return err
+
+
+def causal_end_to_end_error(head: JointsAttentionCausal, feat: torch.Tensor) -> list[float]:
+    """Max error of every tree level of the incremental decoding against the loop, end to end, in float64"""
+    head.double()
+    feat = feat.double()
+    head.incremental = False
+    ref = head(feat)
+    head.incremental = True
+    out = head(feat)
+    head.float()
+    return [(ref[:, mask] - out[:, mask]).abs().max().item() for mask in head.tree_levels_mask if mask.any()]
+
+
+@torch.no_grad()
+def bench_causal(args):
+    """Incremental level-by-level decoding vs re-running the full transformer per tree level.
+    Every level is checked against the loop conditioned on the same upper levels (`causal_step_error`). The end-to-end
+    errors of the whole tree in float64 (`causal_end_to_end_error`, of the trained heads with `--checkpoint_dir`) are
+    only reported: the errors of the ancestors are amplified by every level (through `Embedder3D` of the joints).
+    """
+    for name, head in causal_heads(checkpoint_dir=args.checkpoint_dir).items():
+        head.to(args.device).eval()
+        feat = torch.randn(args.batch_size, len(KINEMATIC_TREE), 512, device=args.device)
+        head.incremental = False
+        ref = head(feat)
+        t_ref = timeit(lambda: head(feat), args.repeat)
+        head.incremental = True
+        out = head(feat)
+        t_out = timeit(lambda: head(feat), args.repeat)
+        err = causal_step_error(head, feat, out)
+        errs_f64 = causal_end_to_end_error(head, feat)
+        print(
+            f"[causal/{name}] levels: {len(errs_f64)} | max abs diff per level: {err:.2e} | "
+            f"end-to-end: {(out - ref).abs().max().item():.2e}, float64: {max(errs_f64):.2e} | "
+            f"loop: {t_ref:.2f} ms | incremental: {t_out:.2f} ms | speedup: {t_ref / t_out:.2f}x"
+        )
+        assert err <= args.atol, f"causal/{name}: {err=} > {args.atol=}"
+
+
+def legacy_condition(head: JointsAttentionCausal, out: torch.Tensor) -> torch.Tensor:
+    """Parents' features via the dense B x N x N x D expand, as before `JointsAttentionCausal.parent_index`"""
+    B, N, _ = out.shape
+    mask_parent = torch.zeros(N, N, dtype=torch.bool, device=out.device)
+    mask_parent[head.has_parent, head.parent_index[head.has_parent]] = True
+    if head.out_type == "pose" and out.shape[-1] == 6:
+        from util.utils import matrix_to_ortho6d, ortho6d_to_matrix
+
+        out = matrix_to_ortho6d(ortho6d_to_matrix(out))
+    out_feat: torch.Tensor = head.encoder(out)
+    out_feat = out_feat.unsqueeze(1).expand(-1, N, -1, -1).clone()
+    out_feat[~mask_parent.expand(B, -1, -1)] = 0
+    return out_feat.sum(-2)
+
+
+def bench_parent(args):
+    """Parent-index gather vs dense expand + mask + sum, for training (forward + backward) and inference"""
+    for name, head in causal_heads().items():
+        head.to(args.device)
+        out = torch.randn(args.batch_size, len(KINEMATIC_TREE), head.out_dim, device=args.device)
+        with torch.no_grad():
+            ref = legacy_condition(head, out)
+            new = head._condition(out)
+        err = (ref - new).abs().max().item()
+        for mode in ("train", "eval"):
+
+            def run(fn):
+                if mode == "train":
+                    fn(head, out).sum().backward()
+                else:
+                    with torch.no_grad():
+                        fn(head, out)
+
+            def cond(head: JointsAttentionCausal, out: torch.Tensor):
+                return head._condition(out)
+
+            t_ref, t_new = timeit(lambda: run(legacy_condition), args.repeat), timeit(lambda: run(cond), args.repeat)
+            m_ref, m_new = allocated_memory(lambda: run(legacy_condition)), allocated_memory(lambda: run(cond))
+            print(
+                f"[parent/{name}/{mode}] B={args.batch_size} | max abs diff: {err:.2e} | "
+                f"expand: {t_ref:.2f} ms, {m_ref / 2**20:.1f} MiB | gather: {t_new:.2f} ms, {m_new / 2**20:.1f} MiB"
+            )
+        assert err <= args.atol, f"parent/{name}: {err=} > {args.atol=}"
+
+
+def random_skinning(num_points: int, num_bones=52, k=4):
+    """Random rigid bone transforms [K, 4, 4], points [N, 3] and top-k weights"""
+    rotation = np.linalg.qr(np.random.randn(num_bones, 3, 3))[0]
+    transforms = np.tile(np.eye(4, dtype=np.float32), (num_bones, 1, 1))
+    transforms[:, :3, :3] = rotation
+    transforms[:, :3, 3] = np.random.randn(num_bones, 3)
+    points = np.random.randn(num_points, 3).astype(np.float32)
+    indices = np.argsort(np.random.rand(num_points, num_bones), axis=-1)[:, :k].astype(np.int16)
+    weights = np.random.rand(num_points, k).astype(np.float32)
+    weights /= weights.sum(-1, keepdims=True)
+    return transforms, points, SparseWeights(indices, weights, num_bones)
+
+
+def bench_lbs(args):
+    """Chunked top-k LBS vs dense einsum of [N, 4, 4] transforms + homogeneous transform of the points"""
+    transforms, points, bw = random_skinning(args.num_points)
+    bw_dense = to_dense(bw)
+
+    def baseline():
+        lbs_transform = np.einsum("kij,nk->nij", transforms, bw_dense)
+        return (lbs_transform[:, :3, :3] @ points[..., None])[..., 0] + lbs_transform[:, :3, 3]
+
+    ref = baseline()
+    t_ref, m_ref = timeit(baseline, args.repeat, warmup=1), peak_memory_numpy(baseline)
+    print(f"[lbs] N={args.num_points} | einsum: {t_ref:.1f} ms, {m_ref / 2**20:.1f} MiB")
+
+    transforms_t, points_t = torch.from_numpy(transforms).to(args.device), torch.from_numpy(points).to(args.device)
+    bw_t = map_weights(bw, lambda x: torch.from_numpy(x).to(args.device))
+    candidates = {
+        "numpy/sparse": (lambda: lbs_points(points, transforms, bw), peak_memory_numpy),
+        "numpy/dense": (lambda: lbs_points(points, transforms, bw_dense), peak_memory_numpy),
+        # Peak memory of torch is only tracked on CUDA
+        "torch/sparse": (
+            lambda: lbs_points(points_t, transforms_t, bw_t),
+            allocated_memory if torch.cuda.is_available() else None,
+        ),
+    }
+    for name, (fn, memory_fn) in candidates.items():
+        out = fn()
+        out = out.cpu().numpy() if isinstance(out, torch.Tensor) else out
+        err = np.abs(out - ref).max()
+        t = timeit(fn, args.repeat, warmup=1)
+        m = "n/a" if memory_fn is None else f"{memory_fn(fn) / 2**20:.1f} MiB"
+        print(f"[lbs/{name}] max abs diff: {err:.2e} | {t:.1f} ms ({t_ref / t:.2f}x), {m}")
+        assert err <= args.atol, f"lbs/{name}: {err=} > {args.atol=}"
+
+
+@torch.no_grad()
+def bench_batching(args):
+    """Concurrent requests through `BatchScheduler`, unbatched (max batch size 1) vs batched"""
+    model = PCAE(N=2048, predict_bw=False, predict_joints=True, predict_joints_tail=True).to(args.device).eval()
+
+    def forward(pc: torch.Tensor):
+        # Fixed latent samples instead of the randomly started FPS, for the equivalence check
+        x = model.encode(pc, sampled_pc=pc[:, : model.base.num_latents])
+        return model.query(LatentContext(x, model.decode_latents(x))).joints
+
+    inputs = [torch.rand(1, model.N, 3, device=args.device) for _ in range(args.concurrency)]
+    refs = [forward(pc) for pc in inputs]
+    for max_batch_size in (1, args.max_batch_size):
+        scheduler = BatchScheduler(
+            forward, max_batch_size=max_batch_size, max_wait=args.max_wait_ms / 1000, name="batching", log_every=0
+        )
+        errors = [0.0] * args.concurrency
+
+        def client(i: int):
+            for _ in range(args.repeat):
+                errors[i] = max(errors[i], (scheduler(inputs[i]) - refs[i]).abs().max().item())
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        duration = time.perf_counter() - start
+        scheduler.close()
+        err = max(errors)
+        print(
+            f"[batching/max_batch_size={max_batch_size}] {args.concurrency} clients x {args.repeat} requests | "
+            f"max abs diff: {err:.2e} | {args.concurrency * args.repeat / duration:.2f} req/s overall\n"
+            f"    {scheduler.summary()}"
+        )
+        assert err <= args.atol, f"batching/{max_batch_size}: {err=} > {args.atol=}"
+
+
+def attention_sites(args) -> dict:
+    """Call sites of `models_ae.Attention` in `PCAE`, with their shapes: module, inputs, whether to return the scores"""
+    dim = 512
+    return {
+        "encoder_cross_attn": (
+            Attention(dim, dim, heads=1, dim_head=dim),
+            (torch.randn(1, 512, dim), torch.randn(1, args.num_inputs, dim)),
+            False,
+        ),
+        "latent_self_attn": (Attention(dim, heads=8, dim_head=64), (torch.randn(1, 512, dim),), False),
+        "decoder_cross_attn": (
+            Attention(dim, dim, heads=1, dim_head=dim),
+            (torch.randn(1, args.num_queries, dim), torch.randn(1, 512, dim)),
+            False,
+        ),
+        "joints_attn_masked": (
+            JointsAttention(dim, kinematic_tree=KINEMATIC_TREE),
+            (torch.randn(args.batch_size, len(KINEMATIC_TREE), dim),),
+            False,
+        ),
+        "input_attn_score": (
+            InputAttention(dim),
+            (torch.randn(1, args.num_inputs, dim), torch.randn(1, args.num_inputs, 1, dim)),
+            True,
+        ),
+    }
+
+
+@torch.no_grad()
+def bench_attention(args):
+    """Attention backends (`models_ae.set_attention_backend`) against the einsum reference, per call site"""
+    models_ae.ATTENTION_TILE_MB = args.tile_mb
+    for site, (module, inputs, return_score) in attention_sites(args).items():
+        module.to(args.device).eval()
+        if isinstance(module, InputAttention):  # zero-initialized output projection
+            torch.nn.init.normal_(module.attn.to_out.weight, std=0.02)
+            module.closed_form = False
+        inputs = [x.to(args.device) for x in inputs]
+
+        def run():
+            if return_score:
+                return module(*inputs, return_score=True)
+            return (module(*inputs),)
+
+        results = {}
+        for backend in ATTENTION_BACKENDS:
+            set_attention_backend(backend, module)
+            out = run()
+            t = timeit(run, args.repeat, warmup=1)
+            m = peak_memory(run)
+            results[backend] = (out, t, m)
+        ref, t_ref, _ = results["einsum"]
+        for backend, (out, t, m) in results.items():
+            err = max((x - y).abs().max().item() for x, y in zip(out, ref))
+            print(
+                f"[attention/{site}/{backend}] max abs diff: {err:.2e} | "
+                f"{t:.2f} ms ({t_ref / t:.2f}x), peak {m / 2**20:.1f} MiB"
+            )
+            assert err <= args.atol, f"attention/{site}/{backend}: {err=} > {args.atol=}"
+
+
+@torch.no_grad()
+def bench_input_attn(args):
+    """Closed-form `InputAttention` (elementwise over the points) vs the generic `Attention` with one batch per point"""
+    module = InputAttention(512).to(args.device).eval()
+    torch.nn.init.normal_(module.attn.to_out.weight, std=0.02)  # zero-initialized output projection
+    for num_points in (args.num_inputs, args.num_queries):
+        feat = torch.randn(1, num_points, 512, device=args.device)
+        context = torch.randn(1, num_points, 1, 512, device=args.device)
+        results = {}
+        for closed_form in (False, True):
+            module.closed_form = closed_form
+            out = module(feat, context, return_score=True)
+            t = timeit(lambda: module(feat, context), args.repeat, warmup=1)
+            m = peak_memory(lambda: module(feat, context))
+            results[closed_form] = (out, t, m)
+        (ref, ref_score), t_ref, m_ref = results[False]
+        (out, score), t, m = results[True]
+        err = max((out - ref).abs().max().item(), (score - ref_score).abs().max().item())
+        print(
+            f"[input_attn] N={num_points} | max abs diff: {err:.2e} | generic: {t_ref:.1f} ms, peak {m_ref / 2**20:.1f} MiB"
+            f" | closed form: {t:.1f} ms, peak {m / 2**20:.1f} MiB | speedup: {t_ref / t:.2f}x"
+        )
+        assert err <= args.atol, f"input_attn: {err=} > {args.atol=}"
+
+
+@torch.no_grad()
+def bench_export(args):
+    """TorchScript export (`export.py`) vs eager, at a number of queries other than the traced one"""
+    models = {
+        "bw": PCAE(N=2048, output_dim=len(KINEMATIC_TREE)),
+        "joints": PCAE(
+            N=2048,
+            output_dim=len(KINEMATIC_TREE),
+            kinematic_tree=KINEMATIC_TREE,
+            predict_bw=False,
+            predict_joints=True,
+            predict_joints_tail=True,
+            joints_attn_causal=True,
+        ),
+    }
+    models = {k: model.to(args.device).eval() for k, model in models.items()}
+    output_dir = tempfile.mkdtemp()
+    try:
+        export_models(models, output_dir, "torchscript", num_queries=1000)
+        exported = load_exported(output_dir, "torchscript", torch.device(args.device))
+        for name, model in models.items():
+            err, t_ref, t = compare(model, exported[name], args.num_queries, args.repeat)
+            print(
+                f"[export/{name}] max abs diff: {err:.2e} | eager: {t_ref:.1f} ms | "
+                f"torchscript: {t:.1f} ms ({t_ref / t:.2f}x)"
+            )
+            assert err <= args.atol, f"export/{name}: {err=} > {args.atol=}"
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def surface_points(num_points: int, generator: torch.Generator, num_parts=16) -> torch.Tensor:
+    """[N, 3] points on ellipsoids of various sizes, evenly split between them: a rough stand-in for the body parts
+    (and their uneven density) of a sampled character
+    """
+    centers = torch.rand(num_parts, 3, generator=generator) * 2 - 1
+    radii = torch.rand(num_parts, 3, generator=generator) * 0.4 + 0.02
+    part = torch.randint(num_parts, (num_points,), generator=generator)
+    directions = torch.nn.functional.normalize(torch.randn(num_points, 3, generator=generator), dim=-1)
+    return centers[part] + directions * radii[part]
+
+
+@torch.no_grad()
+def bench_fps(args):
+    """`FPS_MODE` of `PCAE.fps_index`: approximate voxel FPS vs exact, with the coverage of the input by the samples
+    (distance of every point to its closest sample, mean & max), on the uniform + hands layout of `app.py`
+    """
+    model = PCAE(N=args.num_inputs, hierarchical_ratio=0.5).to(args.device).eval()
+    generator = torch.Generator().manual_seed(args.seed)
+    pc = torch.stack([surface_points(args.num_inputs, generator) for _ in range(args.batch_size)]).to(args.device)
+    results = {}
+    for mode in FPS_MODES:
+        model.fps_mode = mode
+        sampled = model.fps(pc)
+        t = timeit(lambda: model.fps_index(pc), args.repeat, warmup=1)
+        distances = torch.stack([torch.cdist(x, y).min(-1).values for x, y in zip(pc, sampled)])
+        results[mode] = (t, distances.mean().item(), distances.max(-1).values.mean().item())
+    t_ref, mean_ref, max_ref = results["exact"]
+    for mode, (t, mean, max_) in results.items():
+        print(
+            f"[fps/{mode}] {t:.1f} ms ({t_ref / t:.2f}x) | coverage mean: {mean:.4f} ({mean / mean_ref:.2f}x), "
+            f"max: {max_:.4f} ({max_ / max_ref:.2f}x)"
+        )
+
+
+def bench_gs_io(args):
+    """Streaming `GaussianSplats.save` (chunks of `GS_CHUNK_SIZE` splats) vs reading, transforming & writing all the
+    splats at once as `load_gs` / `save_gs`, with a scaling as the transform, on `--num_points` random splats
+    """
+    rng = np.random.default_rng(args.seed)
+    output_dir = tempfile.mkdtemp()
+    input_path = f"{output_dir}/input.ply"
+    try:
+        vertex = np.empty(args.num_points, dtype=[(name, "<f4") for name in PLY_PROPERTIES])
+        for name in PLY_PROPERTIES:
+            vertex[name] = rng.standard_normal(args.num_points)
+        PlyData([PlyElement.describe(vertex, "vertex")]).write(input_path)
+        del vertex
+
+        def baseline():
+            data = PlyData.read(input_path)["vertex"].data
+            gs = activate(np.stack([data[name] for name in GS_PROPERTIES], axis=-1))
+            gs[:, :3] *= 2
+            gs = deactivate(gs)
+            out = np.zeros(len(gs), dtype=data.dtype)
+            for i, name in enumerate(GS_PROPERTIES):
+                out[name] = gs[:, i]
+            PlyData([PlyElement.describe(out, "vertex")]).write(f"{output_dir}/baseline.ply")
+
+        def streaming():
+            GaussianSplats(input_path).transformed(lambda gs: gs * torch.tensor([2] * 3 + [1] * 11)).save(
+                f"{output_dir}/streaming.ply"
+            )
+
+        results = {}
+        for name, fn in (("baseline", baseline), ("streaming", streaming)):
+            results[name] = (timeit(fn, args.repeat, warmup=1), peak_memory_numpy(fn))
+        ref = GaussianSplats(f"{output_dir}/baseline.ply").tensor()
+        err = (GaussianSplats(f"{output_dir}/streaming.ply").tensor() - ref).abs().max().item()
+        t_ref, m_ref = results["baseline"]
+        for name, (t, m) in results.items():
+            print(
+                f"[gs_io/{name}] N={args.num_points} | {t:.1f} ms ({t_ref / t:.2f}x) | "
+                f"{m / 2**20:.1f} MiB ({m_ref / m:.2f}x less)"
+            )
+        print(f"[gs_io] max abs diff: {err:.2e}")
+        assert err <= args.atol, f"gs_io: {err=} > {args.atol=}"
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def legacy_splat_mesh(splats: dict[str, np.ndarray]) -> tuple[list, list, dict[str, list]]:
+    """Per-splat Python loops of the splat import of the 3DGS addon before `splat_mesh.py`"""
+    n = len(splats["center"])
+    vertices, indices = [], []
+    for i in range(n):
+        vertices += [(-2.0, -2.0, float(i)), (2.0, -2.0, float(i)), (2.0, 2.0, float(i)), (-2.0, 2.0, float(i))]
+        indices += [(i * 4, i * 4 + 1, i * 4 + 2), (i * 4, i * 4 + 2, i * 4 + 3)]
+    attributes = {name: [0.0] * n * 2 for name in ("Vrk_1", "Vrk_2", "Vrk_3", "Vrk_4", "Vrk_5", "Vrk_6")}
+    center, color = [0.0] * n * 2 * 3, [0.0] * n * 2 * 4
+    for i in range(n):
+        quat, scale = splats["quats"][i], splats["scales"][i]
+        length = 1 / np.sqrt(quat[0] * quat[0] + quat[1] * quat[1] + quat[2] * quat[2] + quat[3] * quat[3])
+        x, y, z, w = quat[0] * length, quat[1] * length, quat[2] * length, quat[3] * length
+        RS = [
+            scale[0] * (1 - 2 * (z * z + w * w)),
+            scale[0] * (2 * (y * z + x * w)),
+            scale[0] * (2 * (y * w - x * z)),
+            scale[1] * (2 * (y * z - x * w)),
+            scale[1] * (1 - 2 * (y * y + w * w)),
+            scale[1] * (2 * (z * w + x * y)),
+            scale[2] * (2 * (y * w + x * z)),
+            scale[2] * (2 * (z * w - x * y)),
+            scale[2] * (1 - 2 * (y * y + z * z)),
+        ]
+        for name, (a, b) in zip(attributes, ((0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2))):
+            attributes[name][2 * i] = attributes[name][2 * i + 1] = sum(RS[3 * k + a] * RS[3 * k + b] for k in range(3))
+        for k in range(3):
+            center[6 * i + k] = center[6 * i + 3 + k] = splats["center"][i][k]
+            color[8 * i + k] = color[8 * i + 4 + k] = splats["features_dc"][i][k] * SH_0 + 0.5
+        color[8 * i + 3] = color[8 * i + 7] = splats["opacities"][i]
+    return vertices, indices, {"center": center, "color": color, **attributes}
+
+
+def bench_splat_import(args):
+    """Splat meshes of the 3DGS addon import (`splat_mesh.py`) vs its former per-splat Python loops, from reading the
+    `.ply` to the arrays given to `foreach_set`, on `--num_points` random splats
+    """
+    rng = np.random.default_rng(args.seed)
+    output_dir = tempfile.mkdtemp()
+    path = f"{output_dir}/splats.ply"
+    try:
+        vertex = np.empty(args.num_points, dtype=[(name, "<f4") for name in PLY_PROPERTIES])
+        for name in PLY_PROPERTIES:
+            vertex[name] = rng.standard_normal(args.num_points)
+        PlyData([PlyElement.describe(vertex, "vertex")]).write(path)
+
+        def vectorized():
+            splats = load_splats(path)
+            return splat_quads(len(splats["center"])), face_attributes(splats)
+
+        def legacy():
+            return legacy_splat_mesh(load_splats(path))
+
+        (vertices, triangles), attributes = vectorized()
+        vertices_ref, triangles_ref, attributes_ref = legacy()
+        assert np.array_equal(vertices, np.array(vertices_ref)) and np.array_equal(triangles, np.array(triangles_ref))
+        # Relative: the legacy loops compute the covariances in float32
+        err = max(
+            (np.abs(attributes[k] - np.array(v)) / np.maximum(np.abs(np.array(v)), 1)).max()
+            for k, v in attributes_ref.items()
+        )
+        t_ref, t = timeit(legacy, 1, warmup=0), timeit(vectorized, args.repeat, warmup=1)
+        m_ref, m = peak_memory_numpy(legacy), peak_memory_numpy(vectorized)
+        print(
+            f"[splat_import] N={args.num_points} | max rel diff: {err:.2e} | legacy: {t_ref:.1f} ms, "
+            f"{m_ref / 2**20:.1f} MiB | vectorized: {t:.1f} ms ({t_ref / t:.2f}x), {m / 2**20:.1f} MiB"
+        )
+        assert err <= args.atol, f"splat_import: {err=} > {args.atol=}"
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "causal": bench_causal,
+    "parent": bench_parent,
+    "lbs": bench_lbs,
+    "batching": bench_batching,
+    "attention": bench_attention,
+    "input_attn": bench_input_attn,
+    "export": bench_export,
+    "fps": bench_fps,
+    "gs_io": bench_gs_io,
+    "splat_import": bench_splat_import,
+}
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", choices=("all",) + tuple(BENCHMARKS))
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--batch_size", default=1, type=int)
+    parser.add_argument("--num_points", default=1000000, type=int)
+    parser.add_argument("--num_inputs", default=32768, type=int, help="Sampled points of the encoder")
+    parser.add_argument("--num_queries", default=100000, type=int, help="Vertices queried by the decoder")
+    parser.add_argument("--tile_mb", default=64.0, type=float, help="`ATTENTION_TILE_MB` of the attention benchmark")
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--atol", default=1e-4, type=float, help="Tolerance of the equivalence checks")
+    parser.add_argument("--checkpoint_dir", default=None, type=str, help="Trained heads of the causal benchmark")
+    parser.add_argument("--concurrency", default=8, type=int, help="Concurrent clients of the batching benchmark")
+    parser.add_argument("--max_batch_size", default=8, type=int)
+    parser.add_argument("--max_wait_ms", default=10.0, type=float)
+    parser.add_argument("--seed", default=0, type=int)
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_args_parser().parse_args()
+    for name, fn in BENCHMARKS.items():
+        if args.name in ("all", name):
+            torch.manual_seed(args.seed)
+            np.random.seed(args.seed)
+            fn(args)
@@ -0,0 +1,213 @@
+"""Pool of long-lived Blender (bpy) processes running `app_blender.main`
+
+Every worker preloads the rigging templates once (cached as .blend files) and then serves jobs over a socket pair,
+so a job does not pay for the Python + bpy startup and the FBX template import anymore.
+Crashed or timed-out workers are replaced by fresh ones.
+"""
+
+import argparse
+import hashlib
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from multiprocessing.connection import Connection
+
+# Per user, and only used if no other user can write to it (the workers append the .blend files as is)
+TEMPLATE_CACHE_DIR = os.path.join(tempfile.gettempdir(), f"blender_templates-{os.getuid()}")
+
+
+class BlenderWorkerError(RuntimeError):
+    pass
+
+
+class BlenderWorker:
+    def __init__(self, templates: list[str] = (), startup_timeout=300.0):
+        parent_sock, child_sock = socket.socketpair()
+        cmd = [sys.executable, os.path.abspath(__file__), "--fd", str(child_sock.fileno())]
+        for template_path in templates:
+            cmd += ["--template", os.path.abspath(template_path)]
+        self.process = subprocess.Popen(
+            cmd,
+            pass_fds=(child_sock.fileno(),),
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.healthy = True  # False once the worker died or hung, then it has to be replaced
+        try:
+            self._recv(startup_timeout)  # ready message
+        except BlenderWorkerError:
+            self.kill()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        if self.healthy and self.process.poll() is not None:
+            self.healthy = False  # exited while idle
+        return self.healthy
+
+    def _recv(self, timeout: float = None):
+        try:
+            if not self.conn.poll(timeout):
+                self.healthy = False
+                raise BlenderWorkerError(f"Blender worker {self.process.pid} timed out after {timeout}s")
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.healthy = False
+            raise BlenderWorkerError(f"Blender worker {self.process.pid} died (exit code {self.process.poll()})") from e
+
+    def run(self, job: dict, timeout: float = None):
+        """
+        Args:
+            job: keyword arguments of the `argparse.Namespace` of `app_blender.main`
+        """
+        try:
+            self.conn.send(job)
+        except OSError as e:
+            self.healthy = False
+            raise BlenderWorkerError(f"Blender worker {self.process.pid} died (exit code {self.process.poll()})") from e
+        result = self._recv(timeout)
+        if not result["ok"]:
+            raise BlenderWorkerError(result["error"])
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.conn.close()
+
+
+class BlenderWorkerPool:
+    def __init__(self, num_workers: int, templates: list[str] = (), timeout=600.0):
+        """
+        Args:
+            templates: template files to preload in every worker
+            timeout: seconds a job can take before its worker is killed and replaced
+        """
+        self.templates = list(templates)
+        self.timeout = timeout
+        self.idle: queue.Queue[BlenderWorker] = queue.Queue()
+        workers = [None] * num_workers
+
+        def _start(i: int):
+            workers[i] = BlenderWorker(self.templates)
+
+        threads = [threading.Thread(target=_start, args=(i,)) for i in range(num_workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if any(worker is None for worker in workers):
+            for worker in workers:
+                if worker is not None:
+                    worker.close()
+            raise BlenderWorkerError("Failed to start Blender workers")
+        for worker in workers:
+            self.idle.put(worker)
+        print(f"Started {num_workers} Blender workers")
+
+    def _replace(self, worker: BlenderWorker) -> BlenderWorker:
+        print(f"Replacing Blender worker {worker.process.pid}")
+        worker.kill()
+        return BlenderWorker(self.templates)
+
+    def run(self, job: dict):
+        """Run `app_blender.main` with `job` as arguments in the next idle worker (blocks until one is available)"""
+        worker = self.idle.get()
+        if not worker.alive:  # a replacement failed before, or the worker exited while idle
+            try:
+                worker = self._replace(worker)
+            except BlenderWorkerError:
+                self.idle.put(worker)  # retried before the next job, the pool keeps its size
+                raise
+        try:
+            worker.run(job, timeout=self.timeout)
+        finally:
+            if not worker.alive:
+                try:
+                    worker = self._replace(worker)
+                except BlenderWorkerError as e:
+                    print(f"Failed to replace Blender worker: {e}")  # retried before the next job
+            self.idle.put(worker)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().close()
+
+
+def cache_template(template_path: str) -> str | None:
+    """Save the objects of a template file into a .blend, much faster to append than importing the original file
+    Returns:
+        path of the .blend, None if `TEMPLATE_CACHE_DIR` is not private
+    """
+    import bpy
+
+    import util.blender_utils as blender_utils
+    from rig_cache import private_dir
+    from util.utils import HiddenPrints
+
+    if not private_dir(TEMPLATE_CACHE_DIR):
+        print(f"Template cache directory '{TEMPLATE_CACHE_DIR}' is writable by other users, not caching templates")
+        return None
+    stat = os.stat(template_path)
+    key = hashlib.sha1(f"{os.path.abspath(template_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    cache_path = os.path.join(TEMPLATE_CACHE_DIR, f"{key}.blend")
+    if not os.path.isfile(cache_path):
+        with HiddenPrints(suppress_err=True):
+            blender_utils.reset()
+            objs = blender_utils.load_file(template_path)
+            tmp_path = f"{cache_path}.{os.getpid()}.blend"
+            bpy.data.libraries.write(tmp_path, set(objs), fake_user=True)
+            os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def worker_main(fd: int, templates: list[str]):
+    import app_blender
+    import util.blender_utils as blender_utils
+
+    conn = Connection(fd)
+    for template_path in templates:
+        cache_path = cache_template(template_path)
+        if cache_path is not None:
+            app_blender.TEMPLATE_CACHE[os.path.abspath(template_path)] = cache_path
+    blender_utils.reset()
+    conn.send({"ok": True})
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        try:
+            app_blender.main(argparse.Namespace(**job))
+            result = {"ok": True}
+        except Exception:
+            result = {"ok": False, "error": traceback.format_exc()}
+        blender_utils.reset()
+        conn.send(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fd", type=int, required=True)
+    parser.add_argument("--template", type=str, action="append", default=[])
+    args = parser.parse_args()
+
+    worker_main(args.fd, args.template)
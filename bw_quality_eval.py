@@ -0,0 +1,74 @@
+"""Speed/accuracy curve of the multi-resolution bone weights (`BW_QUALITY`) against the full-resolution ones
+
+Runs `preprocess` + `infer` of `app.py` on every input at full resolution, then at every quality, from the same
+sampled points and random seed, and reports per input & quality:
+    - bone weights L1: mean over the vertices of sum_k |bw - bw_full| (between 0 and 2)
+    - dominant bone: share of the vertices with the same most weighted bone as at full resolution
+    - seconds of `preprocess` + `infer`, and the speedup
+Usage:
+    python bw_quality_eval.py [inputs or directories ...] [--qualities 0.05,0.1,0.25,0.5] [--input_normal]
+"""
+
+import argparse
+import os
+
+import numpy as np
+import torch
+
+import app
+from quantize_eval import list_inputs, run
+
+
+def bw_errors(ref: torch.Tensor, bw: torch.Tensor) -> dict:
+    return {
+        "bw_l1": (bw - ref).abs().sum(-1).mean().item(),
+        "dominant": (bw.argmax(-1) == ref.argmax(-1)).float().mean().item(),
+    }
+
+
+def main(args):
+    input_paths = list_inputs(args.inputs)
+    qualities = [float(x) for x in args.qualities.split(",")]
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    app.init_models()  # changes the working directory
+    app.init_blocks()  # the stages return Gradio outputs keyed by the components
+    app.bw_multires_min_verts = args.min_verts
+    results = {q: [] for q in qualities}
+    for input_path in input_paths:
+        loaded = app.load_input(input_path, False, num_samples=app.N)
+        app.bw_quality = 1.0
+        run(loaded, input_path, False, args.seed, args.input_normal)  # warmup
+        ref, t_ref = run(loaded, input_path, False, args.seed, args.input_normal)
+        for quality in qualities:
+            app.bw_quality = quality
+            out, t = run(loaded, input_path, False, args.seed, args.input_normal)
+            results[quality].append({**bw_errors(ref["bw"], out["bw"]), "speedup": t_ref / t})
+            print(
+                f"[{os.path.basename(input_path)}] quality: {quality} | vertices: {ref['bw'].shape[-2]} | "
+                f"bw L1: {results[quality][-1]['bw_l1']:.4f} | dominant: {results[quality][-1]['dominant']:.2%} | "
+                f"full: {t_ref:.2f} s | multires: {t:.2f} s | speedup: {t_ref / t:.2f}x"
+            )
+
+    for quality, rs in results.items():
+        mean = {k: np.mean([r[k] for r in rs]) for k in rs[0]}
+        print(
+            f"[mean] quality: {quality} | bw L1: {mean['bw_l1']:.4f} | dominant: {mean['dominant']:.2%} | "
+            f"speedup: {mean['speedup']:.2f}x"
+        )
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["data/examples"], help="Input files, or directories of .glb")
+    parser.add_argument("--qualities", default="0.05,0.1,0.25,0.5", type=str, help="`BW_QUALITY` values")
+    parser.add_argument("--input_normal", default=False, action="store_true")
+    parser.add_argument("--min_verts", default=0, type=int, help="`BW_MULTIRES_MIN_VERTS`, 0 for every input")
+    parser.add_argument("--threads", default=0, type=int, help="torch CPU threads, 0 for the default")
+    parser.add_argument("--seed", default=0, type=int)
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
@@ -668,11 +668,15 @@ def train_one_epoch(
     return {k: meter.global_avg for k, meter in metric_logger.meters.items()}
 
 
+EVAL_QUERY_CHUNK = 100000  # vertices decoded per cross-attn pass in `evaluate`
+
+
 @torch.no_grad()
 def evaluate(data_loader: DataLoader, model: PCAE, device: torch.device, args):
     criterion = torch.nn.MSELoss()
     metric_logger = misc.MetricLogger(delimiter=" | ")
     model.eval()
+    model_without_ddp = model.module if isinstance(model, torch.nn.parallel.DistributedDataParallel) else model
     vis_data_list = []
     for data in metric_logger.log_every(data_loader, 50, "Test:"):
         data: PoseData
@@ -696,14 +700,16 @@ def evaluate(data_loader: DataLoader, model: PCAE, device: torch.device, args):
             verts = None
         gt = GT(data, global_transform, global_transform_rest, device)
         with torch.cuda.amp.autocast(enabled=False):
-            output = model(
-                pts,
+            # encode once, then decode the (possibly many) vertices in chunks
+            output = model_without_ddp.query(
+                model_without_ddp.encode_context(pts),
                 verts,
                 joints=(
                     torch.cat((gt.joints.nan_to_num(nan=0.0), gt.joints_tail.nan_to_num(nan=0.0)), dim=-1)
                     if args.pose_input_joints
                     else None
                 ),
+                chunk_size=EVAL_QUERY_CHUNK,
             )
             _, loss_value_dict, vis_data = get_loss(output, gt, criterion, args)
         metric_logger.update(**loss_value_dict)
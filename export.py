@@ -0,0 +1,386 @@
+"""Export of the inference models to TorchScript / ONNX, and their runner (`INFER_BACKEND` of `app.init_models`)
+
+Every model is split into graphs without Python control flow on the data:
+    - encoder: (pc, sampled_pc) -> x, point embedding + encoder cross-attn, shared by the models with the same weights
+    - decoder: x -> latents, decoder self-attn
+    - query: (latents, [queries], [joints]) -> outputs of `PCAE.query`, decoder cross-attn + heads
+FPS (`torch_cluster`) stays outside of the graphs as a pre-step, and the number of points / queries and the batch size
+are dynamic axes. Export on the device the models will run on.
+Usage:
+    python export.py --format torchscript [--output_dir output/exported] [--check]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+
+from inference import module_digest, query_activation_bytes
+from model import FPS_MODE, PCAE, LatentContext, Output
+
+EXPORT_FORMATS = ("torchscript", "onnx")
+EXPORT_DIR = "output/exported"
+MANIFEST = "models.json"
+# Attributes of `PCAE` used by the runner and the inference code
+CONFIG_KEYS = (
+    "N",
+    "input_dim",
+    "input_attention",
+    "hierarchical_ratio",
+    "output_dim",
+    "predict_bw",
+    "predict_joints",
+    "predict_global_trans",
+    "predict_pose_trans",
+    "pose_input_joints",
+    "pose_mode",
+    "checkpoint",
+)
+GRAPH_EXT = {"torchscript": ".pt", "onnx": ".onnx"}
+
+
+class EncodeGraph(nn.Module):
+    def __init__(self, model: PCAE):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pc: torch.Tensor, sampled_pc: torch.Tensor):
+        return self.model.encode(pc, sampled_pc=sampled_pc)
+
+
+class DecodeGraph(nn.Module):
+    def __init__(self, model: PCAE):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x: torch.Tensor):
+        return self.model.decode_latents(x)
+
+
+class QueryGraph(nn.Module):
+    def __init__(self, model: PCAE):
+        super().__init__()
+        self.model = model
+
+    def forward(self, latents: torch.Tensor, *inputs: torch.Tensor):
+        inputs = list(inputs)
+        queries = inputs.pop(0) if self.model.predict_bw else None
+        joints = inputs.pop(0) if query_needs_joints(self.model) else None
+        out = self.model.query(LatentContext(None, latents), queries, joints=joints)
+        return tuple(x for x in out if x is not None)
+
+
+def query_needs_joints(model) -> bool:
+    return model.predict_pose_trans and model.pose_input_joints
+
+
+def encoder_digest(model: PCAE) -> str:
+    """Same digest for the models that would share their encoder (see `inference.encoder_key`)"""
+    modules = nn.ModuleList(
+        getattr(parent, name)
+        for parent, name in (
+            (model.base, "point_embed"),
+            (model.base, "cross_attend_blocks"),
+            (model.base, "mean_fc"),
+            (model.base, "logvar_fc"),
+            (model, "normal_embed"),
+            (model, "input_attn"),
+        )
+        if getattr(parent, name, None) is not None
+    )
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{module_digest(modules)}{model.input_dims}{model.input_attention}".encode())
+    return h.hexdigest()
+
+
+def save_graph(
+    module: nn.Module, inputs: dict[str, torch.Tensor], outputs: list[str], dynamic_axes: dict, path: str, fmt: str
+):
+    """
+    Args:
+        inputs: example inputs by name, in the order of `module.forward`
+        outputs: output names
+        dynamic_axes: `torch.onnx.export` style, {name: {dim: axis name}}
+    """
+    module.eval()
+    args = tuple(inputs.values())
+    if fmt == "torchscript":
+        # Tracing records the shapes as tensor ops, so the axes stay dynamic as long as there is no data-dependent
+        # control flow, which the split of the graphs takes care of
+        with torch.no_grad():
+            traced = torch.jit.trace(module, args, check_trace=False)
+        torch.jit.save(torch.jit.freeze(traced), path)
+    elif fmt == "onnx":
+        torch.onnx.export(
+            module,
+            args,
+            path,
+            input_names=list(inputs),
+            output_names=outputs,
+            dynamic_axes={k: v for k, v in dynamic_axes.items() if k in inputs or k in outputs},
+            opset_version=18,
+        )
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def export_models(models: dict[str, PCAE], output_dir: str, fmt: str, num_queries=1000) -> dict:
+    """Exports the eager `models` (by name, see `app.load_models`) and writes their manifest
+    Returns:
+        the manifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    ext = GRAPH_EXT[fmt]
+    dynamic_axes = {
+        "pc": {0: "batch", 1: "num_points"},
+        "sampled_pc": {0: "batch"},
+        "x": {0: "batch"},
+        "latents": {0: "batch"},
+        "queries": {0: "batch", 1: "num_queries"},
+        "joints": {0: "batch"},
+        "bw": {0: "batch", 1: "num_queries"},
+        "global_trans": {0: "batch"},
+        "pose_trans": {0: "batch"},
+    }
+    manifest = {"format": fmt, "models": {}}
+    for name, model in models.items():
+        model.eval()
+        device = next(model.parameters()).device
+        config = {k: getattr(model, k) for k in CONFIG_KEYS}
+        config.update(
+            num_inputs=model.base.num_inputs,
+            num_latents=model.base.num_latents,
+            query_bytes=query_activation_bytes(model),  # for `inference.ChunkPlanner`
+        )
+        pc = torch.rand(1, model.N, model.input_dim, device=device)
+        sampled_pc = pc[:, : model.base.num_latents]  # any points will do for tracing
+
+        graphs = {"encoder": f"encoder-{encoder_digest(model)}{ext}"}
+        path = os.path.join(output_dir, graphs["encoder"])
+        if not os.path.isfile(path):  # shared with a previous model
+            save_graph(EncodeGraph(model), {"pc": pc, "sampled_pc": sampled_pc}, ["x"], dynamic_axes, path, fmt)
+        with torch.no_grad():
+            x = model.encode(pc, sampled_pc=sampled_pc)
+            latents = model.decode_latents(x)
+
+        graphs["decoder"] = f"{name}-decoder{ext}"
+        path = os.path.join(output_dir, graphs["decoder"])
+        save_graph(DecodeGraph(model), {"x": x}, ["latents"], dynamic_axes, path, fmt)
+
+        inputs = {"latents": latents}
+        if model.predict_bw:
+            inputs["queries"] = torch.rand(1, num_queries, model.input_dim, device=device)
+        if query_needs_joints(model):
+            joints_dim = model.joints_embedder.point_num * 3
+            inputs["joints"] = torch.rand(1, model.pose_embed.shape[1], joints_dim, device=device)
+        with torch.no_grad():
+            out = model.query(LatentContext(x, latents), inputs.get("queries"), joints=inputs.get("joints"))
+        config["outputs"] = [k for k, v in out._asdict().items() if v is not None]
+        graphs["query"] = f"{name}-query{ext}"
+        path = os.path.join(output_dir, graphs["query"])
+        save_graph(QueryGraph(model), inputs, config["outputs"], dynamic_axes, path, fmt)
+        config["graphs"] = graphs
+        manifest["models"][name] = config
+        print(f"Exported model '{name}' to {fmt}: {', '.join(graphs.values())}")
+
+    with open(os.path.join(output_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class OnnxGraph:
+    def __init__(self, path: str, device: torch.device):
+        import onnxruntime as ort
+
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(path, providers=providers)
+        self.input_names = [x.name for x in self.session.get_inputs()]
+        self.device = device
+
+    def __call__(self, *inputs: torch.Tensor) -> tuple[torch.Tensor, ...]:
+        feed = {k: x.detach().cpu().numpy() for k, x in zip(self.input_names, inputs)}
+        return tuple(torch.from_numpy(x).to(self.device) for x in self.session.run(None, feed))
+
+
+class TorchScriptGraph:
+    def __init__(self, path: str, device: torch.device):
+        self.module = torch.jit.load(path, map_location=device).eval()
+
+    @torch.no_grad()
+    def __call__(self, *inputs: torch.Tensor) -> tuple[torch.Tensor, ...]:
+        out = self.module(*inputs)
+        return out if isinstance(out, tuple) else (out,)
+
+
+class ExportedPCAE:
+    """Drop-in for an eval `PCAE` at inference (`encode`, `decode_latents`, `query`, `fps_index`...),
+    running the graphs exported by `export_models`
+    """
+
+    fps_index = PCAE.fps_index
+    fps = PCAE.fps
+    encode_context = PCAE.encode_context
+
+    def __init__(self, config: dict, graphs: dict, device: torch.device, backend: str):
+        self.__dict__.update({k: config[k] for k in CONFIG_KEYS})
+        self.checkpoint = f"{self.checkpoint}:{backend}"  # the results may differ slightly from the eager ones
+        self.outputs = config["outputs"]
+        self.query_bytes = config.get("query_bytes")
+        self.encoder, self.decoder, self.query_graph = graphs["encoder"], graphs["decoder"], graphs["query"]
+        # `SharedEncoder` keys on the identity of the encoder modules, i.e. on the encoder graph here
+        self.base = SimpleNamespace(
+            num_inputs=config["num_inputs"],
+            num_latents=config["num_latents"],
+            point_embed=self.encoder,
+            cross_attend_blocks=self.encoder,
+        )
+        self.device = device
+        self.fps_mode = FPS_MODE
+        self.training = False
+
+    def parameters(self):
+        yield torch.empty(0, device=self.device)
+
+    def to(self, *args, **kwargs):
+        return self
+
+    def eval(self):
+        return self
+
+    @torch.no_grad()
+    def encode(self, pc: torch.Tensor, sampled_pc: torch.Tensor = None) -> torch.Tensor:
+        if sampled_pc is None:
+            sampled_pc = self.fps(pc)
+        return self.encoder(pc, sampled_pc)[0]
+
+    @torch.no_grad()
+    def decode_latents(self, x: torch.Tensor) -> torch.Tensor:
+        return self.decoder(x)[0]
+
+    @torch.no_grad()
+    def query(
+        self,
+        context: LatentContext,
+        queries: torch.Tensor = None,
+        joints: torch.Tensor = None,
+        pose: torch.Tensor = None,
+        chunk_size: int = None,
+    ) -> Output:
+        """Same as `PCAE.query`, `pose` (teacher forcing) is not supported"""
+        inputs = [context.latents]
+        if self.predict_bw:
+            assert queries is not None, "Nothing to predict"
+            if queries.shape[-1] > self.input_dim:
+                queries = queries[..., : self.input_dim]
+            if chunk_size is not None and queries.shape[1] > chunk_size and self.outputs == ["bw"]:
+                bw = [self.query_graph(context.latents, x)[0] for x in queries.split(chunk_size, dim=1)]
+                return Output(torch.cat(bw, dim=1), None, None, None)
+            inputs.append(queries)
+        if query_needs_joints(self):
+            inputs.append(joints)
+        out = dict(zip(self.outputs, self.query_graph(*inputs)))
+        return Output(*(out.get(k) for k in Output._fields))
+
+
+def load_exported(output_dir: str, backend: str, device: torch.device) -> dict[str, ExportedPCAE]:
+    """Models exported by `export_models` to `output_dir`, by name"""
+    with open(os.path.join(output_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    assert manifest["format"] == backend, f"Models in {output_dir} are exported to {manifest['format']}, not {backend}"
+    graph_cls = TorchScriptGraph if backend == "torchscript" else OnnxGraph
+    graphs = {}  # loaded once, e.g. the shared encoders
+    models = {}
+    for name, config in manifest["models"].items():
+        for path in config["graphs"].values():
+            if path not in graphs:
+                graphs[path] = graph_cls(os.path.join(output_dir, path), device)
+        models[name] = ExportedPCAE(config, {k: graphs[v] for k, v in config["graphs"].items()}, device, backend)
+        print(f"Loaded model '{name}' exported to {backend} from {output_dir}")
+    return models
+
+
+def compile_model(model: PCAE, **kwargs) -> PCAE:
+    """`torch.compile` the inference entry points of `model` in place (FPS excluded), with dynamic shapes"""
+    kwargs.setdefault("dynamic", True)
+    for name in ("encode", "decode_latents", "query"):
+        setattr(model, name, torch.compile(getattr(model, name), **kwargs))
+    return model
+
+
+@torch.no_grad()
+def compare(
+    eager: PCAE, exported: ExportedPCAE, num_queries=100000, repeat=5, warmup=2
+) -> tuple[float, float, float]:
+    """Max abs diff of the outputs and milliseconds per forward (eager, exported), from the same FPS samples.
+    TorchScript optimizes the graphs after the first (profiling) runs, hence the warmup
+    Returns:
+        max abs diff, eager ms, exported ms
+    """
+    device = next(eager.parameters()).device
+    pc = torch.rand(1, eager.N, eager.input_dim, device=device)
+    sampled_pc = eager.fps(pc)
+    queries = torch.rand(1, num_queries, eager.input_dim, device=device) if eager.predict_bw else None
+    joints = None
+    if query_needs_joints(eager):
+        joints = torch.rand(1, eager.pose_embed.shape[1], eager.joints_embedder.point_num * 3, device=device)
+
+    def forward(model):
+        x = model.encode(pc, sampled_pc=sampled_pc)
+        return model.query(LatentContext(x, model.decode_latents(x)), queries, joints=joints)
+
+    results = {}
+    for i, model in enumerate((eager, exported)):
+        for _ in range(warmup):
+            out = forward(model)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            forward(model)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        results[i] = (out, (time.perf_counter() - start) / repeat * 1000)
+    (ref, t_ref), (out, t) = results[0], results[1]
+    err = max((x - y).abs().max().item() for x, y in zip(ref, out) if x is not None)
+    return err, t_ref, t
+
+
+def main(args):
+    import app
+
+    os.environ["INFER_BACKEND"] = "eager"
+    os.environ["INFER_QUANTIZE"] = ""
+    app.init_models()  # changes the working directory
+    names = ("bw", "bw_normal", "joints", "joints_add", "coarse", "pose")
+    models = {k: getattr(app, f"model_{k}") for k in names if getattr(app, f"model_{k}", None) is not None}
+    export_models(models, args.output_dir, args.format)
+
+    if args.check:
+        exported = load_exported(args.output_dir, args.format, app.device)
+        for name, model in models.items():
+            err, t_ref, t = compare(model, exported[name], args.num_queries, args.repeat)
+            print(
+                f"[{name}] max abs diff: {err:.2e} | eager: {t_ref:.1f} ms | {args.format}: {t:.1f} ms | "
+                f"speedup: {t_ref / t:.2f}x"
+            )
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--format", default="torchscript", choices=EXPORT_FORMATS)
+    parser.add_argument("--output_dir", default=EXPORT_DIR, type=str, help="Relative to the directory of `app.py`")
+    parser.add_argument("--check", default=False, action="store_true", help="Compare the outputs & latency to eager")
+    parser.add_argument("--num_queries", default=100000, type=int, help="Vertices queried by the bw models in --check")
+    parser.add_argument("--repeat", default=5, type=int)
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
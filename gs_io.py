@@ -0,0 +1,165 @@
+"""Gaussian Splats `.ply` I/O with a peak memory independent of the number of splats
+
+`GaussianSplats` memory-maps the vertex data of the file (`plyfile.PlyData.read(mmap=True)`), so only the columns or
+chunks accessed are read. Transforms (e.g. `util.utils.transform_gs`, linear blend skinning) are recorded and applied
+chunk by chunk when the splats are read or written, and `GaussianSplats.save` streams the chunks to the output file.
+Chunks follow the layout of `util.utils.load_gs`: [n, 14] = xyz, opacity, scales, rotation, SH DC (activated).
+"""
+
+import os
+import time
+from typing import Callable, Iterator
+
+import numpy as np
+import torch
+
+from plyfile import PlyData, PlyElement
+from skinning import Weights, blend_transforms, map_weights
+from util.utils import transform_gs
+
+GS_CHUNK_SIZE = int(os.getenv("GS_CHUNK_SIZE", 2**20))
+SH_C0 = 0.28209479177387814
+
+OPACITY = ("opacity",)
+SCALES = ("scale_0", "scale_1", "scale_2")
+ROTATION = ("rot_0", "rot_1", "rot_2", "rot_3")
+SH_DC = ("f_dc_0", "f_dc_1", "f_dc_2")
+# Properties of the chunks, in order
+GS_PROPERTIES = ("x", "y", "z") + OPACITY + SCALES + ROTATION + SH_DC
+# Properties of the written files, as `save_gs`
+PLY_PROPERTIES = ("x", "y", "z", "nx", "ny", "nz") + SH_DC + OPACITY + SCALES + ROTATION
+
+
+def activate(columns: np.ndarray) -> np.ndarray:
+    """[n, 14] raw properties (xyz, opacity, scales, rotation, SH DC) -> layout of `load_gs`, in place"""
+    columns[:, 3] = 1 / (1 + np.exp(-columns[:, 3]))
+    columns[:, 4:7] = np.exp(columns[:, 4:7])
+    columns[:, 11:14] = columns[:, 11:14] * SH_C0 + 0.5
+    return columns
+
+
+def deactivate(gs: np.ndarray) -> np.ndarray:
+    """Inverse of `activate`, in place"""
+    opacities = np.clip(gs[:, 3], 1e-6, 1 - 1e-6)
+    gs[:, 3] = np.log(opacities / (1 - opacities))
+    gs[:, 4:7] = np.log(np.maximum(gs[:, 4:7], 1e-8))
+    gs[:, 11:14] = (gs[:, 11:14] - 0.5) / SH_C0
+    return gs
+
+
+def skin_gs(gs: torch.Tensor, transforms: np.ndarray, bw: Weights) -> torch.Tensor:
+    """Same as `lbs_chunked(transform_gs, gs, transforms, bw)`, for `GaussianSplats.transformed` (chunked already)"""
+    return transform_gs(gs, blend_transforms(transforms, bw))
+
+
+# Transforms that `GaussianSplats.state` can refer to by name
+GS_TRANSFORMS = {"transform_gs": transform_gs, "skin_gs": skin_gs}
+
+
+class GaussianSplats:
+    """Lazy Gaussian Splats of a `.ply` file
+    Args:
+        path: `.ply` file with the properties of 3D Gaussian Splatting (higher SH degrees are ignored, as `load_gs`)
+        chunk_size: splats per chunk
+    """
+
+    def __init__(self, path: str, chunk_size: int = None):
+        self.path = os.path.abspath(path)
+        self.chunk_size = chunk_size or GS_CHUNK_SIZE
+        self.transforms: list[tuple[Callable, tuple, tuple]] = []
+        self._vertex: PlyElement = None
+        missing = set(GS_PROPERTIES) - set(self.vertex.data.dtype.names)
+        if missing:
+            raise ValueError(f"Not Gaussian Splats, missing properties: {sorted(missing)}")
+
+    @property
+    def vertex(self) -> PlyElement:
+        if self._vertex is None:
+            self._vertex = PlyData.read(self.path, mmap=True)["vertex"]
+        return self._vertex
+
+    def __getstate__(self):
+        # The memory map is reopened on access, e.g. after being restored from the rig cache
+        return {**self.__dict__, "_vertex": None}
+
+    def state(self) -> dict:
+        """Path & transforms (`GS_TRANSFORMS` names), to be stored without pickling, see `from_state`"""
+        names = {fn: name for name, fn in GS_TRANSFORMS.items()}
+        if any(fn not in names for fn, _, _ in self.transforms):
+            raise TypeError("Only the transforms of `GS_TRANSFORMS` can be stored")
+        transforms = [[names[fn], list(args), list(per_splat)] for fn, args, per_splat in self.transforms]
+        return {"path": self.path, "chunk_size": self.chunk_size, "transforms": transforms}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "GaussianSplats":
+        gs = cls(state["path"], state["chunk_size"])
+        for name, args, per_splat in state["transforms"]:
+            gs = gs.transformed(GS_TRANSFORMS[name], *args, per_splat=tuple(per_splat))
+        return gs
+
+    def __len__(self):
+        return self.vertex.count
+
+    def columns(self, names: tuple[str], begin=0, end: int = None) -> np.ndarray:
+        """[n, len(names)] float32 copy of the raw properties of the splats `begin:end`"""
+        data = self.vertex.data[begin:end]
+        return np.stack([data[name] for name in names], axis=-1).astype(np.float32, copy=False)
+
+    @property
+    def xyz(self) -> np.ndarray:
+        """[N, 3] untransformed positions"""
+        return self.columns(("x", "y", "z"))
+
+    @property
+    def opacities(self) -> np.ndarray:
+        """[N, 1] activated opacities"""
+        return 1 / (1 + np.exp(-self.columns(OPACITY)))
+
+    @property
+    def colors(self) -> np.ndarray:
+        """[N, 3] SH DC colors"""
+        return self.columns(SH_DC) * SH_C0 + 0.5
+
+    def transformed(self, fn: Callable, *args, per_splat: tuple = ()) -> "GaussianSplats":
+        """Splats mapped by `fn(gs, *args, *per_splat)` chunk by chunk, lazily. `per_splat` values (e.g. skinning
+        weights, [N, ...] or `SparseWeights`) are sliced to the chunk. The file is shared with this instance.
+        """
+        gs = object.__new__(GaussianSplats)
+        gs.__dict__.update(self.__dict__)
+        gs.transforms = self.transforms + [(fn, args, per_splat)]
+        return gs
+
+    def chunk(self, begin: int, end: int) -> torch.Tensor:
+        """[n, 14] splats `begin:end` in the layout of `load_gs`, transformed"""
+        gs = torch.from_numpy(activate(self.columns(GS_PROPERTIES, begin, end)))
+        for fn, args, per_splat in self.transforms:
+            gs = fn(gs, *args, *(map_weights(x, lambda x: x[begin:end]) for x in per_splat))
+        return gs
+
+    def chunks(self) -> Iterator[torch.Tensor]:
+        for begin in range(0, len(self), self.chunk_size):
+            yield self.chunk(begin, min(begin + self.chunk_size, len(self)))
+
+    def tensor(self) -> torch.Tensor:
+        """[N, 14] all the splats in one buffer, as `load_gs` (+ the transforms)"""
+        out = torch.empty((len(self), 14))
+        for begin, chunk in zip(range(0, len(self), self.chunk_size), self.chunks()):
+            out[begin : begin + len(chunk)] = chunk
+        return out
+
+    def save(self, path: str):
+        """Write the transformed splats as `save_gs`, one chunk at a time"""
+        assert os.path.abspath(path) != self.path, "Cannot overwrite the memory-mapped source file"
+        start = time.perf_counter()
+        dtype = np.dtype([(name, "<f4") for name in PLY_PROPERTIES])
+        header = ["ply", "format binary_little_endian 1.0", f"element vertex {len(self)}"]
+        header += [f"property float {name}" for name in PLY_PROPERTIES] + ["end_header", ""]
+        with open(path, "wb") as f:
+            f.write("\n".join(header).encode("ascii"))
+            for chunk in self.chunks():
+                gs = deactivate(chunk.detach().cpu().numpy().astype(np.float32))  # a copy
+                out = np.zeros(len(gs), dtype=dtype)  # zero normals
+                for i, name in enumerate(GS_PROPERTIES):
+                    out[name] = gs[:, i]
+                f.write(out.tobytes())
+        print(f"Saved {len(self)} Gaussian Splats to '{path}' in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,169 @@
+"""Handoff of the rigging inputs from `app.py` to the Blender stage (`app_blender.py`) without pickling
+
+File layout: magic | header length (uint64) | JSON header | arrays, each aligned to `ALIGNMENT` bytes.
+The header holds the dtype, shape and offset (from the first array) of every array, plus all the non-array values.
+Files are written to shared memory (`/dev/shm`) when available and read back as memory maps. Arrays, skinning weights
+and the geometry, UVs & colors of meshes stay views of the maps (pages are copied only when written to), the PBR
+textures are copied into `PIL` images.
+"""
+
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+import trimesh
+from PIL import Image
+
+MAGIC = b"MIAHOFF1"
+ALIGNMENT = 64
+HANDOFF_SUFFIX = ".handoff"
+HANDOFF_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# Material attributes of `trimesh.visual.material.PBRMaterial` carried through the handoff
+PBR_TEXTURES = ("baseColorTexture", "metallicRoughnessTexture", "normalTexture", "occlusionTexture", "emissiveTexture")
+PBR_FACTORS = (
+    "name",
+    "baseColorFactor",
+    "metallicFactor",
+    "roughnessFactor",
+    "emissiveFactor",
+    "alphaMode",
+    "alphaCutoff",
+    "doubleSided",
+)
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def mesh_to_arrays(mesh: trimesh.Trimesh | trimesh.PointCloud, prefix="mesh") -> tuple[dict[str, np.ndarray], dict]:
+    """Split a mesh (geometry, UVs, vertex/face colors, PBR material) into plain arrays and JSON metadata.
+    Arrays have the dtypes `trimesh` stores, so that `arrays_to_mesh` does not convert (copy) them.
+    """
+    arrays = {f"{prefix}/vertices": np.asarray(mesh.vertices, dtype=np.float64)}
+    if isinstance(mesh, trimesh.PointCloud):
+        if mesh.colors is not None and len(mesh.colors) > 0:
+            arrays[f"{prefix}/colors"] = np.asarray(mesh.colors)
+        return arrays, {"type": "pointcloud"}
+
+    arrays[f"{prefix}/faces"] = np.asarray(mesh.faces, dtype=np.int64)
+    meta = {"type": "trimesh", "visual": mesh.visual.kind}
+    if mesh.visual.kind == "texture":
+        if mesh.visual.uv is not None:
+            arrays[f"{prefix}/uv"] = np.asarray(mesh.visual.uv, dtype=np.float64)
+        material = mesh.visual.material
+        if not isinstance(material, trimesh.visual.material.PBRMaterial):
+            material = material.to_pbr()
+        for name in PBR_TEXTURES:
+            image: Image.Image = getattr(material, name, None)
+            if image is None:
+                continue
+            if image.mode not in ("L", "LA", "RGB", "RGBA"):
+                image = image.convert("RGBA")
+            arrays[f"{prefix}/{name}"] = np.asarray(image)
+        meta["material"] = {name: _to_json(getattr(material, name, None)) for name in PBR_FACTORS}
+    elif mesh.visual.kind == "vertex":
+        arrays[f"{prefix}/vertex_colors"] = np.asarray(mesh.visual.vertex_colors)
+    elif mesh.visual.kind == "face":
+        arrays[f"{prefix}/face_colors"] = np.asarray(mesh.visual.face_colors)
+    return arrays, meta
+
+
+def arrays_to_mesh(arrays: dict[str, np.ndarray], meta: dict, prefix="mesh") -> trimesh.Trimesh | trimesh.PointCloud:
+    """Inverse of `mesh_to_arrays`. The mesh arrays are views of `arrays` (e.g. memory maps), except the textures"""
+    vertices = arrays[f"{prefix}/vertices"]
+    if meta["type"] == "pointcloud":
+        return trimesh.PointCloud(vertices, colors=arrays.get(f"{prefix}/colors"), process=False)
+
+    visual = None
+    if meta["visual"] == "texture":
+        material = {k: v for k, v in meta["material"].items() if v is not None}
+        for name in PBR_TEXTURES:
+            if f"{prefix}/{name}" in arrays:
+                material[name] = Image.fromarray(np.asarray(arrays[f"{prefix}/{name}"]))
+        visual = trimesh.visual.TextureVisuals(
+            uv=arrays.get(f"{prefix}/uv"), material=trimesh.visual.material.PBRMaterial(**material)
+        )
+    elif meta["visual"] == "vertex":
+        visual = trimesh.visual.ColorVisuals(vertex_colors=arrays[f"{prefix}/vertex_colors"])
+    elif meta["visual"] == "face":
+        visual = trimesh.visual.ColorVisuals(face_colors=arrays[f"{prefix}/face_colors"])
+    return trimesh.Trimesh(vertices, arrays[f"{prefix}/faces"], visual=visual, process=False)
+
+
+def save_handoff(path: str, data: dict):
+    """
+    Args:
+        data: values can be numpy arrays, meshes, or anything JSON serializable (incl. None)
+    """
+    arrays: dict[str, np.ndarray] = {}
+    meta = {}
+    meshes = {}
+    for key, value in data.items():
+        if isinstance(value, (trimesh.Trimesh, trimesh.PointCloud)):
+            mesh_arrays, meshes[key] = mesh_to_arrays(value, prefix=key)
+            arrays.update(mesh_arrays)
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            arrays[key] = np.ascontiguousarray(value)
+        else:
+            meta[key] = _to_json(value)
+
+    header = {"arrays": {}, "meshes": meshes, "meta": meta}
+    offset = 0
+    for key, x in arrays.items():
+        header["arrays"][key] = {"dtype": x.dtype.str, "shape": list(x.shape), "offset": offset}
+        offset = _align(offset + x.nbytes)
+    header_bytes = json.dumps(header).encode()
+    start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.truncate(start + offset)
+        for key, x in arrays.items():
+            f.seek(start + header["arrays"][key]["offset"])
+            f.write(x.data)
+
+
+def load_handoff(path: str) -> dict:
+    """Inverse of `save_handoff`. Arrays, and the arrays of meshes (see `arrays_to_mesh`), are copy-on-write memory maps
+    of the file, i.e. they can be modified in place without changing the file.
+    """
+    with open(path, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC, f"Not a handoff file: '{path}'"
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    start = _align(len(MAGIC) + 8 + header_len)
+
+    arrays = {}
+    for key, info in header["arrays"].items():
+        dtype, shape = np.dtype(info["dtype"]), tuple(info["shape"])
+        if np.prod(shape) == 0:
+            arrays[key] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[key] = np.memmap(path, dtype=dtype, mode="c", offset=start + info["offset"], shape=shape)
+
+    data = dict(header["meta"])
+    for key, mesh_meta in header["meshes"].items():
+        data[key] = arrays_to_mesh(arrays, mesh_meta, prefix=key)
+    for key, x in arrays.items():
+        if key.partition("/")[0] not in header["meshes"]:
+            data[key] = x
+    return data
+
+
+def handoff_file():
+    """Temporary handoff file in shared memory, removed on close"""
+    return tempfile.NamedTemporaryFile(suffix=HANDOFF_SUFFIX, dir=HANDOFF_DIR)
@@ -0,0 +1,464 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import Future
+from operator import attrgetter
+from typing import Callable, NamedTuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from torch_cluster import knn
+
+from model import PCAE, LatentContext, gather_points
+
+# Submodules frozen by `PCAE.freeze_base`, i.e. the same weights in every checkpoint fine-tuned from one base
+FROZEN_MODULES = ("base.point_embed", "base.cross_attend_blocks")
+# Submodules kept in fp32 by `quantize_dynamic`: the point embedding sees raw coordinates and is cheap anyway
+QUANTIZE_SKIP = ("base.point_embed",)
+
+
+def tensor_digest(x: torch.Tensor) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{tuple(x.shape)}{x.dtype}".encode())
+    if x.is_quantized:
+        if x.qscheme() in (torch.per_tensor_affine, torch.per_tensor_symmetric):
+            h.update(f"{x.q_scale()}{x.q_zero_point()}".encode())
+        else:
+            h.update(tensor_digest(x.q_per_channel_scales()).encode())
+            h.update(tensor_digest(x.q_per_channel_zero_points()).encode())
+        x = x.int_repr()
+    h.update(x.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return h.hexdigest()
+
+
+def _state_tensors(value) -> list[torch.Tensor]:
+    """Tensors of a `state_dict` value, incl. the packed weights of quantized modules (tuples of tensors)"""
+    if isinstance(value, torch.Tensor):
+        return [value]
+    if isinstance(value, (tuple, list)):
+        return [x for v in value for x in _state_tensors(v)]
+    return []
+
+
+def module_digest(module: nn.Module) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(module).encode())
+    for k, v in module.state_dict().items():
+        h.update(k.encode())
+        tensors = _state_tensors(v)
+        h.update("".join(map(tensor_digest, tensors)).encode() if tensors else repr(v).encode())
+    return h.hexdigest()
+
+
+def module_device(module: nn.Module) -> torch.device:
+    tensor = next(module.parameters(), None)
+    if tensor is None:
+        tensor = next(module.buffers(), None)
+    return None if tensor is None else tensor.device
+
+
+def share_frozen_modules(models: list[PCAE], names=FROZEN_MODULES) -> int:
+    """Make byte-identical submodules of `models` point to a single instance.
+    Models on different devices are never tied. Shared modules follow any later `.to()` of either model.
+    Returns:
+        number of freed bytes
+    """
+    freed = 0
+    for name in names:
+        parent_name, _, attr = name.rpartition(".")
+        canonical: dict[tuple, nn.Module] = {}
+        for model in models:
+            parent = attrgetter(parent_name)(model) if parent_name else model
+            module: nn.Module = getattr(parent, attr)
+            key = (module_device(module), module_digest(module))
+            if key not in canonical:
+                canonical[key] = module
+                continue
+            if canonical[key] is module:
+                continue
+            tensors = [x for v in module.state_dict().values() for x in _state_tensors(v)]
+            freed += sum(x.numel() * x.element_size() for x in tensors)
+            setattr(parent, attr, canonical[key])
+    print(f"Shared frozen modules {names} across {len(models)} models: {freed / 2**20:.1f} MiB freed")
+    return freed
+
+
+def quantize_dynamic(model: nn.Module, skip: tuple[str, ...] = QUANTIZE_SKIP) -> nn.Module:
+    """int8 dynamic quantization (int8 weights, activations quantized on the fly) of the `nn.Linear` layers, in place.
+    CPU inference only. Call it before `share_frozen_modules`, so that quantized and fp32 modules are never tied.
+    Args:
+        skip: names of the submodules kept in fp32
+    """
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and not any(name == x or name.startswith(f"{x}.") for x in skip)
+    }
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", (DeprecationWarning, UserWarning))
+        torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+    if getattr(model, "checkpoint", None) is not None:
+        model.checkpoint = f"{model.checkpoint}:qint8"  # the results differ from the fp32 ones, e.g. for `RigCache`
+    return model
+
+
+def unique_rows(x: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor | None]:
+    """Rows of `x` [N, D] with exactly the same values (bitwise) collapsed into one
+    Returns:
+        unique rows [U, D] & the inverse index [N] such that `unique[inverse] == x`, or (`x`, None) if all are unique
+    """
+    a = np.ascontiguousarray(x.detach().cpu().numpy())
+    # Rows as opaque byte strings: a memcmp sort, much faster than `torch.unique(dim=0)`
+    rows = a.view(np.dtype((np.void, a.dtype.itemsize * a.shape[1]))).reshape(-1)
+    _, index, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    if len(index) == len(rows):
+        return x, None
+    return x[torch.from_numpy(index).to(x.device)], torch.from_numpy(inverse.reshape(-1)).to(x.device)
+
+
+def knn_interpolate(
+    src: torch.Tensor, values: torch.Tensor, dst: torch.Tensor, k=4, chunk_size=65536
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Inverse squared distance weighted mean of the `values` of the `k` nearest `src` points of every `dst` point
+    Args:
+        src: [M, 3]
+        values: [M, C]
+        dst: [N, 3]
+    Returns:
+        [N, C] interpolated values & [N, k] indices of the neighbours into `src`
+    """
+    k = min(k, src.shape[0])
+    dst_idx, src_idx = knn(src, dst, k)
+    neighbors = src_idx[torch.argsort(dst_idx, stable=True)].view(-1, k)
+    out = values.new_empty(dst.shape[0], values.shape[-1])
+    for begin in range(0, dst.shape[0], chunk_size):
+        chunk = slice(begin, begin + chunk_size)
+        idx = neighbors[chunk]
+        weights = 1 / (((src[idx] - dst[chunk].unsqueeze(1)) ** 2).sum(-1) + 1e-12)  # exact on the `src` points
+        weights = weights / weights.sum(-1, keepdim=True)
+        out[chunk] = (weights.unsqueeze(-1) * values[idx]).sum(-2)
+    return out, neighbors
+
+
+def _id(model: nn.Module, name: str):
+    module = getattr(model, name, None)
+    return None if module is None else id(module)
+
+
+def fps_key(model: PCAE, pc: torch.Tensor):
+    return ("fps", model.fps_mode, pc.shape[1], model.base.num_latents, model.hierarchical_ratio, pc.device)
+
+
+def encoder_key(model: PCAE, pc: torch.Tensor):
+    base = model.base
+    return (
+        "encode",
+        fps_key(model, pc),
+        model.input_dim,
+        model.input_attention,
+        id(base.point_embed),
+        id(base.cross_attend_blocks),
+        _id(base, "mean_fc"),
+        _id(base, "logvar_fc"),
+        _id(model, "normal_embed"),
+        _id(model, "input_attn"),
+    )
+
+
+class SharedEncoder:
+    """Runs FPS and the frozen encoder (point embedding + encoder cross-attn) once per input
+    for all models sharing them (see `share_frozen_modules`), and only the tuned decoder per model.
+    The last result of every group is memoized by the content of the input. For inference only.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.memo: dict[tuple, tuple[str, torch.Tensor]] = {}
+
+    def clear(self):
+        with self.lock:
+            self.memo.clear()
+
+    def _memoized(self, key: tuple, digest: str, fn):
+        with self.lock:
+            hit = self.memo.get(key)
+        if hit is not None and hit[0] == digest:
+            return hit[1]
+        out = fn()
+        with self.lock:
+            self.memo[key] = (digest, out)
+        return out
+
+    @torch.no_grad()
+    def encode(self, model: PCAE, pc: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            pc: [B, N, D], extra channels beyond `model.input_dim` are ignored
+        Returns:
+            [B, 512, 512], same as `model.encode(pc)`
+        """
+        if pc.shape[-1] > model.input_dim:
+            pc = pc[..., : model.input_dim]
+        xyz_digest = tensor_digest(pc[..., :3])
+        digest = xyz_digest if pc.shape[-1] == 3 else tensor_digest(pc)
+        # FPS only looks at xyz, so models with and without normals share it
+        sampled_idx = self._memoized(fps_key(model, pc), xyz_digest, lambda: model.fps_index(pc))
+        return self._memoized(
+            encoder_key(model, pc), digest, lambda: model.encode(pc, sampled_pc=gather_points(pc, sampled_idx))
+        )
+
+    @torch.no_grad()
+    def encode_context(self, model: PCAE, pc: torch.Tensor) -> LatentContext:
+        """Same as `model.encode_context(pc)`"""
+        x = self.encode(model, pc)
+        return LatentContext(x, model.decode_latents(x))
+
+    def encode_contexts(self, pc: torch.Tensor, models: list[PCAE]) -> list[LatentContext]:
+        return [self.encode_context(model, pc) for model in models]
+
+
+def _signature(x):
+    if isinstance(x, torch.Tensor):
+        return ("tensor", tuple(x.shape[1:]), x.dtype, x.device)
+    return ("value", x)
+
+
+def split_batch(out, sizes: list[int]) -> list:
+    """Split the output of a batched call (tensor, tuple/NamedTuple of tensors, or None) along dim 0"""
+    if out is None:
+        return [None] * len(sizes)
+    if isinstance(out, torch.Tensor):
+        return list(torch.split(out, sizes, dim=0))
+    if isinstance(out, tuple):
+        parts = list(zip(*(split_batch(x, sizes) for x in out)))
+        return [type(out)(*x) if hasattr(out, "_fields") else tuple(x) for x in parts]
+    raise TypeError(f"Unsupported output type: {type(out)}")
+
+
+class BatchScheduler:
+    """Runs `fn` on batches of the calls from concurrent threads: calls arriving within `max_wait` seconds of the
+    first one (up to `max_batch_size`) with the same non-batch shapes are concatenated along dim 0, and every caller
+    gets its own slice of the output. Throughput and latencies are printed every `log_every` batches.
+    For inference only: `fn` runs without gradients, in the thread of the scheduler.
+    """
+
+    def __init__(self, fn: Callable, max_batch_size=8, max_wait=0.01, name: str = None, log_every=100):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name or getattr(fn, "__name__", "batch")
+        self.log_every = log_every
+        self.queue: queue.Queue[tuple[tuple, Future, float]] = queue.Queue()
+        self.latencies: deque[float] = deque(maxlen=10000)
+        self.batch_sizes: deque[int] = deque(maxlen=10000)
+        self.done_times: deque[float] = deque(maxlen=10000)
+        self.num_batches = 0  # successful batches since the start, unlike the bounded `batch_sizes`
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def __call__(self, *args):
+        future = Future()
+        self.queue.put((args, future, time.perf_counter()))
+        return future.result()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self) -> list[tuple[tuple, Future, float]] | None:
+        request = self.queue.get()
+        if request is None:
+            return None
+        requests = [request]
+        deadline = time.perf_counter() + self.max_wait
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)  # stop after this batch
+                break
+            requests.append(request)
+        return requests
+
+    def _run(self, requests: list[tuple[tuple, Future, float]]):
+        args = [x[0] for x in requests]
+        batched = [torch.cat(xs, dim=0) if isinstance(xs[0], torch.Tensor) else xs[0] for xs in zip(*args)]
+        sizes = [next(x for x in a if isinstance(x, torch.Tensor)).shape[0] for a in args]
+        try:
+            with torch.no_grad():
+                outputs = split_batch(self.fn(*batched), sizes)
+        except Exception as e:
+            for _, future, _ in requests:
+                future.set_exception(e)
+            return
+        now = time.perf_counter()
+        for (_, future, start), out in zip(requests, outputs):
+            future.set_result(out)
+            self.latencies.append(now - start)
+            self.done_times.append(now)
+        self.batch_sizes.append(len(requests))
+        self.num_batches += 1
+        if self.log_every and self.num_batches % self.log_every == 0:
+            print(self.summary())
+
+    def _loop(self):
+        while (batch := self._collect()) is not None:
+            groups: dict[tuple, list] = {}
+            for request in batch:
+                groups.setdefault(tuple(_signature(x) for x in request[0]), []).append(request)
+            for requests in groups.values():
+                self._run(requests)
+
+    def stats(self) -> dict[str, float]:
+        """Throughput (requests/s), p50/p99 latencies (ms) and mean batch size over the recent requests"""
+        if not self.latencies:
+            return {}
+        latencies = np.array(self.latencies) * 1000
+        duration = self.done_times[-1] - self.done_times[0]
+        return {
+            "requests": len(latencies),
+            "throughput": (len(self.done_times) - 1) / duration if duration > 0 else float("nan"),
+            "p50": float(np.percentile(latencies, 50)),
+            "p99": float(np.percentile(latencies, 99)),
+            "batch_size": float(np.mean(self.batch_sizes)),
+        }
+
+    def summary(self) -> str:
+        s = self.stats()
+        if not s:
+            return f"[{self.name}] no requests"
+        return (
+            f"[{self.name}] {s['requests']} requests | {s['throughput']:.2f} req/s | "
+            f"p50: {s['p50']:.1f} ms | p99: {s['p99']:.1f} ms | batch size: {s['batch_size']:.2f}"
+        )
+
+
+def query_activation_bytes(model: PCAE, dtype=torch.float32) -> int:
+    """Estimated peak activation bytes per query of `model.query`: the decoder cross-attn scores of every head over
+    the latents (before and after softmax), a few copies of the features (embedding, norm, projections, residual),
+    the optional decoder feed-forward and the bw head
+    """
+    if getattr(model, "query_bytes", None) is not None:  # exported models, see `export.py`
+        return model.query_bytes * torch.finfo(dtype).bits // 32
+    attn = model.base.decoder_cross_attn.fn
+    feat_dim = attn.to_out.out_features
+    elements = 2 * attn.heads * model.base.num_latents
+    elements += 4 * feat_dim + 2 * attn.to_q.out_features
+    if model.input_dim > 3:
+        elements += 3 * feat_dim  # extra embeddings & input attention
+    if model.base.decoder_ff is not None:
+        hidden, _, out = model.base.decoder_ff.fn.net
+        elements += hidden.out_features * 3 // 2 + out.out_features
+    if model.predict_bw:
+        elements += 2 * model.output_dim
+    return elements * torch.finfo(dtype).bits // 8
+
+
+def available_memory(device: torch.device) -> int:
+    """Free bytes on `device`: CUDA free memory, or `MemAvailable` of the host"""
+    if device.type == "cuda":
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def is_oom(e: BaseException) -> bool:
+    if isinstance(e, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    return isinstance(e, RuntimeError) and any(x in str(e) for x in ("out of memory", "can't allocate memory"))
+
+
+ChunkPlan = NamedTuple("ChunkPlan", [("chunk_size", int), ("num_chunks", int), ("query_bytes", int), ("budget", int)])
+
+
+class ChunkPlanner:
+    """Sizes the chunks of decoder queries (`PCAE.query` on many vertices): the largest chunk whose estimated
+    activations (`query_activation_bytes`) fit the memory budget. On allocation failure, the chunk is halved and
+    retried within the call. The budget of the device is halved once for the later calls after a call that ran out of
+    memory (down to `min_backoff`), and doubled back (up to the full budget) after a call that did not.
+    Args:
+        budget: bytes for the activations of a chunk, None for `budget_ratio` of the free memory at every call
+    """
+
+    def __init__(self, budget: int = None, budget_ratio=0.5, min_chunk_size=1024, min_backoff=1 / 16):
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self.min_chunk_size = min_chunk_size
+        self.min_backoff = min_backoff
+        self.lock = threading.Lock()
+        self.backoff: dict[torch.device, float] = {}  # budget scale per device, after allocation failures
+
+    @classmethod
+    def from_env(cls):
+        """Configured by `INFER_CHUNK_MB` (0 for `INFER_CHUNK_RATIO` of the free memory)"""
+        budget_mb = float(os.getenv("INFER_CHUNK_MB", 0))
+        return cls(
+            int(budget_mb * 2**20) if budget_mb > 0 else None,
+            budget_ratio=float(os.getenv("INFER_CHUNK_RATIO", 0.5)),
+        )
+
+    def plan(self, num_queries: int, models: list[PCAE], device: torch.device, dtype=torch.float32) -> ChunkPlan:
+        """Models run one after another on every chunk, keeping their outputs"""
+        activations = max(query_activation_bytes(model, dtype) for model in models)
+        outputs = sum(model.output_dim for model in models if model.predict_bw) * torch.finfo(dtype).bits // 8
+        query_bytes = activations + outputs
+        budget = self.budget if self.budget is not None else int(available_memory(device) * self.budget_ratio)
+        with self.lock:
+            budget = int(budget * self.backoff.get(device, 1.0))
+        chunk_size = min(max(budget // query_bytes, self.min_chunk_size), max(num_queries, 1))
+        return ChunkPlan(chunk_size, -(-num_queries // chunk_size), query_bytes, budget)
+
+    def run(
+        self, fn: Callable[[int, int], torch.Tensor], num_queries: int, models: list[PCAE], device: torch.device
+    ) -> list[torch.Tensor]:
+        """
+        Args:
+            fn: (begin, end) -> output of the queries [begin, end)
+        Returns:
+            outputs of `fn` on consecutive chunks covering the queries
+        """
+        plan = self.plan(num_queries, models, device)
+        print(
+            f"Query chunks: {num_queries} queries in {plan.num_chunks} x {plan.chunk_size} | "
+            f"{plan.query_bytes / 2**10:.1f} KiB/query, budget {plan.budget / 2**20:.0f} MiB"
+        )
+        chunk_size = plan.chunk_size
+        outputs = []
+        begin = 0
+        oom = False
+        while begin < num_queries:
+            end = min(begin + chunk_size, num_queries)
+            try:
+                outputs.append(fn(begin, end))
+                begin = end
+                continue
+            except Exception as e:
+                if not is_oom(e) or chunk_size <= self.min_chunk_size:
+                    raise
+            # The activations of the failed chunk are released with the exception
+            chunk_size = max(chunk_size // 2, self.min_chunk_size)
+            oom = True
+            print(f"Out of memory with chunks of {end - begin} queries, retrying with {chunk_size}")
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+        with self.lock:
+            backoff = self.backoff.get(device, 1.0)
+            self.backoff[device] = max(backoff / 2, self.min_backoff) if oom else min(backoff * 2, 1.0)
+        return outputs
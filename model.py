@@ -1,3 +1,4 @@
+import os
 import warnings
 from typing import NamedTuple
 
@@ -16,6 +17,61 @@ Output = NamedTuple(
     "Output",
     [("bw", torch.Tensor), ("joints", torch.Tensor), ("global_trans", torch.Tensor), ("pose_trans", torch.Tensor)],
 )
+LatentContext = NamedTuple("LatentContext", [("encoded", torch.Tensor), ("latents", torch.Tensor)])
+
+FPS_MODES = ("exact", "voxel")
+# Sampling of the latent points by `PCAE.fps_index`: exact FPS, or `voxel_fps` (approximate, faster)
+FPS_MODE = os.getenv("FPS_MODE", "exact")
+assert FPS_MODE in FPS_MODES, f"Unknown FPS mode: {FPS_MODE}"
+
+
+def gather_points(pc: torch.Tensor, idx: torch.Tensor) -> torch.Tensor:
+    """
+    Args:
+        pc: [B, N, D]
+        idx: [B, M]
+    Returns:
+        [B, M, D]
+    """
+    return torch.gather(pc, 1, idx.unsqueeze(-1).expand(-1, -1, pc.shape[-1]))
+
+
+def voxel_fps(pos: torch.Tensor, num_samples: int, oversample=4, iters=16) -> torch.Tensor:
+    """Approximate FPS: one point per cell of a voxel grid sized for about `oversample * num_samples` occupied cells
+    (bisection on the cell size), then exact FPS on these candidates only
+    Args:
+        pos: [N, 3], a single point cloud
+    Returns:
+        [`num_samples`], indices into `pos`
+    """
+    N = pos.shape[0]
+    target = oversample * num_samples
+    candidates = torch.arange(N, device=pos.device)
+    if N > target:
+        lo = pos.min(0).values
+        extent = (pos.max(0).values - lo).max().clamp_min(1e-12).item()
+
+        def cells(size: float) -> tuple[torch.Tensor, int]:
+            grid = ((pos - lo) / size).long()
+            dims = grid.max(0).values + 1
+            _, inverse = torch.unique((grid[:, 0] * dims[1] + grid[:, 1]) * dims[2] + grid[:, 2], return_inverse=True)
+            return inverse, int(inverse.max()) + 1
+
+        # The number of occupied cells decreases with their size
+        small, large = extent / target, extent
+        for _ in range(iters):
+            mid = (small * large) ** 0.5
+            if cells(mid)[1] > target:
+                small = mid
+            else:
+                large = mid
+        inverse, num_cells = cells(large)
+        if num_cells >= num_samples:
+            # The first point of every cell
+            first = torch.full((num_cells,), N, dtype=torch.long, device=pos.device)
+            candidates = first.scatter_reduce(0, inverse, candidates, reduce="amin")
+    idx = fps(pos[candidates], None, ratio=num_samples / len(candidates))[:num_samples]
+    return candidates[idx]
 
 
 class Embedder3D(nn.Module):
@@ -170,6 +226,27 @@ class InputAttention(nn.Module):
         self.attn = Attention(query_dim=feat_dim, heads=heads, dim_head=dim_head, *args, **xargs)
         nn.init.zeros_(self.attn.to_out.weight)
         nn.init.zeros_(self.attn.to_out.bias)
+        self.closed_form = True  # False to run the generic `Attention` with one batch per point
+
+    def attend(self, feat: torch.Tensor, context: torch.Tensor):
+        """`self.attn` of every point over itself and its own few context tokens, as elementwise ops vectorized over
+        the points instead of B*N tiny matrix products (and without concatenating the point to its context)
+        Args:
+            feat: [P, D]
+            context: [P, k, D]
+        Returns:
+            [P, D], attention scores [P, heads, 1 + k]
+        """
+        attn = self.attn
+        split = lambda x: x.unflatten(-1, (attn.heads, -1))
+        q = split(attn.to_q(self.norm(feat)))  # [P, H, d]
+        k_self, v_self = map(split, attn.to_kv(self.norm_context(feat)).chunk(2, dim=-1))  # [P, H, d]
+        k, v = map(split, attn.to_kv(self.norm_context(context)).chunk(2, dim=-1))  # [P, k, H, d]
+        sim = torch.cat([(q * k_self).sum(-1).unsqueeze(1), (q.unsqueeze(1) * k).sum(-1)], dim=1) * attn.scale
+        score = sim.nan_to_num().softmax(dim=1)  # [P, 1 + k, H]
+        out = score[:, 0].unsqueeze(-1) * v_self + (score[:, 1:].unsqueeze(-1) * v).sum(1)
+        out = attn.drop_path(attn.to_out(out.flatten(-2)))
+        return out, score.transpose(1, 2)
 
     def forward(self, feat: torch.Tensor, context: torch.Tensor, return_score=False):
         """
@@ -180,16 +257,18 @@ class InputAttention(nn.Module):
             [..., D]
         """
         sh = feat.shape
-        feat = feat.view(-1, 1, sh[-1])
-        context = context.view(-1, context.shape[-2], context.shape[-1])
-        context = torch.cat([feat, context], dim=-2)
-        out = self.attn(self.norm(feat), self.norm_context(context), return_score=return_score)
-        if return_score:
-            out, attn_score = out
-        out = out + feat
-        out = out.reshape(*sh)
+        feat = feat.reshape(-1, sh[-1])
+        context = context.reshape(-1, context.shape[-2], context.shape[-1])
+        if self.closed_form:
+            out, attn_score = self.attend(feat, context)
+        else:
+            context = torch.cat([feat.unsqueeze(1), context], dim=-2)
+            out = self.attn(self.norm(feat.unsqueeze(1)), self.norm_context(context), return_score=return_score)
+            if return_score:
+                out, attn_score = out
+        out = out.reshape(*sh) + feat.reshape(*sh)
         if return_score:
-            attn_score = attn_score.reshape(*sh[:-1], -1, context.shape[-2])
+            attn_score = attn_score.reshape(*sh[:-1], self.attn.heads, -1)
             return out, attn_score
         return out
 
@@ -227,6 +306,7 @@ class PCAE(nn.Module):
         super().__init__()
 
         self.N = N
+        self.fps_mode = FPS_MODE
         self.base = create_autoencoder(dim=512, M=num_latents, N=self.N, latent_dim=8, deterministic=deterministic)
         embed_dim = self.base.point_embed.mlp.out_features
         feat_dim = self.base.decoder_cross_attn.fn.to_out.out_features
@@ -252,6 +332,7 @@ class PCAE(nn.Module):
         assert 0 <= hierarchical_ratio < 1.0, f"{hierarchical_ratio=} must be in [0, 1)"
 
         self.output_dim = output_dim
+        self.checkpoint: str = None  # path:size:mtime of the checkpoint loaded by `self.load`
 
         self.predict_bw = predict_bw
         if self.predict_bw:
@@ -416,6 +497,8 @@ class PCAE(nn.Module):
         if adapt:
             model_state_dict = self.adapt_ckpt(model_state_dict)
         self.load_state_dict(model_state_dict, strict=strict)
+        stat = os.stat(pth_path)
+        self.checkpoint = f"{os.path.abspath(pth_path)}:{stat.st_size}:{stat.st_mtime_ns}"
         print(f"Loaded model from {pth_path}")
         return self
 
@@ -439,45 +522,49 @@ class PCAE(nn.Module):
                 param.requires_grad = True
         return self
 
-    def fps(self, pc: torch.Tensor) -> torch.Tensor:
+    def fps_index(self, pc: torch.Tensor) -> torch.Tensor:
         """
         Args:
-            pc: [B, `self.N`, D]
+            pc: [B, N, D], any number of points (`self.N` in training), the FPS ratios follow
         Returns:
-            [B, `self.base.num_latents`, D]
+            [B, `self.base.num_latents`], indices into the dim 1 of `pc`
         """
         B, N, D = pc.shape
-        assert N == self.base.num_inputs
         assert D == self.input_dim
 
-        # flattened = pc.view(B * N, D)
-        # batch = torch.arange(B).to(pc.device)
-        # batch = torch.repeat_interleave(batch, N)
-        # pos = flattened
-        # ratio = 1.0 * self.base.num_latents / N
-        # idx = fps(pos, batch, ratio=ratio)
-        # sampled_pc = pos[idx]
-        # sampled_pc = sampled_pc.view(B, -1, 3)
-
         N_hier = int(N * self.hierarchical_ratio)
         N_pc = [N - N_hier, N_hier]
         num_latents_hier = int(self.base.num_latents * self.hierarchical_ratio)
         N_latents = [self.base.num_latents - num_latents_hier, num_latents_hier]
-        latents_begin_idx = [0, self.base.num_latents - num_latents_hier]
 
-        sampled_pc = torch.empty(B, self.base.num_latents, D, dtype=pc.dtype, device=pc.device)
+        sampled_idx = []
+        begin = 0
         for i, pc_ in enumerate(pc.split(N_pc, dim=1)):
             N_ = pc_.shape[1]
             if N_ == 0:
                 continue
-            batch = torch.repeat_interleave(torch.arange(B).to(pc.device), N_)
-            pos = pc_.reshape(-1, D)
-            idx = fps(pos[:, :3], batch, ratio=1.0 * N_latents[i] / N_)
-            sampled_pc[:, latents_begin_idx[i] : latents_begin_idx[i] + N_latents[i], :] = pos[idx].view(B, -1, D)[
-                :, : N_latents[i], :
-            ]
-        # import trimesh; trimesh.Trimesh(sampled_pc[0].cpu()).export("sample.ply")  # fmt: skip
+            assert N_ >= N_latents[i], f"{N_} points for {N_latents[i]} latents"
+            if self.fps_mode == "voxel":
+                idx = torch.stack([voxel_fps(x[:, :3], N_latents[i]) for x in pc_]) + begin
+            else:
+                batch = torch.repeat_interleave(torch.arange(B).to(pc.device), N_)
+                pos = pc_.reshape(-1, D)
+                idx = fps(pos[:, :3], batch, ratio=1.0 * N_latents[i] / N_)
+                idx = idx.view(B, -1)[:, : N_latents[i]]
+                idx = idx - torch.arange(B, device=idx.device).unsqueeze(1) * N_ + begin
+            sampled_idx.append(idx)
+            begin += N_
+        return torch.cat(sampled_idx, dim=1)
 
+    def fps(self, pc: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            pc: [B, N, D]
+        Returns:
+            [B, `self.base.num_latents`, D]
+        """
+        sampled_pc = gather_points(pc, self.fps_index(pc))
+        # import trimesh; trimesh.Trimesh(sampled_pc[0].cpu()).export("sample.ply")  # fmt: skip
         return sampled_pc
 
     def embed(self, pc: torch.Tensor) -> torch.Tensor:
@@ -512,16 +599,18 @@ class PCAE(nn.Module):
 
         return pc_embeddings
 
-    def encode(self, pc: torch.Tensor) -> torch.Tensor:
+    def encode(self, pc: torch.Tensor, sampled_pc: torch.Tensor = None) -> torch.Tensor:
         """
         Args:
-            pc: [B, `self.N`, 3]
+            pc: [B, N, 3]
+            sampled_pc: [B, `self.base.num_latents`, 3], precomputed `self.fps(pc)`
         Returns:
             [B, 512, 512]
         """
         # _, x = self.base.encode(pc)
 
-        sampled_pc = self.fps(pc)
+        if sampled_pc is None:
+            sampled_pc = self.fps(pc)
         sampled_pc_embeddings = self.embed(sampled_pc)
         pc_embeddings = self.embed(pc)
         cross_attn, cross_ff = self.base.cross_attend_blocks
@@ -536,34 +625,67 @@ class PCAE(nn.Module):
 
         return x
 
-    def decode(self, x: torch.Tensor, queries: torch.Tensor, learnable_embeddings: torch.Tensor = None) -> torch.Tensor:
+    def decode_latents(self, x: torch.Tensor) -> torch.Tensor:
         """
         Args:
-            x: [B, 512, 3]
-            queries: [B, N, 3]
+            x: [B, 512, 512]
         Returns:
-            [B, N, 512]
+            [B, 512, 512]
         """
-        # o = self.base.decode(x, queries)
         if hasattr(self.base, "proj"):
             x = self.base.proj(x)
         for self_attn, self_ff in self.base.layers:
             x = self_attn(x) + x
             x = self_ff(x) + x
+        return x
+
+    def decode_queries(
+        self, latents: torch.Tensor, queries: torch.Tensor, learnable_embeddings: torch.Tensor = None
+    ) -> torch.Tensor:
+        """
+        Args:
+            latents: [B, 512, 512]
+            queries: [B, N, 3]
+        Returns:
+            [B, N, 512]
+        """
         # cross attend from decoder queries to latents
         queries_embeddings = self.embed(queries)
         if learnable_embeddings is not None:
             queries_embeddings = torch.cat((queries_embeddings, learnable_embeddings), dim=1)
-        latents = self.base.decoder_cross_attn(queries_embeddings, context=x)
+        out = self.base.decoder_cross_attn(queries_embeddings, context=latents)
         # optional decoder feedforward
         if self.base.decoder_ff is not None:
-            latents = latents + self.base.decoder_ff(latents)
-        return latents
+            out = out + self.base.decoder_ff(out)
+        return out
+
+    def decode(self, x: torch.Tensor, queries: torch.Tensor, learnable_embeddings: torch.Tensor = None) -> torch.Tensor:
+        """
+        Args:
+            x: [B, 512, 3]
+            queries: [B, N, 3]
+        Returns:
+            [B, N, 512]
+        """
+        # o = self.base.decode(x, queries)
+        return self.decode_queries(self.decode_latents(x), queries, learnable_embeddings)
+
+    def encode_context(self, pc: torch.Tensor) -> LatentContext:
+        """encode + decoder self-attn, i.e. everything that does not depend on the queries
+        Args:
+            pc: [B, N, 3]
+        Returns:
+            `LatentContext` to be reused by any number of `self.query` calls
+        """
+        if pc.shape[-1] > self.input_dim:
+            pc = pc[..., : self.input_dim]
+        x = self.encode(pc)
+        return LatentContext(x, self.decode_latents(x))
 
     def forward_base(self, pc: torch.Tensor, queries: torch.Tensor) -> torch.Tensor:
         """encode + decode + occupancy mlp
         Args:
-            pc: [B, `self.N`, 3]
+            pc: [B, N, 3]
             queries: [B, N2, 3]
         Returns:
             [B, N2, 1]
@@ -579,14 +701,32 @@ class PCAE(nn.Module):
     ):
         """
         Args:
-            pc: [B, `self.N`, 3]
+            pc: [B, N, 3]
             queries: [B, N2, 3]
         Returns:
             [B, N2, `self.output_dim`]
         """
-        if pc.shape[-1] > self.input_dim:
-            pc = pc[..., : self.input_dim]
-        x = self.encode(pc)
+        return self.query(self.encode_context(pc), queries, joints=joints, pose=pose)
+
+    def query(
+        self,
+        context: LatentContext,
+        queries: torch.Tensor = None,
+        joints: torch.Tensor = None,
+        pose: torch.Tensor = None,
+        chunk_size: int = None,
+    ):
+        """decoder cross-attn + heads on a precomputed `LatentContext`
+        Args:
+            context: output of `self.encode_context`
+            queries: [B, N2, 3]
+            chunk_size: decode `queries` in chunks of this size (queries attend to the latents independently,
+                so the output is the same as decoding them at once)
+        Returns:
+            [B, N2, `self.output_dim`]
+        """
+        latents = context.latents
+        B = latents.shape[0]
 
         learnable_embeddings = (
             self.joints_embed if self.predict_joints else None,
@@ -597,34 +737,39 @@ class PCAE(nn.Module):
         learnable_embeddings = [x for x in learnable_embeddings if x is not None]
         if learnable_embeddings:
             learnable_embeddings = torch.cat(learnable_embeddings, dim=1)
-            learnable_embeddings = learnable_embeddings.expand(pc.shape[0], -1, -1).clone()
+            learnable_embeddings = learnable_embeddings.expand(B, -1, -1).clone()
         else:
             learnable_embeddings = None
         if queries is None:
             assert not self.predict_bw and learnable_embeddings is not None, "Nothing to predict"
-            queries = torch.empty_like(pc[:, :0])  # placeholder
+            queries = latents.new_empty(B, 0, self.input_dim)  # placeholder
         elif queries.shape[-1] > self.input_dim:
             queries = queries[..., : self.input_dim]
 
         if self.predict_pose_trans and self.pose_input_joints:
-            assert joints is not None and joints.shape[:-1] == (pc.shape[0], self.pose_embed.shape[1])
+            assert joints is not None and joints.shape[:-1] == (B, self.pose_embed.shape[1])
             joints_embed = self.joints_embedder(joints)
             pose_embed_length = learnable_embeddings_length[2]
             learnable_embeddings[:, -pose_embed_length:] = learnable_embeddings[:, -pose_embed_length:] + joints_embed
 
-        logits = self.decode(x, queries, learnable_embeddings)
-        if learnable_embeddings is not None:
-            logits, logits_joints, logits_global, logits_pose = torch.split(
-                logits, [queries.shape[1]] + learnable_embeddings_length, dim=1
-            )
+        if chunk_size is None or queries.shape[1] <= chunk_size:
+            queries_chunks = (queries,)
+        else:
+            queries_chunks = queries.split(chunk_size, dim=1)
+        bw = []
+        for i, queries_ in enumerate(queries_chunks):
+            # learnable embeddings go with the last chunk, in the same order as an unchunked pass
+            is_last = i == len(queries_chunks) - 1
+            logits = self.decode_queries(latents, queries_, learnable_embeddings if is_last else None)
+            if is_last and learnable_embeddings is not None:
+                logits, logits_joints, logits_global, logits_pose = torch.split(
+                    logits, [queries_.shape[1]] + learnable_embeddings_length, dim=1
+                )
+            if self.predict_bw:
+                bw.append(self.bw_output(logits))
 
         if self.predict_bw:
-            bw: torch.Tensor = self.bw_head(logits)
-            bw = self.actvn(bw)
-            if not isinstance(self.actvn, nn.Softmax):
-                bw = bw / (bw.sum(dim=-1, keepdim=True) + 1e-10)
-            if self.output_actvn_log and self.training:
-                bw = torch.log(bw)
+            bw = bw[0] if len(bw) == 1 else torch.cat(bw, dim=1)
         else:
             bw = None
 
@@ -648,6 +793,21 @@ class PCAE(nn.Module):
 
         return Output(bw, joints, global_trans, pose_trans)
 
+    def bw_output(self, logits: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            logits: [B, N, 512]
+        Returns:
+            [B, N, `self.output_dim`]
+        """
+        bw: torch.Tensor = self.bw_head(logits)
+        bw = self.actvn(bw)
+        if not isinstance(self.actvn, nn.Softmax):
+            bw = bw / (bw.sum(dim=-1, keepdim=True) + 1e-10)
+        if self.output_actvn_log and self.training:
+            bw = torch.log(bw)
+        return bw
+
     def get_grid(self):
         if self.grid is None:
             x = np.linspace(-1, 1, self.grid_density + 1)
@@ -778,6 +938,44 @@ class Transformer(nn.Module):
         x = self.layers(x, mask=~mask)
         return x
 
+    def forward_cached(
+        self, x: torch.Tensor, index: torch.Tensor, mask: torch.Tensor, cache: list[tuple[torch.Tensor, torch.Tensor]]
+    ):
+        """Run only the tokens `index`, attending to the keys/values cached by previous calls.
+        Same as `forward` (in eval mode) as long as no token attends to a token passed in a later call.
+        Args:
+            x: [B, M, D], input of the tokens `index`
+            index: [M], indices of the tokens in the full sequence of length N
+            mask: [M, N] bool (False means don't attend)
+            cache: per-layer ([B, H, N, D/H], [B, H, N, D/H]) keys & values, filled in place (empty for a new sequence)
+        Returns:
+            [B, M, D]
+        """
+        B, M, D = x.shape
+        for i, layer in enumerate(self.layers.layers):
+            layer: nn.TransformerEncoderLayer
+            attn = layer.self_attn
+            H = attn.num_heads
+            if len(cache) <= i:
+                cache.append(tuple(x.new_zeros(B, H, mask.shape[1], D // H) for _ in range(2)))
+            k_cache, v_cache = cache[i]
+
+            h = layer.norm1(x) if layer.norm_first else x
+            q, k, v = F.linear(h, attn.in_proj_weight, attn.in_proj_bias).view(B, M, 3, H, D // H).unbind(2)
+            k_cache[:, :, index] = k.transpose(1, 2)
+            v_cache[:, :, index] = v.transpose(1, 2)
+            out = F.scaled_dot_product_attention(q.transpose(1, 2), k_cache, v_cache, attn_mask=mask)
+            out = attn.out_proj(out.transpose(1, 2).reshape(B, M, D))
+            if layer.norm_first:
+                x = x + layer.dropout1(out)
+                x = x + layer._ff_block(layer.norm2(x))
+            else:
+                x = layer.norm1(x + layer.dropout1(out))
+                x = layer.norm2(x + layer._ff_block(x))
+        if self.layers.norm is not None:
+            x = self.layers.norm(x)
+        return x
+
 
 class JointsDiscriminatorAttn(nn.Module):
     def __init__(self, num_joints=52 * 2, feat_dim=512, depth=8):
@@ -844,9 +1042,11 @@ class JointsAttentionCausal(nn.Module):
         rotation_dim=4,
         query_type="embedding",
         zero_init=False,
+        incremental=True,
     ):
         super().__init__()
 
+        self.incremental = incremental  # level-by-level decoding with cached activations in eval mode
         self.transformer = Transformer(feat_dim, depth=depth, heads=heads, norm_first=True, zero_init=zero_init)
         self.out_type = out_type
         self.out_dim = out_dim
@@ -869,29 +1069,44 @@ class JointsAttentionCausal(nn.Module):
         self.register_buffer("mask_attn", mask_attn, persistent=False)
         self.mask_attn: torch.Tensor
 
-        mask_parent = mask_attn.clone()
         for joint in kinematic_tree:
             mask_attn[joint.index, joint.index] = True
             for parent in joint.parent_recursive:
                 mask_attn[joint.index, parent.index] = True
-            if joint.parent is not None:
-                mask_parent[joint.index, joint.parent.index] = True
-        self.register_buffer("mask_parent", mask_parent, persistent=False)
-        self.mask_parent: torch.Tensor
+        has_parent = torch.zeros(len(kinematic_tree), dtype=torch.bool)
+        for joint in kinematic_tree:
+            has_parent[joint.index] = joint.parent is not None
+        self.register_buffer("has_parent", has_parent, persistent=False)
+        self.has_parent: torch.Tensor
+        parent_index = torch.tensor(kinematic_tree.parent_indices, dtype=torch.long)
+        parent_index[~has_parent] = 0  # gathered, then zeroed by `has_parent`
+        self.register_buffer("parent_index", parent_index, persistent=False)
+        self.parent_index: torch.Tensor
         tree_levels_mask = torch.tensor(kinematic_tree.tree_levels_mask)
         self.register_buffer("tree_levels_mask", tree_levels_mask, persistent=False)
         self.tree_levels_mask: torch.Tensor
 
-    def _forward(self, feat: torch.Tensor, out_gt: torch.Tensor = None):
-        B, N, _ = feat.shape
-        if self.out_type == "pose" and out_gt.shape[-1] == 6:
+    def _condition(self, out: torch.Tensor, index: torch.Tensor = None):
+        """
+        Args:
+            out: [B, N, `self.out_dim`]
+            index: [M], joints to get the parents' features for (all if None)
+        Returns:
+            [B, M, D]
+        """
+        parent_index = self.parent_index if index is None else self.parent_index[index]
+        has_parent = self.has_parent if index is None else self.has_parent[index]
+        out = out[:, parent_index]  # B, M, `self.out_dim`
+        if self.out_type == "pose" and out.shape[-1] == 6:
             from util.utils import matrix_to_ortho6d, ortho6d_to_matrix
 
-            out_gt = matrix_to_ortho6d(ortho6d_to_matrix(out_gt))
-        out_gt_feat: torch.Tensor = self.encoder(out_gt)  # B, N, D
-        out_gt_feat = out_gt_feat.unsqueeze(1).expand(-1, N, -1, -1).clone()  # B, (N), N, D
-        out_gt_feat[~self.mask_parent.expand(B, -1, -1)] = 0
-        out_gt_feat = out_gt_feat.sum(-2)  # B, (N), D
+            out = matrix_to_ortho6d(ortho6d_to_matrix(out))
+        out_feat: torch.Tensor = self.encoder(out)  # B, M, D
+        out_feat = out_feat.masked_fill(~has_parent.unsqueeze(-1), 0)
+        return out_feat
+
+    def _forward(self, feat: torch.Tensor, out_gt: torch.Tensor = None):
+        out_gt_feat = self._condition(out_gt)
         if self.query_type == "embedding":
             in_feat = out_gt_feat + feat
         else:
@@ -901,6 +1116,27 @@ class JointsAttentionCausal(nn.Module):
         out = self.decoder(in_feat_attn)
         return out
 
+    def _forward_incremental(self, feat: torch.Tensor):
+        """Decode the tree level by level. Joints only attend to themselves and their ancestors,
+        whose activations are final once their level is decoded, so each level runs the transformer
+        on its own joints only, on top of the cached activations of the previous levels.
+        """
+        B, N, _ = feat.shape
+        out = torch.zeros((B, N, self.out_dim), dtype=feat.dtype, device=feat.device)
+        cache = []
+        for mask in self.tree_levels_mask:
+            if not mask.any():
+                continue
+            index = mask.nonzero().squeeze(1)
+            out_gt_feat = self._condition(out, index)
+            if self.query_type == "embedding":
+                in_feat = out_gt_feat + feat[:, index]
+            else:
+                raise NotImplementedError(f"{self.query_type=}")
+            in_feat_attn = self.transformer.forward_cached(in_feat, index, self.mask_attn[index], cache)
+            out[:, index] = self.decoder(in_feat_attn)
+        return out
+
     def forward(self, feat: torch.Tensor, out_gt: torch.Tensor = None):
         """
         Args:
@@ -931,6 +1167,8 @@ class JointsAttentionCausal(nn.Module):
             #     else:
             #         raise NotImplementedError
             out = self._forward(feat, out_gt)
+        elif self.incremental:
+            out = self._forward_incremental(feat)
         else:
             out = torch.zeros((B, N, self.out_dim), dtype=feat.dtype, device=feat.device)
             for mask in self.tree_levels_mask:
@@ -1,3 +1,4 @@
+import os
 from functools import wraps
 
 import numpy as np
@@ -12,6 +13,13 @@ from torch_cluster import fps
 
 from timm.layers import DropPath
 
+ATTENTION_BACKENDS = ('einsum', 'sdpa', 'tiled')
+# Backend of the `Attention` layers without their own, see `set_attention_backend`
+_attention_backend = os.getenv('ATTENTION_BACKEND', 'einsum')
+assert _attention_backend in ATTENTION_BACKENDS, f'Unknown attention backend: {_attention_backend}'
+# Max size of the attention scores of a tile of queries in the 'tiled' backend
+ATTENTION_TILE_MB = float(os.getenv('ATTENTION_TILE_MB', 64))
+
 def exists(val):
     return val is not None
 
@@ -74,6 +82,7 @@ class Attention(nn.Module):
         context_dim = default(context_dim, query_dim)
         self.scale = dim_head ** -0.5
         self.heads = heads
+        self.backend = None  # None for the global one
 
         self.to_q = nn.Linear(query_dim, inner_dim, bias = False)
         self.to_kv = nn.Linear(context_dim, inner_dim * 2, bias = False)
@@ -81,6 +90,41 @@ class Attention(nn.Module):
 
         self.drop_path = DropPath(drop_path_rate) if drop_path_rate > 0. else nn.Identity()
 
+    def attend(self, q, k, v, mask = None):
+        sim = einsum('b i d, b j d -> b i j', q, k) * self.scale
+        sim = sim.nan_to_num()
+
+        if exists(mask):
+            max_neg_value = -torch.finfo(sim.dtype).max
+            sim.masked_fill_(~mask, max_neg_value)
+
+        # attention, what we cannot get enough of
+        attn = sim.softmax(dim = -1)
+
+        out = einsum('b i j, b j d -> b i d', attn, v)
+        return out, attn
+
+    def attend_sdpa(self, q, k, v, mask = None):
+        # unlike `attend`, inf scores are not clamped
+        if exists(mask):
+            # same finite fill as `attend`, so that fully masked rows give the mean instead of NaN
+            mask = torch.zeros(mask.shape, dtype = q.dtype, device = q.device).masked_fill_(~mask, -torch.finfo(q.dtype).max)
+        return F.scaled_dot_product_attention(q, k, v, attn_mask = mask, scale = self.scale)
+
+    def attend_tiled(self, q, k, v, mask = None, return_score = False):
+        # `attend` on tiles of queries, with at most `ATTENTION_TILE_MB` of scores at once (plus the returned ones)
+        rows = max(1, int(ATTENTION_TILE_MB * 2**20) // (q.shape[0] * k.shape[1] * q.element_size()))
+        if q.shape[1] <= rows:
+            return self.attend(q, k, v, mask)
+        out = q.new_empty(q.shape[0], q.shape[1], v.shape[-1])
+        attn = q.new_empty(q.shape[0], q.shape[1], k.shape[1]) if return_score else None
+        for i in range(0, q.shape[1], rows):
+            mask_ = mask[:, i:i + rows] if exists(mask) and mask.shape[1] > 1 else mask
+            out[:, i:i + rows], attn_ = self.attend(q[:, i:i + rows], k, v, mask_)
+            if return_score:
+                attn[:, i:i + rows] = attn_
+        return out, attn
+
     def forward(self, x, context = None, mask = None, return_score=False):
         h = self.heads
 
@@ -90,22 +134,21 @@ class Attention(nn.Module):
 
         q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> (b h) n d', h = h), (q, k, v))
 
-        sim = einsum('b i d, b j d -> b i j', q, k) * self.scale
-        sim = sim.nan_to_num()
-
         if exists(mask):
             # mask = rearrange(mask, 'b ... -> b (...)')
             if len(mask.shape) == 2:
                 mask = repeat(mask, 'b j -> (b h) () j', h = h)
             else:
                 mask = repeat(mask, 'b ... -> (b h) ...', h = h)
-            max_neg_value = -torch.finfo(sim.dtype).max
-            sim.masked_fill_(~mask, max_neg_value)
 
-        # attention, what we cannot get enough of
-        attn = sim.softmax(dim = -1)
+        backend = default(self.backend, _attention_backend)
+        if backend == 'sdpa' and not return_score:  # the fused kernels do not output the scores
+            out, attn = self.attend_sdpa(q, k, v, mask), None
+        elif backend == 'tiled':
+            out, attn = self.attend_tiled(q, k, v, mask, return_score)
+        else:
+            out, attn = self.attend(q, k, v, mask)
 
-        out = einsum('b i j, b j d -> b i d', attn, v)
         out = rearrange(out, '(b h) n d -> b n (h d)', h = h)
         out = self.drop_path(self.to_out(out))
         if return_score:
@@ -113,6 +156,24 @@ class Attention(nn.Module):
         return out
 
 
+def set_attention_backend(backend, module = None):
+    """
+    'einsum': full score matrix, the reference
+    'sdpa': `F.scaled_dot_product_attention`, fused kernels without the full score matrix (einsum for `return_score`)
+    'tiled': einsum on tiles of queries, bounded memory (see `ATTENTION_TILE_MB`)
+    Sets the backend of the `Attention` layers of `module` (None to follow the global one), or the global one.
+    Also set by the `ATTENTION_BACKEND` env variable.
+    """
+    global _attention_backend
+    assert backend in ATTENTION_BACKENDS or (backend is None and exists(module)), f'Unknown attention backend: {backend}'
+    if exists(module):
+        for m in module.modules():
+            if isinstance(m, Attention):
+                m.backend = backend
+    else:
+        _attention_backend = backend
+
+
 class PointEmbed(nn.Module):
     def __init__(self, hidden_dim=48, dim=128):
         super().__init__()
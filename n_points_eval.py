@@ -0,0 +1,98 @@
+"""Latency & accuracy of the coarse joints pass (`INFER_N_COARSE`) per number of input points, against `app.N`
+
+Samples `app.N` points on every input as `app.load_input`, normalizes them as `app.preprocess`, then runs
+`model_coarse` on subsets of them (`app.subsample_points`) and reports per point count:
+    - joints error: mean distance of the joints' heads and tails to those from `app.N` points, in the normalized space
+    - hips error: geodesic angle (degrees) between the Hips transforms (`get_hips_transform`) used by `preprocess`
+    - milliseconds of FPS + encoder + decoder, and the speedup
+Usage:
+    python n_points_eval.py [inputs or directories ...] [--counts 2048,4096,8192,16384,32768]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+import app
+from quantize_eval import list_inputs
+from util.dataset_mixamo import BONES_IDX_DICT, MIXAMO_PREFIX, get_hips_transform
+from util.utils import get_normalize_transform
+
+
+@torch.no_grad()
+def forward(pts: torch.Tensor, seed: int, repeat: int) -> tuple[torch.Tensor, float]:
+    """`model_coarse` without the memo of `app.shared_encoder`
+    Returns:
+        joints [1, J, 6], milliseconds
+    """
+    pts = pts.to(app.device)
+    times = []
+    for _ in range(repeat + 1):  # + warmup
+        torch.manual_seed(seed)  # FPS starts at a random point
+        start = time.perf_counter()
+        joints = app.model_coarse.query(app.model_coarse.encode_context(pts)).joints
+        if app.device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return joints.cpu(), np.mean(times[1:]) * 1000
+
+
+def hips_transform(joints: torch.Tensor) -> torch.Tensor:
+    names = ("Hips", "RightUpLeg", "LeftUpLeg")
+    return get_hips_transform(*(joints[:, BONES_IDX_DICT[f"{MIXAMO_PREFIX}{k}"], :3] for k in names))[..., :3, :3]
+
+
+def errors(ref: torch.Tensor, joints: torch.Tensor) -> dict:
+    joints_err = (joints.reshape(-1, 3) - ref.reshape(-1, 3)).norm(dim=-1).mean().item()
+    rot_ref, rot = hips_transform(ref), hips_transform(joints)
+    cos = ((rot.transpose(-1, -2) @ rot_ref).diagonal(dim1=-2, dim2=-1).sum(-1) - 1) / 2
+    return {"joints": joints_err, "hips_deg": torch.rad2deg(torch.acos(cos.clamp(-1, 1))).mean().item()}
+
+
+def main(args):
+    input_paths = list_inputs(args.inputs)
+    counts = sorted(int(x) for x in args.counts.split(","))
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    app.init_models()  # changes the working directory
+    results = {n: [] for n in counts}
+    for input_path in input_paths:
+        np.random.seed(args.seed)
+        is_gs = args.gs and input_path.endswith(".ply")
+        pts = app.load_input(input_path, is_gs, args.opacity_threshold, app.N)["pts"]
+        pts = get_normalize_transform(pts, keep_ratio=True, recenter=True).transform_points(pts)
+        ref, t_ref = forward(pts, args.seed, args.repeat)
+        for n in counts:
+            joints, t = forward(app.subsample_points(pts, n), args.seed, args.repeat)
+            results[n].append({**errors(ref, joints), "ms": t, "speedup": t_ref / t})
+            print(
+                f"[{os.path.basename(input_path)}] N={n} | joints: {results[n][-1]['joints']:.4f} | "
+                f"hips: {results[n][-1]['hips_deg']:.2f} deg | {t:.1f} ms | speedup: {t_ref / t:.2f}x"
+            )
+
+    for n, rs in results.items():
+        mean = {k: np.mean([r[k] for r in rs]) for k in rs[0]}
+        print(
+            f"[mean] N={n} | joints: {mean['joints']:.4f} | hips: {mean['hips_deg']:.2f} deg | "
+            f"{mean['ms']:.1f} ms | speedup: {mean['speedup']:.2f}x"
+        )
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["data/examples"], help="Input files, or directories of .glb")
+    parser.add_argument("--counts", default="2048,4096,8192,16384,32768", type=str, help="Numbers of input points")
+    parser.add_argument("--gs", default=False, action="store_true", help="`.ply` inputs are Gaussian Splats")
+    parser.add_argument("--opacity_threshold", default=0.01, type=float)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--threads", default=0, type=int, help="torch CPU threads, 0 for the default")
+    parser.add_argument("--seed", default=0, type=int)
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
@@ -0,0 +1,125 @@
+"""Pipeline as a DAG of stages, each one memoized by the hash of its options and upstream stages
+
+A stage reads and writes fields of a state object (the `DB` of `app.py`). Its declared `outputs` are the fields it
+writes, which are snapshotted after it runs, so that a later run only re-executes the stages downstream of a changed
+option and restores the others. `persistent` stages are also cached across sessions in a `RigCache`.
+Snapshots hold references to the outputs, treated as read-only. Only the fields that a downstream stage declares in
+its `mutates` (modified in place) are copied, when snapshotted and when restored.
+"""
+
+import copy
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from rig_cache import RigCache, cache_key
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    fn: Callable[[dict, Any], dict]  # fn(options, db) -> Gradio outputs
+    outputs_fn: Callable[[Any], dict]  # outputs_fn(db) -> Gradio outputs of a skipped stage
+    options: tuple[str, ...] = ()  # pipeline options the stage depends on
+    deps: tuple[str, ...] = ()  # upstream stages
+    outputs: tuple[str, ...] = ()  # fields of `db` written by `fn`
+    files: tuple[str, ...] = ()  # fields of `db` holding the paths of the files written by `fn`
+    version: Callable[[], Any] = None  # anything else the results depend on, e.g. model checkpoints
+    setup: Callable[[dict, Any], None] = None  # called before the stage runs or is restored from the cache
+    mutates: tuple[str, ...] = ()  # fields of `db` written by upstream stages that `fn` modifies in place
+    persistent: bool = False
+
+
+class StagePipeline:
+    def __init__(self, stages: list[Stage], cache: RigCache = None):
+        self.stages = list(stages)
+        self.cache = cache
+        self.upstream: dict[str, list[str]] = {}  # transitive dependencies, in execution order
+        for stage in self.stages:
+            assert all(dep in self.upstream for dep in stage.deps), f"Stage '{stage.name}' is before its dependencies"
+            closure = set(stage.deps).union(*(self.upstream[dep] for dep in stage.deps))
+            self.upstream[stage.name] = [s for s in self.upstream if s in closure]
+        self.by_name = {stage.name: stage for stage in self.stages}
+        # Outputs of every stage that are modified in place downstream, copied instead of shared
+        self.copied: dict[str, set[str]] = {stage.name: set() for stage in self.stages}
+        for stage in self.stages:
+            for name in self.upstream[stage.name]:
+                self.copied[name].update(set(stage.mutates) & set(self.by_name[name].outputs))
+
+    def _snapshot(self, name: str, outputs: dict) -> dict:
+        return {k: copy.deepcopy(v) if k in self.copied[name] else v for k, v in outputs.items()}
+
+    def keys(self, options: dict) -> dict[str, str]:
+        keys = {}
+        for stage in self.stages:
+            keys[stage.name] = cache_key(
+                stage.name,
+                [keys[dep] for dep in stage.deps],
+                {k: options[k] for k in stage.options},
+                None if stage.version is None else stage.version(),
+            )
+        return keys
+
+    def _save(self, stage: Stage, keys: dict[str, str], memo: dict, db):
+        memo[stage.name] = (keys[stage.name], self._snapshot(stage.name, {k: getattr(db, k) for k in stage.outputs}))
+        if stage.persistent and self.cache is not None:
+            names = self.upstream[stage.name] + [stage.name]
+            files = {}
+            for name in names:
+                for k in self.by_name[name].files:
+                    with open(getattr(db, k), "rb") as f:
+                        files[k] = f.read()
+            self.cache.put(keys[stage.name], {"outputs": {name: memo[name][1] for name in names}, "files": files})
+
+    def run(self, options: dict, db, until: str = None):
+        """Generator of the Gradio outputs of every stage, running only the stages whose key changed.
+        The memo lives in `db.stages`.
+
+        Args:
+            until: name of the last stage to run, None for all of them
+        """
+        keys = self.keys(options)
+        memo: dict[str, tuple[str, dict]] = dict(db.stages or {})
+        dirty = [stage.name for stage in self.stages if memo.get(stage.name, (None,))[0] != keys[stage.name]]
+        for name in dirty:
+            memo.pop(name, None)
+            if self.by_name[name].setup is not None:
+                self.by_name[name].setup(options, db)
+        db.stages = memo
+        rebuild = bool(dirty)  # otherwise `db` already holds the results of every stage
+
+        # Restore the last dirty persistent stage (and its upstream stages) found in the cache
+        for name in reversed(dirty):
+            if not self.by_name[name].persistent or self.cache is None:
+                continue
+            cached = self.cache.get(keys[name])
+            if cached is None:
+                continue
+            print(f"Restored stage '{name}' from cache")
+            for k, data in cached["files"].items():
+                with open(getattr(db, k), "wb") as f:
+                    f.write(data)
+            for upstream_name, outputs in cached["outputs"].items():
+                memo[upstream_name] = (keys[upstream_name], outputs)
+            dirty = [x for x in dirty if x not in cached["outputs"]]
+            break
+
+        for stage in self.stages:
+            if stage.name in dirty:
+                outputs = stage.fn(options, db)
+                self._save(stage, keys, memo, db)
+            else:
+                if rebuild:  # copies of the fields that later stages modify in place
+                    for k, v in self._snapshot(stage.name, memo[stage.name][1]).items():
+                        setattr(db, k, v)
+                outputs = stage.outputs_fn(db)
+            db.stages = memo
+            yield outputs
+            if stage.name == until:
+                break
+
+    def invalidate(self, db, name: str):
+        """Forget the memoized results of stage `name` and the stages downstream of it (e.g. after running it alone)"""
+        if db.stages:
+            for stage in self.stages:
+                if stage.name == name or name in self.upstream[stage.name]:
+                    db.stages.pop(stage.name, None)
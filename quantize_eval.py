@@ -0,0 +1,128 @@
+"""Accuracy & speed of the int8 dynamic-quantized models (`INFER_QUANTIZE`) against fp32, on a fixed set of inputs
+
+Runs `preprocess` + `infer` of `app.py` on every input, once with the fp32 models and once with the quantized ones,
+from the same sampled points and random seed, and reports per input:
+    - bone weights L1: mean over the vertices of sum_k |bw_int8 - bw_fp32| (between 0 and 2)
+    - joints error: mean distance of the joints' heads and tails, in the normalized space of `infer`
+    - pose error: mean geodesic angle (degrees) between the predicted rest-pose rotations
+Exits with 1 if the mean errors exceed the given thresholds.
+Usage:
+    python quantize_eval.py [inputs or directories ...] [--quantize all] [--exclude pose]
+"""
+
+import argparse
+import copy
+import os
+import shutil
+import sys
+import time
+from glob import glob
+
+import numpy as np
+import torch
+
+import app
+from util.utils import ortho6d_to_matrix
+
+
+def list_inputs(inputs: list[str]) -> list[str]:
+    """Input files, and the `.glb` files of the input directories, resolved as `app.py` does and deduplicated"""
+    input_paths = []
+    for path in inputs:
+        input_paths += sorted(glob(os.path.join(path, "*.glb"))) if os.path.isdir(path) else [path]
+    input_paths = list(dict.fromkeys(app.resolve_input_path(os.path.abspath(path)) for path in input_paths))
+    assert input_paths, f"No inputs found in {inputs}"
+    return input_paths
+
+
+def run(loaded: dict, input_path: str, is_gs: bool, seed: int, input_normal=False) -> tuple[dict, float]:
+    """`preprocess` + `infer` from the outputs of `app.load_input`
+    Returns:
+        bw, joints & pose, seconds
+    """
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    db = app.DB()
+    app.prepare_input(input_path, is_gs, db=db, export_temp=True, loaded=copy.deepcopy(loaded))
+    try:
+        start = time.perf_counter()
+        app.preprocess(db)
+        app.infer(input_normal, db)
+        duration = time.perf_counter() - start
+        return {"bw": db.bw, "joints": db.joints, "pose": db.pose}, duration
+    finally:
+        shutil.rmtree(db.output_dir, ignore_errors=True)
+        app.clear(db)
+
+
+def errors(ref: dict, out: dict) -> dict:
+    bw_l1 = (out["bw"] - ref["bw"]).abs().sum(-1).mean().item()
+    joints_ref, joints = ref["joints"].reshape(-1, 3), out["joints"].reshape(-1, 3)  # heads & tails
+    joints_err = (joints - joints_ref).norm(dim=-1).mean().item()
+    rot_ref, rot = ortho6d_to_matrix(ref["pose"][..., :6]), ortho6d_to_matrix(out["pose"][..., :6])
+    cos = ((rot.transpose(-1, -2) @ rot_ref).diagonal(dim1=-2, dim2=-1).sum(-1) - 1) / 2
+    pose_deg = torch.rad2deg(torch.acos(cos.clamp(-1, 1))).mean().item()
+    return {"bw_l1": bw_l1, "joints": joints_err, "pose_deg": pose_deg}
+
+
+def main(args):
+    input_paths = list_inputs(args.inputs)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    os.environ["INFER_QUANTIZE"] = ""
+    app.init_models()  # changes the working directory
+    app.init_blocks()  # the stages return Gradio outputs keyed by the components
+    inputs, refs, t_refs = {}, {}, {}
+    for input_path in input_paths:
+        is_gs = args.gs and input_path.endswith(".ply")
+        inputs[input_path] = (app.load_input(input_path, is_gs, args.opacity_threshold, app.N), is_gs)
+        run(inputs[input_path][0], input_path, is_gs, args.seed)  # warmup
+        refs[input_path], t_refs[input_path] = run(inputs[input_path][0], input_path, is_gs, args.seed)
+
+    os.environ["INFER_QUANTIZE"] = args.quantize
+    os.environ["INFER_QUANTIZE_EXCLUDE"] = args.exclude
+    app.init_models()
+    results, t_outs = [], {}
+    for input_path in input_paths:
+        loaded, is_gs = inputs[input_path]
+        run(loaded, input_path, is_gs, args.seed)  # warmup
+        out, t_outs[input_path] = run(loaded, input_path, is_gs, args.seed)
+        results.append(errors(refs[input_path], out))
+        print(
+            f"[{os.path.basename(input_path)}] bw L1: {results[-1]['bw_l1']:.4f} | "
+            f"joints: {results[-1]['joints']:.4f} | pose: {results[-1]['pose_deg']:.2f} deg | "
+            f"fp32: {t_refs[input_path]:.2f} s | int8: {t_outs[input_path]:.2f} s | "
+            f"speedup: {t_refs[input_path] / t_outs[input_path]:.2f}x"
+        )
+
+    mean = {k: np.mean([r[k] for r in results]) for k in results[0]}
+    print(
+        f"[mean] quantize={args.quantize!r} exclude={args.exclude!r} | bw L1: {mean['bw_l1']:.4f} | "
+        f"joints: {mean['joints']:.4f} | pose: {mean['pose_deg']:.2f} deg | "
+        f"speedup: {sum(t_refs.values()) / sum(t_outs.values()):.2f}x"
+    )
+    thresholds = {"bw_l1": args.max_bw_l1, "joints": args.max_joints, "pose_deg": args.max_pose_deg}
+    failed = [k for k, v in thresholds.items() if mean[k] > v]
+    if failed:
+        print(f"Accuracy guardrails exceeded: {', '.join(f'{k}={mean[k]:.4f} > {thresholds[k]}' for k in failed)}")
+        sys.exit(1)
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["data/examples"], help="Input files, or directories of .glb")
+    parser.add_argument("--quantize", default="all", type=str, help="Models to quantize, as `INFER_QUANTIZE`")
+    parser.add_argument("--exclude", default="", type=str, help="Models kept in fp32, as `INFER_QUANTIZE_EXCLUDE`")
+    parser.add_argument("--gs", default=False, action="store_true", help="`.ply` inputs are Gaussian Splats")
+    parser.add_argument("--opacity_threshold", default=0.01, type=float)
+    parser.add_argument("--threads", default=0, type=int, help="torch CPU threads, 0 for the default")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--max_bw_l1", default=0.05, type=float)
+    parser.add_argument("--max_joints", default=0.01, type=float)
+    parser.add_argument("--max_pose_deg", default=3.0, type=float)
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
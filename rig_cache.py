@@ -0,0 +1,233 @@
+"""Content-addressed cache of the pipeline results, in memory and on disk, both size-bounded LRU
+
+Disk entries are handoff files (`handoff.py`): arrays, meshes and a JSON tree of the other values, never pickles, so
+reading an entry cannot run code. Other types are stored through the codecs of `register_type`.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+import numpy as np
+import torch
+import trimesh
+
+from handoff import load_handoff, save_handoff
+
+CACHE_SUFFIX = ".rig"
+# type -> (name, to_state, from_state), see `register_type`
+CODECS: dict[type, tuple[str, Callable, Callable]] = {}
+
+
+def file_digest(path: str, block_size=2**20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(*parts) -> str:
+    """Digest of JSON-serializable `parts` (e.g. file digests, options, checkpoint fingerprints)"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def nbytes(value, seen: set = None) -> int:
+    """Approximate size of the arrays held by `value`"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(nbytes(v, seen) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v, seen) for v in value)
+    if hasattr(value, "__dict__"):
+        return sum(nbytes(v, seen) for v in vars(value).values())
+    return 0
+
+
+def register_type(cls: type, to_state: Callable, from_state: Callable, name: str = None):
+    """Store the instances of `cls` on disk as `to_state(x)` (any value supported by `encode`), restored by
+    `from_state(state)`
+    """
+    CODECS[cls] = (name or cls.__name__, to_state, from_state)
+
+
+def encode(value, arrays: dict) -> Any:
+    """JSON tree of `value`, its arrays and meshes moved into `arrays` (the values of a handoff file)
+
+    Raises:
+        TypeError: for types neither built-in nor registered
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    key = str(len(arrays))
+    if isinstance(value, torch.Tensor):
+        arrays[key] = value.detach().cpu().numpy()
+        return {"tensor": key}
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        arrays[key] = value
+        return {"ndarray": key}
+    if isinstance(value, bytes):
+        arrays[key] = np.frombuffer(value, dtype=np.uint8)
+        return {"bytes": key}
+    if isinstance(value, (trimesh.Trimesh, trimesh.PointCloud)):
+        arrays[key] = value
+        return {"mesh": key}
+    if type(value) in CODECS:
+        name, to_state, _ = CODECS[type(value)]
+        return {"type": [name, encode(to_state(value), arrays)]}
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {"dict": {k: encode(v, arrays) for k, v in value.items()}}
+    if type(value) in (list, tuple):
+        return {type(value).__name__: [encode(v, arrays) for v in value]}
+    raise TypeError(f"Cannot store values of type {type(value).__name__} in the rig cache")
+
+
+def decode(tree, arrays: dict):
+    """Inverse of `encode`, the arrays are copied"""
+    if not isinstance(tree, dict):
+        return tree
+    ((tag, x),) = tree.items()
+    if tag == "tensor":
+        return torch.from_numpy(np.array(arrays[x]))
+    if tag == "ndarray":
+        return np.array(arrays[x])
+    if tag == "bytes":
+        return arrays[x].tobytes()
+    if tag == "mesh":
+        return arrays[x]
+    if tag == "type":
+        from_state = {name: from_state for name, _, from_state in CODECS.values()}[x[0]]
+        return from_state(decode(x[1], arrays))
+    if tag == "dict":
+        return {k: decode(v, arrays) for k, v in x.items()}
+    if tag in ("list", "tuple"):
+        return (list if tag == "list" else tuple)(decode(v, arrays) for v in x)
+    raise ValueError(f"Unknown tag in a rig cache entry: {tag}")
+
+
+def private_dir(path: str) -> bool:
+    """Create the directory `path` with mode 0700 if missing. Returns whether only the current user can write to it,
+    i.e. whether its files can be trusted
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    stat = os.stat(path)
+    return not (stat.st_mode & 0o022 or stat.st_uid != os.getuid())
+
+
+class RigCache:
+    def __init__(self, cache_dir: str = None, max_disk_bytes=2 * 2**30, max_memory_bytes=512 * 2**20):
+        """
+        Args:
+            cache_dir: None to only cache in memory
+            max_disk_bytes, max_memory_bytes: 0 to disable the corresponding level
+        """
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes if cache_dir else 0
+        self.max_memory_bytes = max_memory_bytes
+        self.lock = threading.Lock()
+        self.memory: OrderedDict[str, tuple[int, dict]] = OrderedDict()
+        self.memory_bytes = 0
+        if self.max_disk_bytes > 0:
+            if not private_dir(self.cache_dir):
+                print(f"Rig cache directory '{self.cache_dir}' is writable by other users, caching in memory only")
+                self.max_disk_bytes = 0
+
+    @classmethod
+    def from_env(cls):
+        """Configured by `RIG_CACHE_DIR` (empty, the default, for memory only; a private directory, created with
+        mode 0700), `RIG_CACHE_DISK_MB` and `RIG_CACHE_MEMORY_MB`
+        """
+        return cls(
+            os.getenv("RIG_CACHE_DIR", ""),
+            max_disk_bytes=int(float(os.getenv("RIG_CACHE_DISK_MB", 2048)) * 2**20),
+            max_memory_bytes=int(float(os.getenv("RIG_CACHE_MEMORY_MB", 512)) * 2**20),
+        )
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, f"{key}{CACHE_SUFFIX}")
+
+    def get(self, key: str) -> dict | None:
+        """Returns a copy of the cached value (safe to modify), or None"""
+        with self.lock:
+            hit = self.memory.get(key)
+            if hit is not None:
+                self.memory.move_to_end(key)
+                return copy.deepcopy(hit[1])
+        if self.max_disk_bytes <= 0 or not os.path.isfile(self._path(key)):
+            return None
+        try:
+            data = load_handoff(self._path(key))
+            value = decode(data.pop("tree"), data)
+            os.utime(self._path(key))  # mtime as LRU order
+        except Exception as e:
+            print(f"Failed to load cache entry {key}: {e}")
+            return None
+        self._put_memory(key, copy.deepcopy(value))
+        return value
+
+    def put(self, key: str, value: dict):
+        """Store a copy of `value`"""
+        value = copy.deepcopy(value)
+        if self.max_disk_bytes > 0:
+            arrays = {}
+            try:
+                tree = encode(value, arrays)
+            except TypeError as e:
+                print(f"Not caching {key} on disk: {e}")
+            else:
+                tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+                save_handoff(tmp_path, {**arrays, "tree": tree})
+                os.replace(tmp_path, self._path(key))
+                self._evict_disk()
+        self._put_memory(key, value)
+
+    def _put_memory(self, key: str, value: dict):
+        size = nbytes(value)
+        if size > self.max_memory_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= self.memory.pop(key)[0]
+            self.memory[key] = (size, value)
+            self.memory_bytes += size
+            while self.memory_bytes > self.max_memory_bytes:
+                self.memory_bytes -= self.memory.popitem(last=False)[1][0]
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
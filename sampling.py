@@ -0,0 +1,156 @@
+"""Surface sampling of triangle meshes with cached face tables, reused by every draw on the same mesh
+
+`MeshSampler` computes the face areas, their CDF and the face normals once. A similarity transform (rotation,
+translation, uniform scale) scales all the areas by the same factor, so `MeshSampler.transformed` shares the tables
+and only maps the drawn points. Draws are vectorized over the faces (CDF search + barycentric coordinates) and
+follow the layout of `util.utils.sample_mesh`: uniform points first, then the attention points around the centers,
+then the geodesic ones, with the face normals appended when requested.
+"""
+
+import time
+import weakref
+
+import numpy as np
+import trimesh
+
+
+class MeshSampler:
+    """
+    Args:
+        vertices: [V, 3]
+        faces: [F, 3]
+        transform: [4, 4] applied to the drawn points (row vectors, `p @ transform[:3, :3] + transform[3, :3]`,
+            as `pytorch3d.transforms.Transform3d.get_matrix`), a similarity
+    """
+
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray, transform: np.ndarray = None):
+        start = time.perf_counter()
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        self.faces = np.asarray(faces, dtype=np.int64)
+        triangles = self.vertices[self.faces]
+        cross = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        norm = np.linalg.norm(cross, axis=-1)
+        self.face_normals = cross / np.maximum(norm, 1e-12)[:, None]
+        self.cdf = np.cumsum(norm)  # twice the areas
+        assert self.cdf[-1] > 0, "Degenerate mesh without area"
+        self.transform = None if transform is None else np.asarray(transform, dtype=np.float64)
+        self._geodesic_solver = None
+        self.source: weakref.ref = None  # mesh the sampler was built from, see `is_sampler_of`
+        print(f"Mesh sampler of {len(self.faces)} faces built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    @classmethod
+    def from_trimesh(cls, mesh: trimesh.Trimesh):
+        sampler = cls(mesh.vertices, mesh.faces)
+        sampler.source = weakref.ref(mesh)
+        return sampler
+
+    def is_sampler_of(self, mesh: trimesh.Trimesh) -> bool:
+        """Whether built by `from_trimesh` from this very object (copies of it, e.g. restored from a cache, are not)"""
+        return self.source is not None and self.source() is mesh
+
+    def transformed(self, transform: np.ndarray) -> "MeshSampler":
+        """Sampler of the mesh transformed by `transform` (similarity, same convention as `self.transform`),
+        sharing the tables of this one
+        """
+        sampler = object.__new__(MeshSampler)
+        sampler.__dict__.update(self.__dict__)
+        transform = np.asarray(transform, dtype=np.float64)
+        sampler.transform = transform if self.transform is None else self.transform @ transform
+        return sampler
+
+    def _to_world(self, points: np.ndarray, normals: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        if self.transform is None:
+            return points, normals
+        points = points @ self.transform[:3, :3] + self.transform[3, :3]
+        if normals is not None:
+            normals = normals @ np.linalg.inv(self.transform[:3, :3]).T
+            normals = normals / np.maximum(np.linalg.norm(normals, axis=-1, keepdims=True), 1e-12)
+        return points, normals
+
+    def _to_local(self, points: np.ndarray) -> np.ndarray:
+        if self.transform is None:
+            return points
+        return (points - self.transform[3, :3]) @ np.linalg.inv(self.transform[:3, :3])
+
+    def draw(self, n: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Uniform points on the surface, in the coordinates of the untransformed mesh
+        Returns:
+            points [n, 3], face indices [n], barycentric coordinates [n, 3]
+        """
+        face_idx = np.searchsorted(self.cdf, np.random.random(n) * self.cdf[-1], side="right")
+        face_idx = np.minimum(face_idx, len(self.faces) - 1)
+        r1, r2 = np.sqrt(np.random.random(n)), np.random.random(n)
+        bary = np.stack([1 - r1, r1 * (1 - r2), r1 * r2], axis=-1)
+        points = np.einsum("nk,nkd->nd", bary, self.vertices[self.faces[face_idx]])
+        return points, face_idx, bary
+
+    def _nearest(self, n: int, distances_fn, oversample: int) -> tuple[np.ndarray, np.ndarray]:
+        """`n` points among `oversample` times as many uniform ones with the smallest `distances_fn(points, faces,
+        barycentric)` [n * oversample, C], split evenly between the C centers
+        """
+        points, face_idx, bary = self.draw(n * oversample)
+        distances = distances_fn(points, face_idx, bary)
+        counts = [len(x) for x in np.array_split(np.arange(n), distances.shape[-1])]
+        keep = np.concatenate(
+            [np.argpartition(distances[:, i], count - 1)[:count] for i, count in enumerate(counts) if count > 0]
+        )
+        return points[keep], face_idx[keep]
+
+    def geodesic_distances(self, centers: np.ndarray) -> np.ndarray:
+        """[V, C] geodesic distances of the vertices to the vertices closest to `centers` (local coordinates),
+        with the heat method of `potpourri3d`, whose solver is built once
+        """
+        if self._geodesic_solver is None:
+            import potpourri3d as pp3d
+
+            self._geodesic_solver = pp3d.MeshHeatMethodDistanceSolver(self.vertices, self.faces)
+        sources = np.linalg.norm(self.vertices[:, None] - centers[None], axis=-1).argmin(0)
+        return np.stack([self._geodesic_solver.compute_distance(int(i)) for i in sources], axis=-1)
+
+    def sample(
+        self,
+        n: int,
+        get_normals=False,
+        attn_ratio=0.0,
+        attn_centers: list[np.ndarray] = None,
+        attn_geo_ratio=0.0,
+        oversample=16,
+    ) -> np.ndarray:
+        """Same as `util.utils.sample_mesh`
+        Args:
+            attn_ratio: share of the points drawn around `attn_centers` (e.g. the hands), the nearest ones among
+                `oversample` times as many uniform points
+            attn_geo_ratio: share of the points drawn the same way but by geodesic distance
+        Returns:
+            [n, 3], or [n, 6] with the normals
+        """
+        start = time.perf_counter()
+        n_attn = int(n * attn_ratio) if attn_centers else 0
+        n_geo = int(n * attn_geo_ratio) if attn_centers else 0
+        points, face_idx, _ = self.draw(n - n_attn - n_geo)
+        points, face_idx = [points], [face_idx]
+        if n_attn > 0 or n_geo > 0:
+            centers = self._to_local(np.asarray(attn_centers, dtype=np.float64).reshape(-1, 3))
+        if n_attn > 0:
+
+            def euclidean(p: np.ndarray, f: np.ndarray, b: np.ndarray):
+                return np.linalg.norm(p[:, None] - centers[None], axis=-1)
+
+            p, f = self._nearest(n_attn, euclidean, oversample)
+            points.append(p)
+            face_idx.append(f)
+        if n_geo > 0:
+            vertex_distances = self.geodesic_distances(centers)
+
+            def geodesic(p: np.ndarray, f: np.ndarray, b: np.ndarray):
+                return np.einsum("nk,nkc->nc", b, vertex_distances[self.faces[f]])
+
+            p, f = self._nearest(n_geo, geodesic, oversample)
+            points.append(p)
+            face_idx.append(f)
+        points, face_idx = np.concatenate(points), np.concatenate(face_idx)
+        points, normals = self._to_world(points, self.face_normals[face_idx] if get_normals else None)
+        out = np.concatenate([points, normals], axis=-1) if get_normals else points
+        duration = (time.perf_counter() - start) * 1000
+        print(f"Sampled {n} points ({n_attn} attention, {n_geo} geodesic) in {duration:.1f} ms")
+        return out
@@ -0,0 +1,219 @@
+from typing import Callable, NamedTuple
+
+import numpy as np
+import torch
+
+# Top-k skinning weights: `weights[..., n, j]` of bone `indices[..., n, j]` (zero-weight slots point to any bone).
+# All functions below also accept dense [..., N, K] weights, as torch tensors or numpy arrays.
+SparseWeights = NamedTuple(
+    "SparseWeights",
+    [("indices", torch.Tensor | np.ndarray), ("weights", torch.Tensor | np.ndarray), ("num_bones", int)],
+)
+Weights = torch.Tensor | np.ndarray | SparseWeights
+
+
+def to_sparse(bw: torch.Tensor | np.ndarray, k=4) -> SparseWeights:
+    """
+    Args:
+        bw: [..., N, K], with at most `k` nonzero weights per point (otherwise only the top-k are kept)
+    Returns:
+        `SparseWeights` with int16 indices [..., N, k] and weights [..., N, k]
+    """
+    if isinstance(bw, SparseWeights):
+        return bw
+    if isinstance(bw, torch.Tensor):
+        weights, indices = torch.topk(bw, k=k, dim=-1, sorted=True)
+        return SparseWeights(indices.to(torch.int16), weights, bw.shape[-1])
+    indices = np.argsort(-bw, axis=-1, kind="stable")[..., :k]
+    return SparseWeights(indices.astype(np.int16), np.take_along_axis(bw, indices, axis=-1), bw.shape[-1])
+
+
+def to_dense(bw: Weights) -> torch.Tensor | np.ndarray:
+    """
+    Returns:
+        [..., N, K]
+    """
+    if not isinstance(bw, SparseWeights):
+        return bw
+    indices, weights = bw.indices, bw.weights
+    if isinstance(weights, torch.Tensor):
+        dense = weights.new_zeros(*weights.shape[:-1], bw.num_bones)
+        return dense.scatter_add_(-1, indices.long(), weights)
+    k = weights.shape[-1]
+    dense = np.zeros((*weights.shape[:-1], bw.num_bones), dtype=weights.dtype)
+    rows = np.arange(dense.size // bw.num_bones)[:, None]
+    np.add.at(dense.reshape(-1, bw.num_bones), (rows, indices.reshape(-1, k)), weights.reshape(-1, k))
+    return dense
+
+
+def map_weights(bw: Weights, fn: Callable) -> Weights:
+    """Apply `fn` (e.g. device/dtype conversion, squeezing, repeating...) to every array of `bw`"""
+    if isinstance(bw, SparseWeights):
+        return SparseWeights(fn(bw.indices), fn(bw.weights), bw.num_bones)
+    return fn(bw)
+
+
+def repeat_weights(bw: Weights, repeats: int) -> Weights:
+    """Repeat every point `repeats` times (e.g. [N, K] -> [N * `repeats`, K])"""
+
+    def _repeat(x: torch.Tensor | np.ndarray):
+        if isinstance(x, torch.Tensor):
+            return x.repeat_interleave(repeats, dim=-2)
+        return x.repeat(repeats, axis=-2)
+
+    return map_weights(bw, _repeat)
+
+
+def bone_weights(bw: Weights, bone_index: int) -> torch.Tensor | np.ndarray:
+    """
+    Returns:
+        [..., N], weights of one bone
+    """
+    if not isinstance(bw, SparseWeights):
+        return bw[..., bone_index]
+    return (bw.weights * (bw.indices == bone_index)).sum(-1)
+
+
+def coalesce(bw: SparseWeights) -> SparseWeights:
+    """Merge the weights of duplicated bones of every point into the first slot"""
+    module = torch if isinstance(bw.weights, torch.Tensor) else np
+    indices, weights = bw.indices, module.where(bw.indices < 0, 0, bw.weights)
+    indices = module.where(indices < 0, 0, indices)
+    k = indices.shape[-1]
+    for i in range(k):
+        for j in range(i + 1, k):
+            dup = indices[..., j] == indices[..., i]
+            weights[..., i] += module.where(dup, weights[..., j], 0)
+            weights[..., j] = module.where(dup, 0, weights[..., j])
+    return SparseWeights(indices, weights, bw.num_bones)
+
+
+def remap_bones(bw: Weights, index_map: np.ndarray, num_bones: int) -> Weights:
+    """
+    Args:
+        index_map: [K], new index of every bone (several bones can be merged into one), -1 to drop the bone
+        num_bones: number of bones after remapping
+    """
+    if isinstance(bw, SparseWeights):
+        if isinstance(bw.indices, torch.Tensor):
+            index_map = torch.as_tensor(index_map, device=bw.indices.device)
+            indices = index_map[bw.indices.long()].to(torch.int16)
+        else:
+            indices = np.asarray(index_map)[bw.indices].astype(np.int16)
+        return coalesce(SparseWeights(indices, bw.weights, num_bones))
+
+    module = torch if isinstance(bw, torch.Tensor) else np
+    dense = module.zeros((*bw.shape[:-1], num_bones), dtype=bw.dtype)
+    if module is torch:
+        dense = dense.to(bw.device)
+    for i, j in enumerate(index_map):
+        if j >= 0:
+            dense[..., j] += bw[..., i]
+    return dense
+
+
+def reorganize_weights(bw: Weights, bones_idx_dict: dict[str, int], template_dict: dict[str, int]) -> Weights:
+    """Same as `app.reorganize_bone_data_(bw.T, bones_idx_dict, template_dict).T` for skinning weights"""
+    index_map = np.full(len(bones_idx_dict), -1)
+    for bone_name, i in bones_idx_dict.items():
+        if bone_name in template_dict:
+            index_map[i] = template_dict[bone_name]
+    return remap_bones(bw, index_map, len(template_dict))
+
+
+def blend_transforms(transforms: torch.Tensor | np.ndarray, bw: Weights) -> torch.Tensor | np.ndarray:
+    """Linear blend skinning transforms
+    Args:
+        transforms: [K, 4, 4]
+        bw: [N, K]
+    Returns:
+        [N, 4, 4]
+    """
+    module = torch if isinstance(transforms, torch.Tensor) else np
+    if not isinstance(bw, SparseWeights):
+        return module.einsum("kij,nk->nij", transforms, bw)
+    indices, weights = bw.indices, bw.weights
+    if module is torch:
+        indices = indices.long()
+        dtype = torch.promote_types(transforms.dtype, weights.dtype)
+        out = torch.zeros((indices.shape[0], *transforms.shape[1:]), dtype=dtype, device=transforms.device)
+    else:
+        out = np.zeros((indices.shape[0], *transforms.shape[1:]), dtype=np.result_type(transforms, weights))
+    for j in range(indices.shape[-1]):
+        out += weights[:, j, None, None] * transforms[indices[:, j]]
+    return out
+
+
+def lbs_points(
+    points: torch.Tensor | np.ndarray,
+    transforms: torch.Tensor | np.ndarray,
+    bw: Weights,
+    out: torch.Tensor | np.ndarray = None,
+    chunk_size=65536,
+) -> torch.Tensor | np.ndarray:
+    """Linear blend skinning of points, chunked over points.
+    Only the top-k bones of `SparseWeights` are blended, and no [N, 4, 4] transform is materialized.
+    Args:
+        points: [N, 3]
+        transforms: [K, 4, 4], affine
+        bw: [N, K] or `SparseWeights`
+        out: [N, 3], output buffer (can be `points` itself)
+    Returns:
+        [N, 3], `blend_transforms(transforms, bw)` applied to `points`
+    """
+    module = torch if isinstance(points, torch.Tensor) else np
+    if out is None:
+        out = module.empty_like(points)
+    transforms = transforms[:, :3]  # K, 3, 4
+    for begin in range(0, points.shape[0], chunk_size):
+        chunk = slice(begin, begin + chunk_size)
+        p = points[chunk, :, None]  # n, 3, 1
+        bw_ = map_weights(bw, lambda x: x[chunk])
+        if isinstance(bw_, SparseWeights):
+            indices = bw_.indices.long() if module is torch else bw_.indices
+            p_new = 0
+            for j in range(indices.shape[-1]):
+                transform = transforms[indices[:, j]]  # n, 3, 4
+                p_new = p_new + bw_.weights[:, j, None] * ((transform[..., :3] @ p)[..., 0] + transform[..., 3])
+        else:
+            transform = module.einsum("kij,nk->nij", transforms, bw_)
+            p_new = (transform[..., :3] @ p)[..., 0] + transform[..., 3]
+        out[chunk] = p_new
+    return out
+
+
+def lbs_chunked(transform_fn: Callable, data, transforms: np.ndarray, bw: Weights, chunk_size=65536):
+    """Linear blend skinning of any per-point data (e.g. Gaussian splats), chunked over points
+    Args:
+        transform_fn: fn(data[chunk], [n, 4, 4] transforms) -> transformed data[chunk]
+        data: [N, ...]
+        transforms: [K, 4, 4]
+        bw: [N, K] or `SparseWeights`
+    Returns:
+        [N, ...], gathered into one buffer
+    """
+    out = None
+    for begin in range(0, len(data), chunk_size):
+        chunk = slice(begin, begin + chunk_size)
+        data_ = transform_fn(data[chunk], blend_transforms(transforms, map_weights(bw, lambda x: x[chunk])))
+        if out is None:
+            if isinstance(data_, torch.Tensor):
+                out = data_.new_empty((len(data), *data_.shape[1:]))
+            else:
+                out = np.empty((len(data), *data_.shape[1:]), dtype=data_.dtype)
+        out[chunk] = data_
+    return out
+
+
+def pack_weights(bw: Weights, key="bw") -> dict[str, np.ndarray]:
+    """Flatten `bw` into arrays, e.g. to be saved by `np.savez`"""
+    if isinstance(bw, SparseWeights):
+        return {f"{key}_indices": bw.indices, f"{key}_weights": bw.weights, f"{key}_num_bones": bw.num_bones}
+    return {key: bw}
+
+
+def unpack_weights(data: dict[str, np.ndarray], key="bw") -> Weights:
+    """Inverse of `pack_weights`"""
+    if key in data:
+        return data[key]
+    return SparseWeights(data[f"{key}_indices"], data[f"{key}_weights"], int(data[f"{key}_num_bones"]))
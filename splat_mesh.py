@@ -0,0 +1,77 @@
+"""Vectorized geometry & face attributes of the splat meshes of the 3DGS render addon (`__init__.py`)
+
+Every splat is a quad (4 vertices, 2 triangles) at z = its index, with its attributes repeated on both faces:
+`center`, `color` (SH DC color + opacity), `Vrk_1..6` (upper triangle of the 3D covariance) and `sorted_indices`,
+read by the `KIRI_3DGS_Render_GN` node group. No `bpy` here, the arrays are given to `foreach_set` as is.
+"""
+
+import numpy as np
+
+from plyfile import PlyData
+
+SH_0 = 0.28209479177387814
+# (row, column) of `Vrk_1..6` in the covariance
+VRK_INDEX = ((0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2))
+
+
+def load_splats(path: str) -> dict[str, np.ndarray]:
+    """Same values as `PlyInfo` of the addon
+    Returns:
+        center [N, 3], opacities [N], features_dc [N, 3], scales [N, 3], quats [N, 4]
+    """
+    vertex = PlyData.read(path)["vertex"]
+    columns = lambda *names: np.stack([np.asarray(vertex[name]) for name in names], axis=1)
+    center = columns("x", "y", "z")
+    log_opacities = np.asarray(vertex["opacity"]) if "opacity" in vertex else np.ones(len(center))
+    return dict(
+        center=center,
+        opacities=1 / (1 + np.exp(-log_opacities)),
+        features_dc=columns("f_dc_0", "f_dc_1", "f_dc_2"),
+        scales=np.exp(columns("scale_0", "scale_1", "scale_2")),
+        quats=columns("rot_0", "rot_1", "rot_2", "rot_3"),
+    )
+
+
+def rs_matrices(quats: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """[N, 3, 3] `RS_matrix` of the addon: rows of the rotation of the normalized `quats` scaled by `scales`"""
+    x, y, z, w = (quats / np.linalg.norm(quats, axis=-1, keepdims=True)).T
+    rotation = np.stack(
+        [
+            np.stack([1 - 2 * (z * z + w * w), 2 * (y * z + x * w), 2 * (y * w - x * z)], axis=-1),
+            np.stack([2 * (y * z - x * w), 1 - 2 * (y * y + w * w), 2 * (z * w + x * y)], axis=-1),
+            np.stack([2 * (y * w + x * z), 2 * (z * w - x * y), 1 - 2 * (y * y + z * z)], axis=-1),
+        ],
+        axis=1,
+    )
+    return scales[:, :, None] * rotation
+
+
+def covariances(quats: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """[N, 6] `Vrk_1..6`, from (RS)^T RS"""
+    rs = rs_matrices(quats, scales)
+    return np.stack([np.einsum("nj,nj->n", rs[:, :, i], rs[:, :, j]) for i, j in VRK_INDEX], axis=-1)
+
+
+def splat_quads(n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns:
+        vertices [4n, 3] float32, triangles [2n, 3] int32
+    """
+    corners = np.array([(-2.0, -2.0), (2.0, -2.0), (2.0, 2.0), (-2.0, 2.0)], dtype=np.float32)
+    vertices = np.empty((n, 4, 3), dtype=np.float32)
+    vertices[..., :2] = corners
+    vertices[..., 2] = np.arange(n, dtype=np.float32)[:, None]
+    triangles = np.arange(n, dtype=np.int32)[:, None, None] * 4 + np.array([[0, 1, 2], [0, 2, 3]], dtype=np.int32)
+    return vertices.reshape(-1, 3), triangles.reshape(-1, 3)
+
+
+def face_attributes(splats: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Flat float32/int32 attribute arrays of the 2N faces, as `foreach_set` takes them, keyed by attribute name"""
+    n = len(splats["center"])
+    per_face = lambda x: np.ascontiguousarray(np.repeat(x, 2, axis=0), dtype=np.float32).reshape(-1)
+    color = np.concatenate([splats["features_dc"] * SH_0 + 0.5, splats["opacities"].reshape(-1, 1)], axis=-1)
+    attributes = {"center": per_face(splats["center"]), "color": per_face(color)}
+    vrk = covariances(splats["quats"], splats["scales"])
+    attributes.update({f"Vrk_{i + 1}": per_face(vrk[:, i]) for i in range(len(VRK_INDEX))})
+    attributes["sorted_indices"] = np.repeat(np.arange(n, dtype=np.int32), 2)
+    return attributes
@@ -40,6 +40,7 @@ if __name__ == "__main__":
     vis_batch = 1
 
     N = 32768
+    CHUNK = 100000  # vertices decoded per pass; the shape itself is encoded only once
     hands_resample_ratio = 0.5
     geo_resample_ratio = 0.0
     hierarchical_ratio = hands_resample_ratio + geo_resample_ratio
@@ -124,7 +125,7 @@ if __name__ == "__main__":
 
         with torch.no_grad():
             # model.to_mesh(pts)[-1].export(os.path.join(data_dir, "test.ply"))
-            bw = model.forward(pts, verts).bw
+            bw = model.query(model.encode_context(pts), verts, chunk_size=CHUNK).bw
             pts, verts = pts[..., :3], verts[..., :3]
             joints = model_joints.forward(pts).joints
             joints_ = joints.clone() if model_pose.pose_input_joints else None